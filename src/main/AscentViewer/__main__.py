@@ -26,16 +26,59 @@ import sys
 from platform import system
 from signal import SIG_DFL, SIGINT, signal
 
-from PyQt5.QtGui import QFont  # may not be necessary
-from PyQt5.QtWidgets import QApplication
+# --profile-startup[=json|cprofile] [--profile-output=path]: time startup up to the first paint, print a report and exit.
+# (without --profile-output, the report goes to stdout along with everything else that gets printed)
+# this has to come before every other import, so that those can be timed too
+from lib import profiling
+from lib.profiling import profileMark, profileSpan, watchFirstPaint
+profiling.enableFromArgs(sys.argv[1:])
 
-from lib.ui.tab_widgets.about import *
-from lib.ui.tab_widgets.settings import *
-from lib.ui.tab_widgets.viewer import *
-from lib.ui.tab_widgets.welcome import *
-from lib.ui.themes.theme_loader import *
-from lib.ui.win.main import *
-from lib.ui.win.splash import *
+# --metrics[=path.jsonl]: record decode/scale latencies, cache hit rates and memory from the start (F12 shows them),
+# and append them to path when AscentViewer closes
+from lib import metrics
+metrics.enableFromArgs(sys.argv[1:])
+
+# python AscentViewer batch ...: headless batch conversion, no windows get made at all
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    from lib.batch import main as batchMain
+    sys.exit(batchMain(sys.argv[2:]))
+
+# if AscentViewer is already running, the paths just get handed to it. That only costs QtCore, QtNetwork and a
+# round trip over a local socket, instead of a whole startup. --new-instance (or profiling) skips this
+if __name__ == "__main__" and "--new-instance" not in sys.argv[1:] and profiling.profiler is None:
+    from lib.single_instance import forwardToRunningInstance
+    if forwardToRunningInstance([os.path.abspath(arg) for arg in sys.argv[1:] if not arg.startswith("-")]):
+        sys.exit(0)
+
+with profileSpan("import PyQt5"):
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QFont  # may not be necessary
+    from PyQt5.QtWidgets import QApplication, QFileDialog
+
+with profileSpan("import lib.image"):
+    from lib.assets import installPixmaps, preloadImages
+    from lib.image.loader import imageFileFilter, probeImage, readDisplayImage, readImage, tiledMinPixels
+    from lib.image.tiles import TILED_MIN_PIXELS
+    from lib.single_instance import InstanceServer
+    from lib.startup import StartupPipeline
+with profileSpan("import lib.ui.tab_widgets.about"):
+    from lib.ui.tab_widgets.about import *
+with profileSpan("import lib.ui.tab_widgets.compare"):
+    from lib.ui.tab_widgets.compare import *
+with profileSpan("import lib.ui.tab_widgets.duplicates"):
+    from lib.ui.tab_widgets.duplicates import *
+with profileSpan("import lib.ui.tab_widgets.settings"):
+    from lib.ui.tab_widgets.settings import *
+with profileSpan("import lib.ui.tab_widgets.viewer"):
+    from lib.ui.tab_widgets.viewer import *
+with profileSpan("import lib.ui.tab_widgets.welcome"):
+    from lib.ui.tab_widgets.welcome import *
+with profileSpan("import lib.ui.themes.theme_loader"):
+    from lib.ui.themes.theme_loader import *
+with profileSpan("import lib.ui.win.main"):
+    from lib.ui.win.main import *
+with profileSpan("import lib.ui.win.splash"):
+    from lib.ui.win.splash import *
 
 
 # localize subclass
@@ -62,24 +105,186 @@ class Localize():
 
         #mainWin.fileMenu.setTitle((app.translate("File Menu Title", "&File")))
 
+def construct(widgetClass, *args):
+    with profileSpan(f"{widgetClass.__name__}.__init__"):
+        return widgetClass(*args)
+
+# tabs only get built the first time they're opened (and get thrown away again when they're closed)
+def registerTabs():
+    mainWin.tabRegistry.register("welcome", lambda: construct(WelcomeWidget, mainThemeLoader), "Welcome")
+    mainWin.tabRegistry.register("viewer", lambda: construct(ViewerWidget, mainThemeLoader), "Image Viewer")
+    mainWin.tabRegistry.register("settings", buildSettingsTab, "Settings")
+    mainWin.tabRegistry.register("duplicates", buildDuplicatesTab, "Duplicates")
+    mainWin.tabRegistry.register("compare", lambda: construct(CompareWidget, mainThemeLoader), "Compare")
+
+def buildSettingsTab():
+    widget = construct(SettingsWidget, mainThemeLoader)
+    widget.duplicatesLink.linkActivated.connect(openDuplicatesTab)
+    return widget
+
+def buildDuplicatesTab():
+    widget = construct(DuplicatesWidget, mainThemeLoader)
+    widget.openRequested.connect(openPathInNewViewer)
+    return widget
+
+def openPathInNewViewer(path):
+    mainWin.tabRegistry.openNew("viewer").openFolder(os.path.dirname(path), path)
+
 def openViewerTab(self):
-    mainWin.mainTabW.addTab(viewer, "Image Viewer")
-    mainWin.mainTabW.setCurrentWidget(viewer)
+    return mainWin.tabRegistry.open("viewer")
+
+def openImageDialog(self):
+    path, _ = QFileDialog.getOpenFileName(mainWin, "Open image", "", imageFileFilter())
+    if path:
+        # opening the image's folder too lets the user step through its neighbours
+        openViewerTab(self).openFolder(os.path.dirname(path), path)
+
+def openFolderDialog(self):
+    folder = QFileDialog.getExistingDirectory(mainWin, "Open folder")
+    if folder:
+        openViewerTab(self).openFolder(folder)
 
 def openSettingsTab(self):
-    mainWin.mainTabW.addTab(settings, "Settings")
-    mainWin.mainTabW.setCurrentWidget(settings)
+    return mainWin.tabRegistry.open("settings")
+
+def openDuplicatesTab(self):
+    return mainWin.tabRegistry.open("duplicates")
+
+def openCompareTab(self):
+    return mainWin.tabRegistry.open("compare")
+
+def showAbout(self):
+    global about
+    if about is None:
+        about = construct(AboutWin)
+    about.show()
+
+def openForwardedPaths(paths):
+    """Opens what a later launch handed over, each in its own viewer tab."""
+    # the window isn't up yet, so this waits for finishStartup()
+    if not pipeline.isFinished():
+        forwardedPaths.extend(paths)
+        return
+
+    for path in paths:
+        viewer = mainWin.tabRegistry.openNew("viewer")
+        if os.path.isdir(path):
+            viewer.openFolder(path)
+        else:
+            viewer.openFolder(os.path.dirname(path), path)
+
+    mainWin.setWindowState(mainWin.windowState() & ~Qt.WindowMinimized)
+    mainWin.raise_()
+    mainWin.activateWindow()
 
 def doShit():
-    mainWin.mainTabW.addTab(welcome, "Welcome")
-    welcome.openImageLink.linkActivated.connect(openViewerTab)
+    welcome = mainWin.tabRegistry.open("welcome")
+    welcome.openImageLink.linkActivated.connect(openImageDialog)
+    mainWin.openImg.triggered.connect(openImageDialog)
+    welcome.openFolderLink.linkActivated.connect(openFolderDialog)
+    mainWin.openFolder.triggered.connect(openFolderDialog)
     welcome.settingsLink.linkActivated.connect(openSettingsTab)
+    welcome.duplicatesLink.linkActivated.connect(openDuplicatesTab)
+    welcome.compareLink.linkActivated.connect(openCompareTab)
+    mainWin.about.triggered.connect(showAbout)
+
+# startup stages, run in order by the StartupPipeline set up in setUpStartup()
+def scanThemes():
+    with profileSpan("ThemeLoader.__init__"):
+        return ThemeLoader("./assets/themes/")
+
+def applyMainTheme():
+    global mainThemeLoader, iconPath
+    mainThemeLoader = pipeline.results["themes"]
+    with profileSpan("ThemeLoader.applyTheme"):
+        mainThemeLoader.applyTheme("AscentedNordDark", "#AFB7C6", app) #777cc1
+    iconPath = mainThemeLoader.getThemeIconPackPath("AscentedNordDark")
+
+def buildWidgets():
+    global mainWin, about
+    installPixmaps(pipeline.results["assets"] or {})
+
+    mainWin = construct(MainWindow, mainThemeLoader)
+    about = None
+
+    registerTabs()
+    doShit()
+    Localize()
+
+def decodeInitialImage():
+    # a folder just gets opened once the window is up
+    if initialImagePath is None or os.path.isdir(initialImagePath):
+        return None
+
+    # really big images get the tiled treatment from the viewer instead
+    size, mapped = probeImage(initialImagePath)
+    if size.isValid() and size.width() * size.height() > tiledMinPixels(mapped, TILED_MIN_PIXELS):
+        return None
+
+    # the window isn't there yet, but it won't be bigger than the screen
+    image, error = readDisplayImage(initialImagePath, initialDisplaySize)
+    if image is None:
+        image, error = readImage(initialImagePath)
+    return image if not image.isNull() else None
+
+def finishStartup():
+    if profiling.profiler is not None:
+        watchFirstPaint(mainWin, finishProfiling)
+
+    mainWin.show()
+    splash.close()
+
+    if initialImagePath is not None and os.path.isdir(initialImagePath):
+        openViewerTab(None).openFolder(initialImagePath)
+    elif initialImagePath is not None:
+        openViewerTab(None).openFolder(os.path.dirname(initialImagePath), initialImagePath, pipeline.results["image"])
+
+    pipeline.printTimings()
+
+    if forwardedPaths:
+        openForwardedPaths(forwardedPaths)
+        forwardedPaths.clear()
+
+def finishProfiling():
+    profileMark("MainWindow first paint")
+    profiling.profiler.extra["stagesMs"] = {name: seconds * 1000 for name, seconds in pipeline.timings.items()}
+    profiling.profiler.finish()
+    app.exit(0)
+
+def setUpStartup():
+    global pipeline
+    pipeline = StartupPipeline()
+    pipeline.addStage("themes", "Scanning themes...", scanThemes, background=True)
+    pipeline.addStage("theme", "Applying the theme...", applyMainTheme)
+    pipeline.addStage("assets", "Loading assets...", preloadImages, background=True)
+    pipeline.addStage("widgets", "Building the window...", buildWidgets, weight=2)
+    pipeline.addStage("image", "Opening the image...", decodeInitialImage, background=True,
+                      weight=3 if initialImagePath and not os.path.isdir(initialImagePath) else 0)
+
+    pipeline.stageStarted.connect(lambda name, label, percent: splash.setProgress(percent, label))
+    pipeline.finished.connect(finishStartup)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv) #+ ["-platform windows:darkmode=1 altgr"]) # https://forum.qt.io/topic/101391/windows-10-dark-theme/10
 
     signal(SIGINT, SIG_DFL)
 
+    if metrics.getMetrics().exportPath:
+        app.aboutToQuit.connect(lambda: metrics.getMetrics().exportJsonLines(metrics.getMetrics().exportPath))
+
+    # listening starts before anything else gets loaded, so launches during startup get caught too
+    forwardedPaths = []
+    instanceServer = InstanceServer()
+    instanceServer.pathsReceived.connect(openForwardedPaths)
+    if "--new-instance" not in app.arguments() and profiling.profiler is None:
+        instanceServer.listen()
+
+    # has to be resolved before the chdir below, it's relative to wherever we got launched from
+    imageArgs = [arg for arg in app.arguments()[1:] if not arg.startswith("-")]
+    profileMark("QApplication created")
+    initialImagePath = os.path.abspath(imageArgs[0]) if imageArgs else None
+    initialDisplaySize = app.primaryScreen().availableSize()
+
     try:
         os.chdir(__file__.replace(os.path.basename(__file__), ""))
     except:
@@ -88,20 +293,12 @@ if __name__ == "__main__":
     if system() == "Windows":
         app.setFont(QFont("Segoe UI", 9)) # 8 maybe
 
-    mainThemeLoader = ThemeLoader("./assets/themes/")
-    mainThemeLoader.applyTheme("AscentedNordDark", "#AFB7C6", app) #777cc1
-    iconPath = mainThemeLoader.getThemeIconPackPath("AscentedNordDark")
+    # the splash goes up first, everything else is loaded in stages while it's showing
+    splash = construct(Splash)
+    watchFirstPaint(splash, lambda: profileMark("Splash first paint"))
+    splash.show()
 
-    splash = Splash()
-    mainWin = MainWindow(mainThemeLoader)
-    about = AboutWin()
-    welcome = WelcomeWidget(mainThemeLoader)
-    viewer = ViewerWidget(mainThemeLoader)
-    settings = SettingsWidget(mainThemeLoader)
-
-    mainWin.show()
-
-    doShit()
-    Localize()
+    setUpStartup()
+    pipeline.start()
 
     sys.exit(app.exec_())
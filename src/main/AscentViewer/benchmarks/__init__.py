@@ -0,0 +1,368 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+# headless benchmarks for the hot paths: decoding, fit-to-window scaling, resize storms, theme scanning and startup.
+# python -m benchmarks --help for the options
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# has to be set before the QApplication exists
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import PYQT_VERSION_STR, QT_VERSION_STR, QPointF, QRectF, QSize, Qt
+from PyQt5.QtGui import QColor, QImage, QLinearGradient, QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from lib.image.loader import readImage
+from lib.image.scaled_cache import ScaledPixmapCache
+from lib.paths import getCacheDir
+
+RESULTS_VERSION = 1
+
+BENCHMARKS = ("decode", "scale", "resize", "themes", "startup")
+
+# megapixels of the synthetic images
+DEFAULT_SIZES = (1, 12, 50, 200)
+DEFAULT_FORMATS = ("jpg", "png", "bmp", "tif")
+
+# what "the window" is for fitting and downscaled decoding
+WINDOW_SIZE = QSize(1600, 900)
+
+# the sizes a resize storm goes through, like dragging a window edge around
+RESIZE_STORM_STEPS = 40
+
+# a benchmark only counts as regressed if it got this much slower, and by at least REGRESSION_MIN_SECONDS
+# (so sub-millisecond noise never gets flagged)
+DEFAULT_THRESHOLD = 0.15
+REGRESSION_MIN_SECONDS = 0.002
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Time AscentViewer's hot paths on synthetic images, headless.")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"comma separated benchmarks to run ({', '.join(BENCHMARKS)})")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated image sizes, in megapixels")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS), help="comma separated image formats")
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="how many times every benchmark runs (the median is what gets compared)")
+    parser.add_argument("--data-dir", default=None, help="where the synthetic images are kept between runs")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results against this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"), help="only compare two existing result files")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="how much slower (0.15 = 15%%) counts as a regression")
+    return parser
+
+
+def timeRuns(function, repeats, setup=None):
+    """Runs function repeats times (after setup, which isn't timed) and returns timing statistics in seconds."""
+    seconds = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    return {"runs": repeats, "median": statistics.median(seconds), "min": min(seconds), "max": max(seconds),
+            "mean": statistics.fmean(seconds)}
+
+
+def syntheticSize(megapixels):
+    """A 4:3 size with about that many megapixels."""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    return QSize(width, width * 3 // 4)
+
+
+def drawSyntheticImage(size, seed):
+    """Gradients and soft shapes: compresses about like a photo, instead of like noise or a flat color."""
+    image = QImage(size, QImage.Format_RGB32)
+    randomGenerator = random.Random(seed)
+
+    def randomColor():
+        return QColor(randomGenerator.randrange(256), randomGenerator.randrange(256), randomGenerator.randrange(256))
+
+    painter = QPainter(image)
+    gradient = QLinearGradient(QPointF(0, 0), QPointF(size.width(), size.height()))
+    gradient.setColorAt(0, randomColor())
+    gradient.setColorAt(1, randomColor())
+    painter.fillRect(image.rect(), gradient)
+
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    for _ in range(200):
+        color = randomColor()
+        color.setAlpha(randomGenerator.randrange(40, 200))
+        painter.setBrush(color)
+        radius = randomGenerator.uniform(0.01, 0.2) * size.width()
+        painter.drawEllipse(QRectF(randomGenerator.uniform(0, size.width()), randomGenerator.uniform(0, size.height()), radius, radius * randomGenerator.uniform(0.3, 1.5)))
+    painter.end()
+
+    return image
+
+
+def generateImages(dataDir, sizes, formats):
+    """Returns {(megapixels, format): path}, making whichever synthetic images don't exist yet."""
+    paths = {}
+    for megapixels in sizes:
+        image = None
+        for fmt in formats:
+            path = os.path.join(dataDir, f"synthetic_{megapixels}mp.{fmt}")
+            paths[megapixels, fmt] = path
+            if os.path.isfile(path):
+                continue
+
+            if image is None:
+                print(f"Generating the {megapixels} MP images...", flush=True)
+                image = drawSyntheticImage(syntheticSize(megapixels), megapixels)
+
+            # written under another name first, so an interrupted run never leaves a half written image behind
+            if not image.save(path + ".tmp", fmt.upper(), 90):
+                print(f"[!] Could not write a {fmt} image, skipping that format")
+                del paths[megapixels, fmt]
+                continue
+            os.replace(path + ".tmp", path)
+    return paths
+
+
+def benchmarkDecode(results, images, repeats):
+    for (megapixels, fmt), path in images.items():
+        results[f"decode/{fmt}/{megapixels}mp"] = timeRuns(lambda: readImage(path), repeats)
+        # what opening an image for fit-to-window could get away with
+        results[f"decodeScaled/{fmt}/{megapixels}mp"] = timeRuns(lambda: readImage(path, WINDOW_SIZE), repeats)
+
+
+def loadPixmaps(images, sizes):
+    """One pixmap per size, whatever format it comes from doesn't matter once it's decoded."""
+    for megapixels in sizes:
+        path = next((path for (size, fmt), path in images.items() if size == megapixels), None)
+        if path is not None:
+            yield megapixels, QPixmap.fromImage(readImage(path)[0])
+
+
+def benchmarkScale(results, images, sizes, repeats):
+    for megapixels, pixmap in loadPixmaps(images, sizes):
+        caches = []
+        # a fresh cache every time, otherwise all but the first run just hand back the cached copy
+        results[f"fitScale/{megapixels}mp"] = timeRuns(lambda: caches[-1].scaled(WINDOW_SIZE), repeats,
+                                                       setup=lambda: caches.append(ScaledPixmapCache(pixmap)))
+        results[f"fitScaleCached/{megapixels}mp"] = timeRuns(lambda: caches[-1].scaled(WINDOW_SIZE), repeats)
+        del caches
+
+
+def benchmarkResize(results, images, sizes, repeats):
+    from lib.ui.tab_widgets.viewer import ViewerWidget
+
+    app = QApplication.instance()
+    viewer = ViewerWidget(None)
+    viewer.resize(WINDOW_SIZE)
+    viewer.show()
+    app.processEvents()
+
+    def storm():
+        for step in range(RESIZE_STORM_STEPS):
+            # back and forth between half and full window size
+            fraction = 0.5 + 0.5 * abs(step / (RESIZE_STORM_STEPS / 2) - 1)
+            viewer.resize(int(WINDOW_SIZE.width() * fraction), int(WINDOW_SIZE.height() * fraction))
+            viewer.repaint()
+            app.processEvents()
+
+    for megapixels, pixmap in loadPixmaps(images, sizes):
+        viewer.setPixmap(pixmap)
+        results[f"resizeStorm/{megapixels}mp"] = timeRuns(storm, repeats)
+
+    viewer.close()
+    viewer.deleteLater()
+    app.processEvents()
+
+
+def benchmarkThemes(results, repeats):
+    from lib.ui.themes.theme_loader import ThemeLoader
+
+    themeLocation = os.path.join(APP_DIR, "assets", "themes", "")
+    with tempfile.TemporaryDirectory() as cacheLocation:
+        # every run gets an empty cache directory, so every theme gets compiled from its source files
+        runCaches = []
+        results["themeScan/cold"] = timeRuns(lambda: ThemeLoader(themeLocation, runCaches[-1]), repeats,
+                                             setup=lambda: runCaches.append(tempfile.mkdtemp(dir=cacheLocation)))
+        results["themeScan/warm"] = timeRuns(lambda: ThemeLoader(themeLocation, runCaches[-1]), repeats)
+
+        loader = ThemeLoader(themeLocation, cacheLocation)
+        app = QApplication.instance()
+        themeName = loader.themeNames()[0]
+        results["themeApply"] = timeRuns(lambda: loader.switchTheme(themeName, "#AFB7C6", app), repeats,
+                                         setup=lambda: loader.switchTheme(loader.themeNames()[-1], "#000000", app))
+
+
+def profileStartup(extraArgs):
+    """Starts AscentViewer with --profile-startup and returns its report, or None if that didn't work."""
+    with tempfile.TemporaryDirectory() as directory:
+        reportPath = os.path.join(directory, "startup.json")
+        command = [sys.executable, os.path.join(APP_DIR, "__main__.py"), "--profile-startup=json",
+                   f"--profile-output={reportPath}", "--new-instance"] + extraArgs
+        try:
+            subprocess.run(command, cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+            with open(reportPath, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+            print(f"[!] Startup profiling failed: {e}")
+            return None
+
+
+def benchmarkStartup(results, images, repeats):
+    # opening a JPEG is what launching AscentViewer by double clicking an image mostly looks like
+    jpegSizes = sorted(megapixels for megapixels, fmt in images if fmt == "jpg")
+    runs = [("startup/firstPaint", [])]
+    if jpegSizes:
+        runs.append(("startup/firstPaintWithImage", [images[jpegSizes[0], "jpg"]]))
+
+    for name, extraArgs in runs:
+        seconds = []
+        for _ in range(repeats):
+            report = profileStartup(extraArgs)
+            if report is None:
+                break
+            firstPaint = next((event["start"] for event in report["events"] if event["name"] == "MainWindow first paint"), report["totalMs"])
+            seconds.append(firstPaint / 1000)
+
+        if seconds:
+            results[name] = {"runs": len(seconds), "median": statistics.median(seconds), "min": min(seconds),
+                             "max": max(seconds), "mean": statistics.fmean(seconds)}
+
+
+def runBenchmarks(args):
+    only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(only) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+    dataDir = args.data_dir or getCacheDir("benchmarks")
+    os.makedirs(dataDir, exist_ok=True)
+
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    os.chdir(APP_DIR)
+
+    images = generateImages(dataDir, sizes, formats) if {"decode", "scale", "resize", "startup"} & set(only) else {}
+    results = {}
+
+    for name in only:
+        print(f"Running {name}...", flush=True)
+        start = time.perf_counter()
+        if name == "decode":
+            benchmarkDecode(results, images, args.repeats)
+        elif name == "scale":
+            benchmarkScale(results, images, sizes, args.repeats)
+        elif name == "resize":
+            benchmarkResize(results, images, sizes, args.repeats)
+        elif name == "themes":
+            benchmarkThemes(results, args.repeats)
+        elif name == "startup":
+            benchmarkStartup(results, images, args.repeats)
+        print(f"{name} took {time.perf_counter() - start:.1f} s", flush=True)
+
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "qt": QT_VERSION_STR,
+                    "pyqt": PYQT_VERSION_STR, "cpus": os.cpu_count()},
+        "options": {"sizes": sizes, "formats": formats, "repeats": args.repeats},
+        "results": results,
+    }
+
+
+def printResults(report):
+    for name, timing in report["results"].items():
+        print(f"{name:<36} {timing['median'] * 1000:10.1f} ms  (min {timing['min'] * 1000:.1f}, max {timing['max'] * 1000:.1f})")
+
+
+def compareResults(baseline, report, threshold):
+    """Prints every benchmark both reports have, and returns the names of the ones that got slower than threshold allows."""
+    regressions = []
+    print(f"{'benchmark':<36} {'baseline':>12} {'now':>12} {'change':>8}")
+
+    for name, timing in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:<36} {'-':>12} {timing['median'] * 1000:9.1f} ms      new")
+            continue
+
+        change = timing["median"] / old["median"] - 1 if old["median"] else 0
+        regressed = change > threshold and timing["median"] - old["median"] > REGRESSION_MIN_SECONDS
+        if regressed:
+            regressions.append(name)
+
+        print(f"{name:<36} {old['median'] * 1000:9.1f} ms {timing['median'] * 1000:9.1f} ms {change:+7.1%}"
+              f"{'  [!] regression' if regressed else ''}")
+
+    if baseline.get("machine") != report.get("machine"):
+        print("[!] The baseline was made on a different machine (or Python/Qt version), take the numbers with a grain of salt.")
+
+    return regressions
+
+
+def loadReport(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+
+    if report.get("version") != RESULTS_VERSION:
+        raise SystemExit(f'"{path}" is not a benchmark results file this version can read')
+    return report
+
+
+def main(argv):
+    args = createArgumentParser().parse_args(argv)
+
+    if args.compare:
+        baseline, report = (loadReport(path) for path in args.compare)
+    else:
+        # read up front, so a typo in the path doesn't only turn up after all the benchmarks ran
+        baseline = loadReport(args.baseline) if args.baseline else None
+        report = runBenchmarks(args)
+        printResults(report)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=4)
+            print(f"Results written to {args.output}")
+
+    if baseline is None:
+        return 0
+
+    regressions = compareResults(baseline, report, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+
+    print("No regressions.")
+    return 0
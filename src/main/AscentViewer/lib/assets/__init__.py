@@ -0,0 +1,59 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from PyQt5.QtGui import QImage, QPixmap, QPixmapCache
+
+# the images the first windows need, decoded in the background while the splash is up
+STARTUP_ASSETS = [
+    "./assets/img/pcbg_alpha.png",
+    "./assets/img/settingsbg_alpha4.png",
+    "./assets/img/dropdown_arrow.png",
+]
+
+# the backgrounds alone are ~8 MB each once decoded, which blows through QPixmapCache's 10 MB default
+PIXMAP_CACHE_LIMIT_KB = 64 * 1024
+
+
+def preloadImages(paths=STARTUP_ASSETS):
+    """Decodes paths into QImages. Safe to run off the GUI thread."""
+    return {path: QImage(path) for path in paths}
+
+
+def installPixmaps(images):
+    """Turns preloaded QImages into cached pixmaps, so getPixmap doesn't have to touch the disk. GUI thread only."""
+    QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), PIXMAP_CACHE_LIMIT_KB))
+
+    for path, image in images.items():
+        if not image.isNull():
+            QPixmapCache.insert(path, QPixmap.fromImage(image))
+
+
+def getPixmap(path):
+    """Returns the pixmap for an asset, from the cache if it was preloaded."""
+    pixmap = QPixmapCache.find(path)
+    if pixmap is not None:
+        return pixmap
+
+    pixmap = QPixmap(path)
+    if not pixmap.isNull():
+        QPixmapCache.insert(path, pixmap)
+    return pixmap
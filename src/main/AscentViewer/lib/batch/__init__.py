@@ -0,0 +1,163 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+# headless batch conversion: python AscentViewer batch [options] inputs...
+# runs without a QApplication (QImageReader/QImageWriter don't need one) and spreads the files over a process pool
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage, QImageWriter
+
+from lib.image.folder import isImageFile
+from lib.image.loader import readImage
+
+# how many files per worker can be queued up at once. the input is read lazily and never queued past this,
+# so memory use stays the same no matter how many files there are
+JOBS_PER_WORKER = 2
+
+
+def parseSize(text):
+    """Parses "1920x1080" (or just "1920" for a square) into a QSize."""
+    width, _, height = text.lower().partition("x")
+    try:
+        return QSize(int(width), int(height or width))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'"{text}" is not a size, use WIDTHxHEIGHT')
+
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(prog="AscentViewer batch", description="Resize, convert or strip the metadata of many images at once.")
+    parser.add_argument("inputs", nargs="+", help="files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="directory to write the results to")
+    parser.add_argument("-r", "--recursive", action="store_true", help="also go into subdirectories")
+    parser.add_argument("-s", "--max-size", type=parseSize, help="fit images into WIDTHxHEIGHT (never upscales)")
+    parser.add_argument("-f", "--format", help="output format (png, jpg, webp, ...), defaults to the input's")
+    parser.add_argument("-q", "--quality", type=int, default=-1, help="encoder quality, 0-100")
+    parser.add_argument("--strip-metadata", action="store_true", help="don't carry text metadata over to the output")
+    parser.add_argument("--overwrite", action="store_true", help="replace files that already exist in the output directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    return parser
+
+
+def iterInputs(inputs, recursive):
+    """Lazily yields (path, relative output path) for every image in inputs."""
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                if not recursive:
+                    dirs.clear()
+                for name in files:
+                    if isImageFile(name):
+                        path = os.path.join(root, name)
+                        yield path, os.path.relpath(path, item)
+        elif os.path.isfile(item):
+            yield item, os.path.basename(item)
+        else:
+            for path in glob.iglob(item, recursive=recursive):
+                if os.path.isfile(path) and isImageFile(path):
+                    yield path, os.path.basename(path)
+
+
+def withoutMetadata(image):
+    """Returns a copy of image without any of the text metadata the reader attached to it."""
+    stripped = QImage(image.constBits().asstring(image.sizeInBytes()), image.width(), image.height(),
+                      image.bytesPerLine(), image.format()).copy()
+    stripped.setColorTable(image.colorTable())
+    stripped.setDotsPerMeterX(image.dotsPerMeterX())
+    stripped.setDotsPerMeterY(image.dotsPerMeterY())
+    return stripped
+
+
+def convertFile(job):
+    """Runs in a worker process. Returns (source, destination, error message or "", seconds)."""
+    source, destination, maxSize, fmt, quality, stripMetadata = job
+    start = time.perf_counter()
+
+    # same decode path as the viewer, the reader downscales while decoding where it can
+    image, error = readImage(source, QSize(*maxSize) if maxSize else None)
+    if image.isNull():
+        return source, destination, error or "could not decode", time.perf_counter() - start
+
+    if stripMetadata:
+        image = withoutMetadata(image)
+
+    writer = QImageWriter(destination, fmt.encode() if fmt else b"")
+    writer.setQuality(quality)
+    if not writer.write(image):
+        return source, destination, writer.errorString(), time.perf_counter() - start
+
+    return source, destination, "", time.perf_counter() - start
+
+
+def main(argv):
+    args = createArgumentParser().parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+
+    maxSize = (args.max_size.width(), args.max_size.height()) if args.max_size else None
+
+    def jobs():
+        for source, relative in iterInputs(args.inputs, args.recursive):
+            if args.format:
+                relative = os.path.splitext(relative)[0] + "." + args.format.lower()
+
+            destination = os.path.join(args.output, relative)
+            if os.path.exists(destination) and not args.overwrite:
+                print(f"skipped {source} ({destination} already exists)", flush=True)
+                continue
+
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            yield source, destination, maxSize, args.format, args.quality, args.strip_metadata
+
+    done = failed = 0
+    start = time.perf_counter()
+    pending = set()
+    jobIterator = jobs()
+
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        while True:
+            # top the queue back up, but never past a fixed number of jobs
+            while len(pending) < max(1, args.jobs) * JOBS_PER_WORKER:
+                job = next(jobIterator, None)
+                if job is None:
+                    break
+                pending.add(pool.submit(convertFile, job))
+
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                source, destination, error, seconds = future.result()
+                done += 1
+                if error:
+                    failed += 1
+                    print(f"[{done}] [!] {source}: {error}", flush=True)
+                else:
+                    print(f"[{done}] {source} -> {destination} ({seconds * 1000:.0f} ms)", flush=True)
+
+    print(f"{done - failed} of {done} images converted in {time.perf_counter() - start:.1f} s")
+    return 1 if failed else 0
@@ -0,0 +1,127 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from collections import Counter
+
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QImage
+
+# numpy is optional. Without it the lookup tables get applied with bytes.translate(), which is
+# still C speed but needs a copy of the pixels, and histograms are counted from a smaller sample
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the most pixels a histogram gets counted from. They're sampled evenly from the whole image
+HISTOGRAM_SAMPLES = 256 * 256 if numpy is not None else 128 * 128
+
+
+class Adjustments:
+    def __init__(self, brightness=0, contrast=0, gamma=1.0, blackPoint=0, whitePoint=255):
+        """Init function. brightness and contrast go from -100 to 100, blackPoint and whitePoint are the input
+        levels that get stretched to 0 and 255, and gamma is applied after that."""
+        self.brightness = brightness
+        self.contrast = contrast
+        self.gamma = gamma
+        self.blackPoint = blackPoint
+        self.whitePoint = whitePoint
+
+    def isIdentity(self):
+        return (self.brightness == 0 and self.contrast == 0 and self.gamma == 1.0
+                and self.blackPoint == 0 and self.whitePoint == 255)
+
+    def lookupTable(self):
+        """Returns the 256 byte table that maps every input channel value to its adjusted value."""
+        levelRange = max(self.whitePoint - self.blackPoint, 1)
+        contrast = (100 + self.contrast) / 100 if self.contrast <= 0 else 100 / max(100 - self.contrast, 1)
+        brightness = self.brightness * 255 / 100
+
+        table = bytearray(256)
+        for value in range(256):
+            level = min(max((value - self.blackPoint) / levelRange, 0.0), 1.0) ** (1 / self.gamma) * 255
+            table[value] = min(max(round((level - 127.5) * contrast + 127.5 + brightness), 0), 255)
+        return bytes(table)
+
+
+def imageArray(image):
+    """Returns a numpy view of image's pixels, shaped (height, bytesPerLine). No copy is made,
+    so writing to it changes image (and image must outlive it)."""
+    bits = image.bits()
+    bits.setsize(image.sizeInBytes())
+    return numpy.frombuffer(bits, numpy.uint8).reshape(image.height(), image.bytesPerLine())
+
+
+def applyAdjustments(image, adjustments):
+    """Returns an adjusted copy of image. The alpha channel is left alone."""
+    if adjustments.isIdentity() or image.isNull():
+        return image
+
+    table = adjustments.lookupTable()
+
+    if numpy is not None:
+        result = image.convertToFormat(QImage.Format_RGBA8888 if image.hasAlphaChannel() else QImage.Format_RGBX8888)
+        pixels = imageArray(result)[:, :result.width() * 4].reshape(result.height(), result.width(), 4)
+        # one fancy indexing pass per image, straight into the QImage's own buffer
+        pixels[:, :, :3] = numpy.frombuffer(table, numpy.uint8)[pixels[:, :, :3]]
+        return result
+
+    # the QImages made from the translated bytes don't own them, hence the conversions (which copy) right away
+    if not image.hasAlphaChannel():
+        result = image.convertToFormat(QImage.Format_RGB888)
+        data = result.constBits().asstring(result.sizeInBytes()).translate(table)
+        return QImage(data, result.width(), result.height(), result.bytesPerLine(), QImage.Format_RGB888).copy()
+
+    # the table hits the alpha bytes too, so the original alpha gets put back afterwards.
+    # setAlphaChannel() multiplies with whatever alpha is there already, so that gets dropped first
+    result = image.convertToFormat(QImage.Format_RGBA8888)
+    data = result.constBits().asstring(result.sizeInBytes()).translate(table)
+    adjusted = QImage(data, result.width(), result.height(), result.bytesPerLine(), QImage.Format_RGBA8888)
+    adjusted = adjusted.convertToFormat(QImage.Format_RGBX8888)
+    adjusted.setAlphaChannel(result.convertToFormat(QImage.Format_Alpha8))
+    return adjusted
+
+
+def histogram(image, maxSamples=HISTOGRAM_SAMPLES):
+    """Returns (red, green, blue), each a list of 256 counts, from at most maxSamples evenly sampled pixels."""
+    if image.isNull():
+        return [0] * 256, [0] * 256, [0] * 256
+
+    size = image.size()
+    if size.width() * size.height() > maxSamples:
+        scale = (maxSamples / (size.width() * size.height())) ** 0.5
+        size = QSize(max(1, int(size.width() * scale)), max(1, int(size.height() * scale)))
+    # the fast transformation only reads the rows and columns it samples
+    sample = image.scaled(size, Qt.IgnoreAspectRatio, Qt.FastTransformation).convertToFormat(QImage.Format_RGB888)
+
+    if numpy is not None:
+        pixels = imageArray(sample)[:, :sample.width() * 3].reshape(-1, 3)
+        return tuple(numpy.bincount(pixels[:, channel], minlength=256).tolist() for channel in range(3))
+
+    rows = sample.constBits().asstring(sample.sizeInBytes())
+    rowBytes = sample.width() * 3
+    data = b"".join(rows[y * sample.bytesPerLine():y * sample.bytesPerLine() + rowBytes] for y in range(sample.height()))
+    channels = []
+    for channel in range(3):
+        counts = Counter(data[channel::3])
+        channels.append([counts.get(value, 0) for value in range(256)])
+    return tuple(channels)
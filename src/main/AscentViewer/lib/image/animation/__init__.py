@@ -0,0 +1,264 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import os
+import threading
+from collections import OrderedDict, deque
+
+from PyQt5.QtCore import QElapsedTimer, QObject, QRunnable, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+from lib.image.loader import getDecodeThreadPool
+
+# formats worth asking whether they're animated. Qt's png plugin doesn't do APNG, those show their first frame
+ANIMATED_EXTENSIONS = ("gif", "webp", "mng")
+
+# how many decoded frames are kept ready ahead of the one on screen, and how much memory they can take at most
+FRAME_BUFFER_SIZE = 8
+FRAME_BUFFER_BYTES = 64 * 1024 * 1024
+
+# frame delays this short are treated as 100 ms, like browsers do (plenty of GIFs rely on that)
+MIN_FRAME_DELAY = 11
+DEFAULT_FRAME_DELAY = 100
+
+# if playback falls further behind than this (a stall, the machine sleeping...), the timeline restarts
+# from the current frame instead of dropping frames to catch up
+MAX_LAG = 1000
+
+# how many isAnimated() answers are remembered
+ANIMATED_CACHE_SIZE = 4096
+
+# path: (mtime, size, animated). Filled from the decode threads too, hence the lock
+animatedCache = OrderedDict()
+animatedCacheLock = threading.Lock()
+
+
+def isAnimated(path):
+    """Checks whether path is an image with more than one frame.
+
+    Counting a GIF's frames means reading all of them, so the answer is remembered until the file changes.
+    The image loader asks while it decodes, so by the time the viewer asks it's usually already known."""
+    if os.path.splitext(path)[1][1:].lower() not in ANIMATED_EXTENSIONS:
+        return False
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with animatedCacheLock:
+        cached = animatedCache.get(path)
+        if cached is not None and cached[:2] == key:
+            animatedCache.move_to_end(path)
+            return cached[2]
+
+    reader = QImageReader(path)
+    animated = reader.supportsAnimation() and reader.imageCount() != 1
+
+    with animatedCacheLock:
+        animatedCache[path] = (*key, animated)
+        animatedCache.move_to_end(path)
+        while len(animatedCache) > ANIMATED_CACHE_SIZE:
+            animatedCache.popitem(last=False)
+    return animated
+
+
+class FrameSignals(QObject):
+    # generation, frame, delay
+    frameDecoded = pyqtSignal(int, QImage, int)
+    # generation, reachedEnd
+    batchFinished = pyqtSignal(int, bool)
+
+
+class FrameTask(QRunnable):
+    """Decodes the next count frames with reader, which only ever gets used by one task at a time."""
+    def __init__(self, player, reader, generation, count):
+        super().__init__()
+
+        self.player = player
+        self.signals = player.signals
+        self.reader = reader
+        self.generation = generation
+        self.count = count
+
+    def run(self):
+        for i in range(self.count):
+            if self.generation != self.player.generation:
+                return
+
+            frame = self.reader.read()
+            if frame.isNull():
+                self.signals.batchFinished.emit(self.generation, True)
+                return
+
+            delay = self.reader.nextImageDelay()
+            self.signals.frameDecoded.emit(self.generation, frame, delay if delay >= MIN_FRAME_DELAY else DEFAULT_FRAME_DELAY)
+
+        self.signals.batchFinished.emit(self.generation, False)
+
+
+class AnimationPlayer(QObject):
+    """Plays an animated image, decoding frames on the decode pool a few at a time.
+
+    Only a small ring buffer of upcoming frames is kept, so long animations don't sit in memory in full.
+    Every frame has a deadline on a fixed timeline, and frames that are already overdue when a later one
+    is due as well get dropped, so slow decoding or a busy GUI thread never makes playback drift."""
+    frameReady = pyqtSignal(QImage)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.threadPool = getDecodeThreadPool()
+        self.signals = FrameSignals()
+        self.signals.frameDecoded.connect(self.onFrameDecoded, Qt.QueuedConnection)
+        self.signals.batchFinished.connect(self.onBatchFinished, Qt.QueuedConnection)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.showNextFrame)
+        self.clock = QElapsedTimer()
+
+        # bumped on every play() and stop(), tasks and results from an older generation are ignored
+        self.generation = 0
+        self.path = None
+        self.reader = None
+        self.frames = deque()
+        self.bufferSize = FRAME_BUFFER_SIZE
+        self.decoding = False
+        self.decodedThisLoop = 0
+
+        # when the next frame is due, in ms on self.clock
+        self.deadline = 0
+        self.waitingForFrame = False
+        self.paused = False
+        self.pausedAt = 0
+        self.droppedFrames = 0
+
+    def play(self, path):
+        self.stop()
+
+        self.path = path
+        self.openReader()
+        frameSize = self.reader.size()
+        frameBytes = max(frameSize.width() * frameSize.height() * 4, 1)
+        self.bufferSize = max(2, min(FRAME_BUFFER_SIZE, FRAME_BUFFER_BYTES // frameBytes))
+
+        self.clock.start()
+        self.deadline = 0
+        self.waitingForFrame = True
+        self.decodeMore()
+
+    def stop(self):
+        self.generation += 1
+        self.timer.stop()
+        self.path = None
+        self.reader = None
+        self.frames.clear()
+        self.decoding = False
+        self.waitingForFrame = False
+        self.paused = False
+        self.droppedFrames = 0
+
+    def isPlaying(self):
+        return self.path is not None
+
+    def setPaused(self, paused):
+        if not self.isPlaying() or paused == self.paused:
+            return
+
+        self.paused = paused
+        if paused:
+            self.timer.stop()
+            self.pausedAt = self.clock.elapsed()
+        else:
+            # the whole timeline moves back by however long we were paused
+            self.deadline += self.clock.elapsed() - self.pausedAt
+            if not self.waitingForFrame:
+                self.timer.start(max(0, self.deadline - self.clock.elapsed()))
+
+    def bufferedBytes(self):
+        return sum(frame.sizeInBytes() for frame, delay in self.frames)
+
+    def openReader(self):
+        self.reader = QImageReader(self.path)
+        self.reader.setAutoTransform(True)
+        self.decodedThisLoop = 0
+
+    def decodeMore(self):
+        if self.decoding or self.reader is None or len(self.frames) >= self.bufferSize:
+            return
+
+        self.decoding = True
+        task = FrameTask(self, self.reader, self.generation, self.bufferSize - len(self.frames))
+        # ahead of prefetching, a late frame is something the user actually sees
+        self.threadPool.start(task, 1)
+
+    def onFrameDecoded(self, generation, frame, delay):
+        if generation != self.generation:
+            return
+
+        self.frames.append((frame, delay))
+        self.decodedThisLoop += 1
+        if self.waitingForFrame and not self.paused:
+            self.showNextFrame()
+
+    def onBatchFinished(self, generation, reachedEnd):
+        if generation != self.generation:
+            return
+
+        self.decoding = False
+        if reachedEnd:
+            if self.decodedThisLoop == 0 or self.reader.loopCount() == 0:
+                # either nothing decodes at all or it's not meant to loop, so the last frame just stays up
+                self.reader = None
+                return
+            # QImageReader can't reliably jump back to the first frame, so it's a fresh reader per loop
+            self.openReader()
+
+        self.decodeMore()
+
+    def showNextFrame(self):
+        if not self.frames:
+            # the decoder is behind. The next frame goes up as soon as it lands
+            self.waitingForFrame = True
+            return
+        self.waitingForFrame = False
+
+        now = self.clock.elapsed()
+        due = self.deadline
+        frame, delay = self.frames.popleft()
+
+        # a frame whose successor is due already would only flash by, if it got painted at all
+        while self.frames and due + delay <= now:
+            due += delay
+            frame, delay = self.frames.popleft()
+            self.droppedFrames += 1
+
+        if now - due > MAX_LAG:
+            due = now
+
+        self.deadline = due + delay
+        self.frameReady.emit(frame)
+        self.timer.start(max(0, self.deadline - self.clock.elapsed()))
+        self.decodeMore()
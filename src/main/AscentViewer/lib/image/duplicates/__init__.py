@@ -0,0 +1,413 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import math
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PyQt5.QtCore import QObject, QRunnable, QSize, Qt, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from lib.image.folder import isImageFile, naturalSortKey
+from lib.image.loader import readImage
+from lib.image.thumbnails import getThumbnailStore
+
+HASH_KINDS = ("aHash", "dHash", "pHash")
+
+# the hashes only ever look at 32x32 pixels, so the decode can be tiny (and JPEGs get to skip most of their IDCT)
+HASH_DECODE_SIZE = 64
+PHASH_SIZE = 32
+
+# paths per job handed to a worker process, big enough that pickling isn't what the workers spend their time on
+HASH_BATCH = 32
+JOBS_PER_WORKER = 2
+
+# two images whose hashes are at most this many bits apart count as duplicates (out of 64)
+DEFAULT_MAX_DISTANCE = 6
+
+# the 8 lowest frequencies of a 32 point DCT-II, one row per frequency
+DCT_COSINES = [[math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)] for u in range(8)]
+
+
+def grayPixels(image, width, height):
+    """Returns image squashed to width x height as rows of 8 bit luma values."""
+    gray = image.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation).convertToFormat(QImage.Format_Grayscale8)
+    data = gray.constBits().asstring(gray.sizeInBytes())
+    stride = gray.bytesPerLine()
+    return [data[y * stride:y * stride + width] for y in range(height)]
+
+
+def bitsToInt(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return value
+
+
+def averageHash(image):
+    """64 bits: which pixels of an 8x8 version are brighter than its mean."""
+    pixels = b"".join(grayPixels(image, 8, 8))
+    mean = sum(pixels) / 64
+    return bitsToInt(pixel > mean for pixel in pixels)
+
+
+def differenceHash(image):
+    """64 bits: whether each pixel of a 9x8 version is brighter than its right neighbour."""
+    return bitsToInt(row[x] > row[x + 1] for row in grayPixels(image, 9, 8) for x in range(8))
+
+
+def perceptualHash(image):
+    """64 bits: which of the 8x8 lowest DCT frequencies of a 32x32 version are above their median (DC left out)."""
+    rows = grayPixels(image, PHASH_SIZE, PHASH_SIZE)
+
+    # it's separable, and only 8 frequencies per axis are ever used, so this is a few thousand multiplications
+    rowFrequencies = [[sum(pixel * cosine for pixel, cosine in zip(row, cosines)) for cosines in DCT_COSINES] for row in rows]
+    frequencies = [sum(rowFrequencies[y][u] * cosines[y] for y in range(PHASH_SIZE))
+                   for cosines in DCT_COSINES for u in range(8)]
+
+    median = sorted(frequencies[1:])[31]
+    return bitsToInt(frequency > median for frequency in frequencies)
+
+
+def hammingDistance(a, b):
+    return (a ^ b).bit_count()
+
+
+def hashFiles(paths):
+    """Runs in a worker process. Returns (path, mtimeNs, fileSize, aHash, dHash, pHash) for every path that could be
+    decoded."""
+    results = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        image, error = readImage(path, QSize(HASH_DECODE_SIZE, HASH_DECODE_SIZE))
+        if image.isNull():
+            continue
+
+        results.append((path, stat.st_mtime_ns, stat.st_size, averageHash(image), differenceHash(image), perceptualHash(image)))
+    return results
+
+
+def toSigned(value):
+    # SQLite integers are signed 64 bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def toUnsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class HashIndex:
+    """Perceptual hashes, kept in a table next to the thumbnails (in the same SQLite file). Like ThumbnailStore,
+    every thread gets its own connection."""
+    def __init__(self, path=None):
+        self.path = path if path is not None else getThumbnailStore().path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                mtimeNs INTEGER NOT NULL,
+                fileSize INTEGER NOT NULL,
+                aHash INTEGER NOT NULL,
+                dHash INTEGER NOT NULL,
+                pHash INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def lookup(self, paths):
+        """Returns {path: (mtimeNs, fileSize, aHash, dHash, pHash)} for every path in paths that has a row."""
+        db = self.connection()
+        rows = {}
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            query = f"SELECT path, mtimeNs, fileSize, aHash, dHash, pHash FROM hashes WHERE path IN ({','.join('?' * len(chunk))})"
+            for path, mtimeNs, fileSize, *hashes in db.execute(query, chunk):
+                rows[path] = (mtimeNs, fileSize) + tuple(toUnsigned(value) for value in hashes)
+        return rows
+
+    def store(self, results):
+        if not results:
+            return
+
+        db = self.connection()
+        with self.lock:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                           [result[:3] + tuple(toSigned(value) for value in result[3:]) for result in results])
+            db.execute("COMMIT")
+
+
+hashIndex = None
+
+
+def getHashIndex():
+    global hashIndex
+    if hashIndex is None:
+        hashIndex = HashIndex()
+    return hashIndex
+
+
+class MultiIndexHash:
+    """Multi-index hashing over 64 bit hashes: they get cut into 4 chunks of 16 bits, each with a table of its own.
+    Two hashes at most maxDistance bits apart have to be at most maxDistance // 4 bits apart in at least one chunk,
+    so a lookup only probes a few buckets per table instead of comparing against every hash."""
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self, maxDistance):
+        self.maxDistance = maxDistance
+        self.tables = [{} for i in range(self.CHUNKS)]
+
+        # every way of flipping up to maxDistance // 4 bits of a chunk
+        radius = maxDistance // self.CHUNKS
+        self.flips = [mask for mask in range(1 << self.CHUNK_BITS) if mask.bit_count() <= radius]
+
+    def chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value):
+        for table, chunk in zip(self.tables, self.chunks(value)):
+            table.setdefault(chunk, []).append(value)
+
+    def search(self, value):
+        """Returns every added hash at most maxDistance bits away from value."""
+        found = set()
+        for table, chunk in zip(self.tables, self.chunks(value)):
+            for flip in self.flips:
+                for candidate in table.get(chunk ^ flip, ()):
+                    if candidate not in found and hammingDistance(value, candidate) <= self.maxDistance:
+                        found.add(candidate)
+        return found
+
+
+def groupDuplicates(hashes, maxDistance):
+    """Groups the paths in hashes ({path: hash}) whose hashes are at most maxDistance bits apart, transitively.
+    Returns the groups with more than one path, biggest first."""
+    # exact copies share a hash, every hash only has to be looked up once
+    pathsByHash = {}
+    for path, value in hashes.items():
+        pathsByHash.setdefault(value, []).append(path)
+
+    index = MultiIndexHash(maxDistance)
+    for value in pathsByHash:
+        index.add(value)
+
+    parents = {}
+
+    def find(value):
+        root = value
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while value != root:
+            parents[value], value = root, parents[value]
+        return root
+
+    for value in pathsByHash:
+        for match in index.search(value):
+            parents[find(match)] = find(value)
+
+    groups = {}
+    for value, paths in pathsByHash.items():
+        groups.setdefault(find(value), []).extend(paths)
+
+    groups = [sorted(group, key=naturalSortKey) for group in groups.values() if len(group) > 1]
+    groups.sort(key=lambda group: (-len(group), naturalSortKey(group[0])))
+    return groups
+
+
+def iterImagesUnder(folder, recursive):
+    for root, dirs, files in os.walk(folder):
+        if not recursive:
+            dirs.clear()
+        dirs.sort()
+        for name in files:
+            if isImageFile(name):
+                yield os.path.join(root, name)
+
+
+def getWorkerCount():
+    # one core stays free for the GUI
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class DuplicateSignals(QObject):
+    # requestId, hashed so far, total
+    progress = pyqtSignal(int, int, int)
+    # requestId, groups
+    finished = pyqtSignal(int, list)
+
+
+class DuplicateTask(QRunnable):
+    """Hashes everything in a folder that isn't in the index yet on a process pool, then groups the lot."""
+    def __init__(self, requestId, folder, recursive, kind, maxDistance, finder):
+        super().__init__()
+
+        self.requestId = requestId
+        self.folder = folder
+        self.recursive = recursive
+        self.kind = kind
+        self.maxDistance = maxDistance
+        self.finder = finder
+        self.signals = finder.signals
+
+    def run(self):
+        groups = []
+        try:
+            groups = self.findGroups()
+        except Exception as e:
+            print(f'[!] Looking for duplicates in "{self.folder}" failed: {type(e).__name__}: {e}')
+        finally:
+            # always reported, even when cancelled: the finder holds on to the task until then
+            self.signals.finished.emit(self.requestId, groups)
+
+    def findGroups(self):
+        paths = [os.path.abspath(path) for path in iterImagesUnder(self.folder, self.recursive)]
+        known = self.finder.index.lookup(paths)
+        column = 2 + HASH_KINDS.index(self.kind)
+        hashes, missing = {}, []
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            # rows are only trusted while the file's mtime and size still match
+            row = known.get(path)
+            if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+                hashes[path] = row[column]
+            else:
+                missing.append(path)
+
+        total = len(hashes) + len(missing)
+        self.signals.progress.emit(self.requestId, len(hashes), total)
+
+        if missing and not self.hashMissing(missing, hashes, total, column):
+            return []
+
+        return groupDuplicates(hashes, self.maxDistance) if self.finder.isPending(self.requestId) else []
+
+    def hashMissing(self, missing, hashes, total, column):
+        """Returns False if the request got cancelled on the way."""
+        jobs = iter([missing[start:start + HASH_BATCH] for start in range(0, len(missing), HASH_BATCH)])
+        workers = getWorkerCount()
+        pending = set()
+
+        # spawned rather than forked, forking a process that has Qt's threads running in it isn't safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            while True:
+                if not self.finder.isPending(self.requestId):
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    return False
+
+                # same bounded queue as batch conversion, so 100k paths never all sit in the pool at once
+                while len(pending) < workers * JOBS_PER_WORKER:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.add(pool.submit(hashFiles, job))
+
+                if not pending:
+                    return True
+
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results = future.result()
+                    self.finder.index.store(results)
+                    for result in results:
+                        hashes[result[0]] = result[column + 1]
+
+                self.signals.progress.emit(self.requestId, len(hashes), total)
+
+
+class DuplicateFinder(QObject):
+    """Finds groups of images that look the same, by perceptual hash. Hashes are computed by worker processes and
+    kept in a HashIndex, so looking through a folder again only costs the files that changed."""
+    progress = pyqtSignal(int, int)
+    groupsFound = pyqtSignal(list)
+
+    def __init__(self, index=None, parent=None):
+        super().__init__(parent)
+
+        self.index = index if index is not None else getHashIndex()
+
+        # the task mostly waits on the worker processes, one thread to drive them is plenty
+        self.threadPool = QThreadPool(self)
+        self.threadPool.setMaxThreadCount(1)
+        self.signals = DuplicateSignals()
+        self.signals.progress.connect(self.onProgress, Qt.QueuedConnection)
+        self.signals.finished.connect(self.onTaskFinished, Qt.QueuedConnection)
+        self.nextRequestId = 0
+        self.currentRequestId = None
+        # tasks stay referenced until they've reported back, cancelled ones too. Letting go of one the pool has
+        # already picked up would delete it out from under the pool thread
+        self.tasks = {}
+
+    def find(self, folder, recursive=True, kind="pHash", maxDistance=DEFAULT_MAX_DISTANCE):
+        """Looks for duplicates in folder. Anything that's still running gets cancelled."""
+        self.cancel()
+        self.nextRequestId += 1
+        task = DuplicateTask(self.nextRequestId, folder, recursive, kind, maxDistance, self)
+        task.setAutoDelete(False)
+        self.tasks[self.nextRequestId] = task
+        self.currentRequestId = self.nextRequestId
+        self.threadPool.start(task)
+
+    def isPending(self, requestId):
+        return requestId == self.currentRequestId
+
+    def isRunning(self):
+        return self.currentRequestId is not None
+
+    def cancel(self):
+        task = self.tasks.get(self.currentRequestId)
+        if task is not None and self.threadPool.tryTake(task):
+            del self.tasks[self.currentRequestId]
+        self.currentRequestId = None
+
+    def onProgress(self, requestId, done, total):
+        if requestId == self.currentRequestId:
+            self.progress.emit(done, total)
+
+    def onTaskFinished(self, requestId, groups):
+        self.tasks.pop(requestId, None)
+        if requestId == self.currentRequestId:
+            self.currentRequestId = None
+            self.groupsFound.emit(groups)
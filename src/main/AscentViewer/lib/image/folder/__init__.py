@@ -0,0 +1,408 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import os
+import re
+from bisect import bisect_left
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtGui import QImageReader
+
+from lib.image.mapped import MAPPED_EXTENSIONS
+from lib.image.metadata import MetadataIndexer, cameraName, captureTimeOrMtime
+from lib.image.watcher import FolderWatcher
+
+# how many directory entries get pulled from the scanner per event loop iteration
+SCAN_CHUNK = 256
+
+# numbers in file names get padded to this many digits for sorting
+NUMBER_WIDTH = 20
+
+imageExtensions = None
+
+
+def getImageExtensions():
+    """Returns the (lowercase, dotless) extensions of every format Qt can read, plus the ones we can map ourselves."""
+    global imageExtensions
+    if imageExtensions is None:
+        imageExtensions = frozenset(bytes(fmt).decode().lower() for fmt in QImageReader.supportedImageFormats()) | MAPPED_EXTENSIONS
+    return imageExtensions
+
+
+def isImageFile(path):
+    return os.path.splitext(path)[1][1:].lower() in getImageExtensions()
+
+
+def naturalSortKey(path):
+    """Sort key that puts img2.png before img10.png. It's a plain string (numbers get zero padded),
+    since comparing those is a lot quicker than comparing lists when there's 100k of them."""
+    return re.sub(r"\d+", lambda match: match.group().zfill(NUMBER_WIDTH), os.path.basename(path).lower())
+
+
+def iterImageFiles(folder):
+    """Lazily yields the path of every image directly inside folder, in whatever order the filesystem gives them."""
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and isImageFile(entry.name):
+                        yield entry.path
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f'[!] Could not scan "{folder}": {e}')
+
+
+class Descending:
+    """Wraps a sort key so that it sorts the other way around (bisect and sorted() only ever use <)."""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+# what each sort order sorts by, besides the name (which breaks ties). None sorts after everything else
+SORT_ORDERS = {
+    "name": None,
+    "date": captureTimeOrMtime,
+    "camera": cameraName,
+    "dimensions": lambda record: record.width * record.height or None,
+    "size": lambda record: record.fileSize,
+}
+
+# when a batch of metadata this big comes in, sorting everything again beats moving the paths one by one
+RESORT_BATCH = 64
+
+
+class FolderModel(QObject):
+    """The images of one folder in sorted order, plus which one is currently shown.
+
+    The folder is scanned a chunk at a time from the event loop, so huge folders don't block anything
+    and navigation works as soon as the first entries are in. After that, it's kept up to date by a
+    FolderWatcher, one changed file at a time.
+
+    Every image's metadata gets indexed in the background too, which is what sorting by anything but the
+    name and filtering go by. paths only holds the images that pass the filter, allPaths has all of them."""
+    currentChanged = pyqtSignal(int, str)
+    countChanged = pyqtSignal(int)
+    scanFinished = pyqtSignal()
+    # added, removed, modified (absolute paths)
+    filesChanged = pyqtSignal(list, list, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.folder = None
+        self.paths = []
+        self.sortKeys = []
+        self.pathSet = set()
+        self.allPaths = set()
+        self.currentPath = None
+        self.currentIndex = -1
+
+        self.sortOrder = "name"
+        self.descending = False
+        # takes an ImageMetadata (or None, if it isn't indexed yet) and returns whether the image should be in paths
+        self.filter = None
+        self.metadata = {}
+        # every path's key for the current sort order, so that filtering (or moving a path) never has to make them again
+        self.keyCache = {}
+        # and naturalSortKey() of every path, which is what takes longest to make
+        self.nameKeys = {}
+
+        self.scanner = None
+        self.scanTimer = QTimer(self)
+        self.scanTimer.setInterval(0)
+        self.scanTimer.timeout.connect(self.scanChunk)
+
+        self.watcher = FolderWatcher(self)
+        self.watcher.changed.connect(self.applyChanges)
+        self.watcher.overflowed.connect(self.resync)
+
+        self.indexer = MetadataIndexer(parent=self)
+        self.indexer.metadataReady.connect(self.onMetadataReady)
+
+    def open(self, folder, startPath=None):
+        """Starts scanning folder. startPath (if given) becomes the current image right away."""
+        self.folder = folder
+        self.paths = []
+        self.sortKeys = []
+        self.pathSet = set()
+        self.allPaths = set()
+        self.metadata = {}
+        self.keyCache = {}
+        self.nameKeys = {}
+        self.currentPath = None
+        self.currentIndex = -1
+        self.indexer.cancelAll()
+
+        if startPath is not None:
+            self.insert(startPath)
+            self.setCurrentIndex(0)
+
+        self.scanner = iterImageFiles(folder)
+        self.scanTimer.start()
+        # started right away, so nothing that happens during the scan gets missed
+        self.watcher.watch(folder)
+
+    def isScanning(self):
+        return self.scanner is not None
+
+    def scanChunk(self):
+        found = []
+        for _ in range(SCAN_CHUNK):
+            path = next(self.scanner, None)
+            if path is None:
+                self.scanTimer.stop()
+                self.scanner = None
+                self.scanFinished.emit()
+                break
+
+            found.append(os.path.abspath(path))
+            self.insert(path)
+
+        self.indexer.request(found)
+        self.countChanged.emit(len(self.paths))
+
+        if self.currentIndex == -1 and self.paths:
+            self.setCurrentIndex(0)
+
+    def sortKey(self, path):
+        key = self.keyCache.get(path)
+        if key is not None:
+            return key
+
+        key = self.nameKeys.get(path)
+        if key is None:
+            key = self.nameKeys[path] = naturalSortKey(path)
+
+        valueOf = SORT_ORDERS[self.sortOrder]
+        if valueOf is not None:
+            record = self.metadata.get(path)
+            value = valueOf(record) if record is not None else None
+            key = (value is None, value if value is not None else 0, key)
+
+        key = self.keyCache[path] = Descending(key) if self.descending else key
+        return key
+
+    def matchesFilter(self, path):
+        return self.filter is None or self.filter(self.metadata.get(path))
+
+    def insert(self, path):
+        """Adds path at its sorted position without re-sorting everything."""
+        path = os.path.abspath(path)
+        if path in self.allPaths:
+            return
+
+        self.allPaths.add(path)
+        self.place(path)
+
+    def place(self, path):
+        """Puts path into paths, if it passes the filter."""
+        if not self.matchesFilter(path):
+            return
+
+        key = self.sortKey(path)
+        index = bisect_left(self.sortKeys, key)
+        self.sortKeys.insert(index, key)
+        self.paths.insert(index, path)
+        self.pathSet.add(path)
+
+        # the current image doesn't change, but its index moves along
+        if path == self.currentPath:
+            self.currentIndex = index
+        elif self.currentIndex != -1 and index <= self.currentIndex:
+            self.currentIndex += 1
+
+    def unplace(self, path):
+        """Takes path out of paths (but not allPaths). Returns the index it had, or -1 if it wasn't there."""
+        if path not in self.pathSet:
+            return -1
+
+        # different paths can have the same sort key (IMG1.png and img1.png), so the exact one is looked for from there
+        index = bisect_left(self.sortKeys, self.sortKey(path))
+        while self.paths[index] != path:
+            index += 1
+
+        del self.sortKeys[index]
+        del self.paths[index]
+        self.pathSet.discard(path)
+        self.keyCache.pop(path, None)
+
+        if index < self.currentIndex:
+            self.currentIndex -= 1
+        elif index == self.currentIndex:
+            self.currentIndex = -1
+        return index
+
+    def remove(self, path):
+        """Takes path out completely. Returns the index it had, or -1 if it wasn't in paths."""
+        self.allPaths.discard(path)
+        self.nameKeys.pop(path, None)
+        return self.unplace(path)
+
+    def applyChanges(self, paths):
+        """Brings the paths that the watcher reported up to date, without touching anything else."""
+        added, removed, modified = [], [], []
+        currentRemovedAt = -1
+
+        for path in paths:
+            if isImageFile(path) and os.path.isfile(path):
+                if path in self.allPaths:
+                    modified.append(path)
+                else:
+                    self.insert(path)
+                    added.append(path)
+            elif path in self.allPaths:
+                index = self.remove(path)
+                if path == self.currentPath:
+                    currentRemovedAt = index
+                self.metadata.pop(path, None)
+                removed.append(path)
+
+        if not (added or removed or modified):
+            return
+
+        # before anything gets told, so nobody sees the model without a current image (and e.g. prefetches nothing)
+        if currentRemovedAt != -1:
+            # whatever comes after it takes its place
+            self.currentPath = None
+            self.setCurrentIndex(min(currentRemovedAt, len(self.paths) - 1))
+
+        self.indexer.request(added + modified)
+        if removed:
+            self.indexer.forget(removed)
+
+        if added or removed:
+            self.countChanged.emit(len(self.paths))
+        self.filesChanged.emit(added, removed, modified)
+
+    def resync(self):
+        """Compares the whole folder against what we have. Only for when the watcher lost track."""
+        if self.folder is None:
+            return
+
+        present = {os.path.abspath(path) for path in iterImageFiles(self.folder)}
+        self.applyChanges(sorted(present ^ self.allPaths))
+
+    def onMetadataReady(self, records):
+        if self.sortOrder == "name" and self.filter is None:
+            self.metadata.update((record.path, record) for record in records if record.path in self.allPaths)
+            return
+
+        if len(records) >= RESORT_BATCH:
+            for record in records:
+                if record.path in self.allPaths:
+                    self.metadata[record.path] = record
+                    self.keyCache.pop(record.path, None)
+            self.resort()
+            return
+
+        # a few stragglers just get moved to where their metadata says they belong
+        for record in records:
+            if record.path in self.allPaths:
+                self.unplace(record.path)
+                self.metadata[record.path] = record
+                self.place(record.path)
+        self.afterReorder()
+
+    def setSortOrder(self, sortOrder, descending=False):
+        """Sorts by one of SORT_ORDERS. Images that aren't indexed yet go last until their metadata is in."""
+        self.sortOrder = sortOrder
+        self.descending = descending
+        self.keyCache = {}
+        self.resort()
+
+    def setFilter(self, filter):
+        """Only keeps the images that filter (a function taking an ImageMetadata, or None) returns True for.
+        filter=None shows everything again."""
+        self.filter = filter
+        self.resort()
+
+    def resort(self):
+        """Sorts and filters allPaths from scratch."""
+        keys = {path: self.sortKey(path) for path in self.allPaths if self.matchesFilter(path)}
+        self.paths = sorted(keys, key=keys.__getitem__)
+        self.sortKeys = [keys[path] for path in self.paths]
+        self.pathSet = set(self.paths)
+        self.currentIndex = -1
+        self.afterReorder()
+
+    def afterReorder(self):
+        if self.currentPath in self.pathSet:
+            self.currentIndex = self.paths.index(self.currentPath)
+        else:
+            # the current image got filtered out (or there was none yet)
+            self.currentPath = None
+            self.currentIndex = -1
+            self.setCurrentIndex(0)
+
+        self.countChanged.emit(len(self.paths))
+
+    def cameras(self):
+        """Every camera that took a picture in this folder (as far as it's indexed yet), sorted."""
+        return sorted({cameraName(record) for record in self.metadata.values() if cameraName(record)})
+
+    def count(self):
+        return len(self.paths)
+
+    def setCurrentIndex(self, index):
+        if not 0 <= index < len(self.paths):
+            return
+
+        self.currentIndex = index
+        self.currentPath = self.paths[index]
+        self.currentChanged.emit(index, self.currentPath)
+
+    def next(self):
+        if self.paths:
+            self.setCurrentIndex((self.currentIndex + 1) % len(self.paths))
+
+    def previous(self):
+        if self.paths:
+            self.setCurrentIndex((self.currentIndex - 1) % len(self.paths))
+
+    def first(self):
+        self.setCurrentIndex(0)
+
+    def last(self):
+        self.setCurrentIndex(len(self.paths) - 1)
+
+    def neighbours(self, count):
+        """Returns the paths of the count images on either side of the current one, closest first."""
+        if self.currentIndex == -1:
+            return []
+
+        result = []
+        for distance in range(1, count + 1):
+            for index in (self.currentIndex + distance, self.currentIndex - distance):
+                path = self.paths[index % len(self.paths)]
+                if path != self.currentPath and path not in result:
+                    result.append(path)
+
+        return result
@@ -0,0 +1,314 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import time
+
+from PyQt5.QtCore import QObject, QRunnable, QSize, Qt, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+
+from lib.image.mapped import MAPPED_EXTENSIONS, MAPPED_TILED_MIN_PIXELS, isMappable, mapImage
+from lib.metrics import recordMetric
+
+# formats where asking the reader for a smaller image is actually cheaper than a full decode
+# (libjpeg can scale in the DCT domain), so a quick preview is worth doing before the real thing
+CHEAP_PREVIEW_FORMATS = (b"jpeg", b"jpg")
+
+# the preview is only worth it if the full image is a lot bigger than what we'd show
+PREVIEW_MIN_RATIO = 4
+
+# below this (in pixels, compared to what covers the display), decoding the whole image is cheap enough anyway
+DISPLAY_DECODE_MIN_RATIO = 4
+
+# zooming this little past the resolution an image was decoded at isn't worth decoding all of it
+FULL_RESOLUTION_SLACK = 1.05
+
+# where images decoded smaller than they are remember their real size
+FULL_SIZE_KEY = "AscentViewer.fullSize"
+
+# decoding gets its own pool. Qt's smooth scaling splits big images into jobs on QThreadPool.globalInstance()
+# and waits for them while holding the GIL, so if a decode task sits on a global pool thread waiting
+# for the GIL, the whole thing deadlocks
+decodeThreadPool = None
+
+
+def getDecodeThreadPool():
+    """Returns the thread pool shared by every ImageLoader."""
+    global decodeThreadPool
+    if decodeThreadPool is None:
+        decodeThreadPool = QThreadPool()
+    return decodeThreadPool
+
+
+def imageFileFilter():
+    """Returns a QFileDialog name filter with every format Qt can read."""
+    formats = {bytes(fmt).decode() for fmt in QImageReader.supportedImageFormats()} | MAPPED_EXTENSIONS
+    patterns = " ".join(f"*.{fmt}" for fmt in sorted(formats))
+    return f"Images ({patterns});;All files (*)"
+
+
+def readImage(path, scaledSize=None, clipRect=None):
+    """Decodes path into a QImage. Returns (image, errorString), the image is null if something went wrong.
+
+    scaledSize is fitted into with the aspect ratio kept, clipRect is in source image coordinates.
+    This is safe to call from any thread (it doesn't touch QPixmap)."""
+    mapped = mapImage(path) if isMappable(path) else None
+    if mapped is not None:
+        return mapped.read(scaledSize, clipRect), ""
+
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+
+    if clipRect is not None:
+        reader.setClipRect(clipRect)
+
+    if scaledSize is not None:
+        sourceSize = clipRect.size() if clipRect is not None else reader.size()
+        if sourceSize.isValid() and (sourceSize.width() > scaledSize.width() or sourceSize.height() > scaledSize.height()):
+            reader.setScaledSize(sourceSize.scaled(scaledSize, Qt.KeepAspectRatio))
+
+    image = reader.read()
+    return image, "" if not image.isNull() else reader.errorString()
+
+
+def readDisplayImage(path, displaySize):
+    """Decodes path at just enough resolution to cover displaySize, if its format can do that cheaply
+    (libjpeg scales in the DCT domain, so most of the work is skipped, not just done and thrown away).
+
+    Returns (image, errorString) like readImage(), or (None, "") if the image should be decoded whole instead.
+    fullImageSize() on the image gives the size it really is."""
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+
+    size = reader.size()
+    if reader.format() not in CHEAP_PREVIEW_FORMATS or not size.isValid() or displaySize is None or displaySize.isEmpty():
+        return None, ""
+
+    # size and setScaledSize() are both from before the exif rotation
+    rotated = bool(reader.transformation() & QImageIOHandler.TransformationRotate90)
+    scaledSize = size.scaled(displaySize.transposed() if rotated else displaySize, Qt.KeepAspectRatioByExpanding)
+    if size.width() * size.height() < DISPLAY_DECODE_MIN_RATIO * scaledSize.width() * scaledSize.height():
+        return None, ""
+
+    reader.setScaledSize(scaledSize)
+    image = reader.read()
+    if image.isNull():
+        return image, reader.errorString()
+
+    setFullImageSize(image, size.transposed() if rotated else size)
+    return image, ""
+
+
+def setFullImageSize(image, size):
+    image.setText(FULL_SIZE_KEY, f"{size.width()}x{size.height()}")
+
+
+def fullImageSize(image):
+    """Returns the size of the image that image was decoded from, which is bigger than image itself
+    if it came from readDisplayImage()."""
+    text = image.text(FULL_SIZE_KEY)
+    if text:
+        width, height = text.split("x")
+        return QSize(int(width), int(height))
+    return image.size()
+
+
+def probeImage(path):
+    """Reads just the header of path. Returns (size, mapped), where mapped is a MappedImage
+    if the file is uncompressed and can be used straight from disk, otherwise None."""
+    mapped = mapImage(path) if isMappable(path) else None
+    if mapped is not None:
+        return mapped.size(), mapped
+
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    return reader.size(), None
+
+
+def tiledMinPixels(mapped, maxPixels):
+    """How many pixels an image can have before it should be tiled instead of decoded whole."""
+    return min(maxPixels, MAPPED_TILED_MIN_PIXELS) if mapped is not None else maxPixels
+
+
+class LoaderSignals(QObject):
+    # requestId, path, image, errorString, isPreview
+    finished = pyqtSignal(int, str, QImage, str, bool)
+    # requestId, path, size
+    tooLarge = pyqtSignal(int, str, QSize)
+    # requestId, once the task is done with, whether it decoded anything or not
+    retired = pyqtSignal(int)
+
+
+class DecodeTask(QRunnable):
+    def __init__(self, requestId, path, loader, previewSize=None, scaledSize=None, maxPixels=None, displaySize=None):
+        super().__init__()
+
+        self.requestId = requestId
+        self.path = path
+        self.loader = loader
+        self.signals = loader.signals
+        self.previewSize = previewSize
+        self.scaledSize = scaledSize
+        self.maxPixels = maxPixels
+        self.displaySize = displaySize
+
+    def run(self):
+        try:
+            self.decode()
+        finally:
+            self.signals.retired.emit(self.requestId)
+
+    def decode(self):
+        # the request could've been cancelled while this was still sitting in the queue
+        if not self.loader.isPending(self.requestId):
+            return
+
+        size, mapped = probeImage(self.path)
+
+        # only the header has been read so far, so bailing out here is cheap
+        if self.maxPixels is not None and self.scaledSize is None and size.isValid() and size.width() * size.height() > tiledMinPixels(mapped, self.maxPixels):
+            self.signals.tooLarge.emit(self.requestId, self.path, size)
+            return
+
+        if mapped is not None:
+            # no decoding to speak of, so no preview either
+            start = time.perf_counter()
+            image = mapped.read(self.scaledSize)
+            recordMetric("decodeMs", (time.perf_counter() - start) * 1000, "mapped")
+            self.signals.finished.emit(self.requestId, self.path, image, "" if not image.isNull() else "Could not map the file", False)
+            return
+
+        if self.displaySize is not None and self.scaledSize is None:
+            # big JPEGs: the full resolution only gets decoded once somebody zooms in far enough to need it
+            start = time.perf_counter()
+            image, error = readDisplayImage(self.path, self.displaySize)
+            if image is not None:
+                recordMetric("decodeMs", (time.perf_counter() - start) * 1000, "display")
+                self.signals.finished.emit(self.requestId, self.path, image, error, False)
+                return
+
+        reader = QImageReader(self.path)
+        reader.setAutoTransform(True)
+
+        if self.previewSize is not None and self.wantsPreview(reader.format(), size):
+            start = time.perf_counter()
+            image, error = readImage(self.path, self.previewSize)
+            recordMetric("previewDecodeMs", (time.perf_counter() - start) * 1000, bytes(reader.format()).decode())
+            if not image.isNull() and self.loader.isPending(self.requestId):
+                # the size from the header is from before the exif rotation, the preview is after it
+                rotated = bool(reader.transformation() & QImageIOHandler.TransformationRotate90)
+                setFullImageSize(image, size.transposed() if rotated else size)
+                self.signals.finished.emit(self.requestId, self.path, image, "", True)
+
+        if not self.loader.isPending(self.requestId):
+            return
+
+        start = time.perf_counter()
+        image, error = readImage(self.path, self.scaledSize)
+        recordMetric("decodeMs", (time.perf_counter() - start) * 1000, bytes(reader.format()).decode())
+        if not image.isNull():
+            # counting the frames of a GIF reads all of them, better here than on the GUI thread when it's shown
+            # (lib.image.animation imports this module, so it can't be imported at the top)
+            from lib.image.animation import isAnimated
+            isAnimated(self.path)
+        self.signals.finished.emit(self.requestId, self.path, image, error, False)
+
+    def wantsPreview(self, fmt, size):
+        return (fmt in CHEAP_PREVIEW_FORMATS and size.isValid()
+                and size.width() * size.height() >= PREVIEW_MIN_RATIO * self.previewSize.width() * self.previewSize.height())
+
+
+class ImageLoader(QObject):
+    """Decodes images on a thread pool and hands the QImages back on the GUI thread.
+
+    QPixmaps can only be made on the GUI thread, so converting is up to whoever listens to the signals."""
+    imageLoaded = pyqtSignal(int, str, QImage)
+    previewLoaded = pyqtSignal(int, str, QImage)
+    loadFailed = pyqtSignal(int, str, str)
+    imageTooLarge = pyqtSignal(int, str, QSize)
+
+    def __init__(self, parent=None, threadPool=None):
+        super().__init__(parent)
+
+        self.threadPool = threadPool if threadPool is not None else getDecodeThreadPool()
+        self.signals = LoaderSignals()
+        self.signals.finished.connect(self.onTaskFinished, Qt.QueuedConnection)
+        self.signals.tooLarge.connect(self.onTaskTooLarge, Qt.QueuedConnection)
+        self.signals.retired.connect(self.onTaskRetired, Qt.QueuedConnection)
+
+        self.nextRequestId = 0
+        self.pendingTasks = {}
+        # tasks stay referenced until they've reported back, cancelled ones too. Letting go of one the pool has
+        # already picked up would delete it out from under the pool thread
+        self.tasks = {}
+
+    def load(self, path, previewSize=None, scaledSize=None, priority=0, maxPixels=None, displaySize=None):
+        """Queues path for decoding and returns the request id that the signals will carry.
+
+        If maxPixels is given and the image turns out to be bigger than that, it doesn't get decoded at all
+        and imageTooLarge is emitted instead. With displaySize, formats that can are decoded just big enough
+        to cover it (see readDisplayImage), and that's what imageLoaded gets."""
+        self.nextRequestId += 1
+        task = DecodeTask(self.nextRequestId, path, self, previewSize, scaledSize, maxPixels, displaySize)
+        task.setAutoDelete(False)
+
+        self.pendingTasks[self.nextRequestId] = task
+        self.tasks[self.nextRequestId] = task
+        self.threadPool.start(task, priority)
+
+        return self.nextRequestId
+
+    def isPending(self, requestId):
+        return requestId in self.pendingTasks
+
+    def cancel(self, requestId):
+        """Cancels a request. Its results (if it's already decoding) get thrown away."""
+        task = self.pendingTasks.pop(requestId, None)
+        if task is not None and self.threadPool.tryTake(task):
+            del self.tasks[requestId]
+
+    def cancelAll(self):
+        for requestId in list(self.pendingTasks):
+            self.cancel(requestId)
+
+    def onTaskFinished(self, requestId, path, image, error, isPreview):
+        # stale results (from cancelled requests) just get dropped here
+        if requestId not in self.pendingTasks:
+            return
+
+        if isPreview:
+            self.previewLoaded.emit(requestId, path, image)
+            return
+
+        del self.pendingTasks[requestId]
+
+        if image.isNull():
+            print(f'[!] Could not load "{path}": {error}')
+            self.loadFailed.emit(requestId, path, error)
+        else:
+            self.imageLoaded.emit(requestId, path, image)
+
+    def onTaskRetired(self, requestId):
+        self.tasks.pop(requestId, None)
+
+    def onTaskTooLarge(self, requestId, path, size):
+        if self.pendingTasks.pop(requestId, None) is not None:
+            self.imageTooLarge.emit(requestId, path, size)
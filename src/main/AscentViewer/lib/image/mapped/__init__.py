@@ -0,0 +1,246 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import ast
+import ctypes
+import mmap
+import os
+import struct
+
+from PyQt5 import sip
+from PyQt5.QtCore import QRect, QSize, Qt
+from PyQt5.QtGui import QImage
+
+# files that might be plain uncompressed pixels. Whether one actually is gets decided from its header,
+# anything else (RLE bitmaps, compressed TIFFs, 16 bit PGMs...) goes through QImageReader like before
+MAPPED_EXTENSIONS = frozenset({"bmp", "dib", "ppm", "pgm", "pnm", "tif", "tiff", "npy"})
+
+# mapped images bigger than this get tiled. That's a lot lower than for everything else, since tiles
+# of a mapped image are just a copy of the rows that are on screen, not a decode
+MAPPED_TILED_MIN_PIXELS = 16 * 1000 * 1000
+
+NPY_FORMATS = {1: QImage.Format_Grayscale8, 3: QImage.Format_RGB888, 4: QImage.Format_RGBA8888}
+
+
+def isMappable(path):
+    return os.path.splitext(path)[1][1:].lower() in MAPPED_EXTENSIONS
+
+
+def parseBmp(data):
+    if data[:2] != b"BM" or len(data) < 34:
+        return None
+
+    offset, = struct.unpack_from("<I", data, 10)
+    width, height, planes, bitsPerPixel, compression = struct.unpack_from("<iiHHI", data, 18)
+    if compression != 0 or bitsPerPixel not in (24, 32):
+        return None
+
+    stride = (width * bitsPerPixel + 31) // 32 * 4
+    fmt = QImage.Format_BGR888 if bitsPerPixel == 24 else QImage.Format_RGB32
+    # positive heights are stored bottom row first
+    return offset, width, abs(height), stride, fmt, height > 0
+
+
+def parseTiff(data):
+    byteOrder = {b"II": "<", b"MM": ">"}.get(bytes(data[:2]))
+    if byteOrder is None or struct.unpack_from(byteOrder + "H", data, 2)[0] != 42:
+        return None
+
+    ifdOffset, = struct.unpack_from(byteOrder + "I", data, 4)
+    entryCount, = struct.unpack_from(byteOrder + "H", data, ifdOffset)
+
+    tags = {}
+    for i in range(entryCount):
+        tag, fieldType, count = struct.unpack_from(byteOrder + "HHI", data, ifdOffset + 2 + i * 12)
+        if fieldType not in (3, 4):
+            continue
+
+        valueFormat = "H" if fieldType == 3 else "I"
+        valueOffset = ifdOffset + 2 + i * 12 + 8
+        if count * struct.calcsize(valueFormat) > 4:
+            valueOffset, = struct.unpack_from(byteOrder + "I", data, valueOffset)
+        tags[tag] = struct.unpack_from(byteOrder + valueFormat * count, data, valueOffset)
+
+    width, height = tags.get(256, (0,))[0], tags.get(257, (0,))[0]
+    samples = tags.get(277, (1,))[0]
+    offsets, byteCounts = tags.get(273, ()), tags.get(279, ())
+    if (tags.get(259, (1,))[0] != 1 or tags.get(284, (1,))[0] != 1 or tags.get(274, (1,))[0] != 1
+            or any(bits != 8 for bits in tags.get(258, (1,))) or not offsets or len(offsets) != len(byteCounts)):
+        return None
+
+    # the strips have to follow each other directly, so the whole thing is one buffer
+    if any(offsets[i] + byteCounts[i] != offsets[i + 1] for i in range(len(offsets) - 1)):
+        return None
+
+    photometric = tags.get(262, (1,))[0]
+    if samples == 1 and photometric == 1:
+        fmt = QImage.Format_Grayscale8
+    elif samples == 3 and photometric == 2:
+        fmt = QImage.Format_RGB888
+    elif samples == 4 and photometric == 2:
+        fmt = QImage.Format_RGBA8888_Premultiplied if tags.get(338, (2,))[0] == 1 else QImage.Format_RGBA8888
+    else:
+        return None
+
+    return offsets[0], width, height, width * samples, fmt, False
+
+
+def parsePnm(data):
+    if data[:2] not in (b"P5", b"P6"):
+        return None
+
+    # magic, width, height and maxval, separated by whitespace and # comments
+    fields = []
+    position = 2
+    while len(fields) < 3:
+        while data[position:position + 1].isspace():
+            position += 1
+        if data[position:position + 1] == b"#":
+            while data[position:position + 1] not in (b"\n", b""):
+                position += 1
+            continue
+
+        start = position
+        while data[position:position + 1].isdigit():
+            position += 1
+        if start == position:
+            return None
+        fields.append(int(data[start:position]))
+
+    width, height, maxValue = fields
+    # anything else would need its values stretched to 0-255 (or is 16 bit), which QImageReader does
+    if maxValue != 255:
+        return None
+
+    channels = 1 if data[:2] == b"P5" else 3
+    # exactly one whitespace character comes before the pixels
+    return position + 1, width, height, width * channels, QImage.Format_Grayscale8 if channels == 1 else QImage.Format_RGB888, False
+
+
+def parseNpy(data):
+    if data[:6] != b"\x93NUMPY":
+        return None
+
+    if data[6] == 1:
+        headerLength, = struct.unpack_from("<H", data, 8)
+        headerStart = 10
+    else:
+        headerLength, = struct.unpack_from("<I", data, 8)
+        headerStart = 12
+
+    header = ast.literal_eval(bytes(data[headerStart:headerStart + headerLength]).decode("latin1"))
+    shape = header["shape"]
+    channels = 1 if len(shape) == 2 else shape[2] if len(shape) == 3 else 0
+    if header["descr"] not in ("|u1", "<u1", ">u1", "u1") or header["fortran_order"] or channels not in NPY_FORMATS:
+        return None
+
+    height, width = shape[:2]
+    return headerStart + headerLength, width, height, width * channels, NPY_FORMATS[channels], False
+
+
+PARSERS = {"bmp": parseBmp, "dib": parseBmp, "ppm": parsePnm, "pgm": parsePnm, "pnm": parsePnm,
+           "tif": parseTiff, "tiff": parseTiff, "npy": parseNpy}
+
+
+class MappedImage:
+    """An uncompressed image file mapped into memory, so there's no decoding to speak of.
+
+    Nothing gets read up front, the OS pages in whatever rows get copied out. read() always hands out a copy
+    (of just the rows it needs), since its images cross threads and end up in caches that can outlive the
+    mapping. Only view() points at the file itself. The file mapping is copy on write, but nothing ever writes
+    to it (ctypes just insists on a writable buffer)."""
+    def __init__(self, path, file, offset, width, height, stride, fmt, bottomUp):
+        self.path = path
+        self.map = file
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.format = fmt
+        self.bottomUp = bottomUp
+        self.bytesPerPixel = QImage(1, 1, fmt).depth() // 8
+
+        self.buffer = ctypes.c_char.from_buffer(file)
+        self.address = ctypes.addressof(self.buffer) + offset
+
+    def size(self):
+        return QSize(self.width, self.height)
+
+    def view(self, rect):
+        """A QImage pointing straight at rect's pixels in the file, no copy. It mustn't outlive this object.
+        For bottom up files, this is upside down (so rect is flipped first)."""
+        top = self.height - 1 - rect.bottom() if self.bottomUp else rect.top()
+        address = self.address + top * self.stride + rect.left() * self.bytesPerPixel
+        return QImage(sip.voidptr(address), rect.width(), rect.height(), self.stride, self.format)
+
+    def read(self, scaledSize=None, clipRect=None):
+        """Copies clipRect (default: everything) out of the file, fitted into scaledSize if given. That copy is the
+        only one, bottom up files get flipped while copying. Works like readImage(), and is just as thread safe."""
+        rect = QRect(clipRect) if clipRect is not None else QRect(0, 0, self.width, self.height)
+        rect = rect.intersected(QRect(0, 0, self.width, self.height))
+        if rect.isEmpty():
+            return QImage()
+
+        view = self.view(rect)
+        targetSize = rect.size()
+        if scaledSize is not None and (rect.width() > scaledSize.width() or rect.height() > scaledSize.height()):
+            targetSize = rect.size().scaled(scaledSize, Qt.KeepAspectRatio)
+
+        if targetSize == rect.size():
+            return view.mirrored(False, True) if self.bottomUp else view.copy()
+
+        if rect.width() > targetSize.width() * 2:
+            # sampling every nth row only touches those rows' pages, the smooth pass on top takes care of aliasing
+            image = view.scaled(targetSize * 2, Qt.IgnoreAspectRatio, Qt.FastTransformation)
+            image = image.scaled(targetSize, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        else:
+            image = view.scaled(targetSize, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+        return image.mirrored(False, True) if self.bottomUp else image
+
+
+def mapImage(path):
+    """Maps path if it's an uncompressed image whose pixels can be used as they are. Returns a MappedImage, or None."""
+    parser = PARSERS.get(os.path.splitext(path)[1][1:].lower())
+    if parser is None:
+        return None
+
+    try:
+        with open(path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        layout = parser(data)
+    except (struct.error, IndexError, KeyError, ValueError, SyntaxError, TypeError):
+        layout = None
+
+    if layout is None:
+        data.close()
+        return None
+
+    offset, width, height, stride, fmt, bottomUp = layout
+    if width <= 0 or height <= 0 or offset + stride * height > len(data):
+        data.close()
+        return None
+
+    return MappedImage(path, data, offset, width, height, stride, fmt, bottomUp)
@@ -0,0 +1,126 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QSettings, pyqtSignal
+
+from lib.metrics import recordMetric
+
+DEFAULT_BUDGET_MB = 1024
+
+memoryManager = None
+
+
+def getMemoryManager():
+    """Returns the memory manager shared by every tab."""
+    global memoryManager
+    if memoryManager is None:
+        settings = QSettings("AscentViewer", "AscentViewer")
+        memoryManager = ImageMemoryManager(int(settings.value("memory/budgetMB", DEFAULT_BUDGET_MB)) * 1024 * 1024)
+    return memoryManager
+
+
+class ImageMemoryManager(QObject):
+    """Keeps track of how much memory every tab's decoded images take up, and makes background tabs let go of theirs
+    once the total goes over the budget. Tabs that are on screen are never asked to release anything.
+
+    Every owner (usually a tab) reports its usage with update(), and gets its release callback called when it has
+    to shrink. The callback is expected to drop whatever it can rebuild later and report its new usage."""
+    usageChanged = pyqtSignal(int, int)
+
+    def __init__(self, budgetBytes, parent=None):
+        super().__init__(parent)
+
+        self.budgetBytes = budgetBytes
+        # owner -> {"label", "bytes", "release", "active"}, least recently active first
+        self.owners = OrderedDict()
+        self.enforcing = False
+
+    def register(self, owner, label, releaseCallback):
+        self.owners[owner] = {"label": label, "bytes": 0, "release": releaseCallback, "active": False}
+
+    def unregister(self, owner):
+        if self.owners.pop(owner, None) is not None:
+            self.usageChanged.emit(self.usedBytes(), self.budgetBytes)
+
+    def update(self, owner, byteCount, label=None):
+        """Reports owner's current usage."""
+        entry = self.owners.get(owner)
+        if entry is None:
+            return
+
+        entry["bytes"] = byteCount
+        if label is not None:
+            entry["label"] = label
+        recordMetric("memoryBytes", byteCount, owner)
+
+        self.usageChanged.emit(self.usedBytes(), self.budgetBytes)
+        self.enforce()
+
+    def setActive(self, owner, active):
+        """Marks owner as on screen (never released) or in the background."""
+        entry = self.owners.get(owner)
+        if entry is None:
+            return
+
+        entry["active"] = active
+        if active:
+            self.owners.move_to_end(owner)
+        else:
+            self.enforce()
+
+    def setBudget(self, budgetBytes):
+        self.budgetBytes = budgetBytes
+        QSettings("AscentViewer", "AscentViewer").setValue("memory/budgetMB", budgetBytes // (1024 * 1024))
+        self.usageChanged.emit(self.usedBytes(), self.budgetBytes)
+        self.enforce()
+
+    def usedBytes(self):
+        return sum(entry["bytes"] for entry in self.owners.values())
+
+    def enforce(self):
+        """Releases background owners, least recently shown first, until usage is back under the budget."""
+        # release callbacks report their new usage, which would land right back here
+        if self.enforcing:
+            return
+
+        self.enforcing = True
+        try:
+            for owner, entry in list(self.owners.items()):
+                if self.usedBytes() <= self.budgetBytes:
+                    break
+                if not entry["active"] and entry["bytes"] > 0:
+                    entry["release"]()
+        finally:
+            self.enforcing = False
+
+    def report(self):
+        """Returns [(label, bytes, active)] for every owner, biggest first."""
+        return sorted(((entry["label"], entry["bytes"], entry["active"]) for entry in self.owners.values()),
+                      key=lambda item: item[1], reverse=True)
+
+    def printReport(self):
+        print("Image memory\n=====================================================")
+        for label, byteCount, active in self.report():
+            print(f'{label}: {byteCount / (1024 * 1024):.1f} MB{" (on screen)" if active else ""}')
+        print(f"Total: {self.usedBytes() / (1024 * 1024):.1f} of {self.budgetBytes / (1024 * 1024):.0f} MB")
@@ -0,0 +1,383 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from PyQt5.QtCore import QObject, QRunnable, Qt, QThreadPool, pyqtSignal
+
+from lib.image.loader import probeImage
+from lib.paths import getCacheDir
+
+# only this much of a file is read for its metadata, which is plenty for JPEG headers.
+# TIFF values that live further in just don't get picked up
+HEADER_BYTES = 256 * 1024
+
+# how many files one indexing task handles (they share a SELECT and a transaction)
+INDEX_BATCH = 256
+
+# bumped whenever the extractor changes in a way that makes old rows wrong
+METADATA_VERSION = 1
+
+ImageMetadata = namedtuple("ImageMetadata", ["path", "mtimeNs", "fileSize", "width", "height", "format", "captureTime",
+                                             "make", "model", "orientation", "keywords", "caption"])
+
+# tiff tags
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_DATE_TIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1}
+
+# iptc datasets (record 2)
+IPTC_KEYWORDS = 25
+IPTC_CAPTION = 120
+
+
+def parseTiffTags(tiff):
+    """Returns {tag: value} for the tags we care about from a TIFF structure (which is what EXIF is)."""
+    byteOrder = {b"II": "<", b"MM": ">"}.get(bytes(tiff[:2]))
+    if byteOrder is None:
+        return {}
+
+    def readIfd(offset):
+        entries = {}
+        count, = struct.unpack_from(byteOrder + "H", tiff, offset)
+        for i in range(count):
+            position = offset + 2 + i * 12
+            tag, fieldType, valueCount = struct.unpack_from(byteOrder + "HHI", tiff, position)
+            size = TIFF_TYPE_SIZES.get(fieldType, 0) * valueCount
+            if not size:
+                continue
+
+            valuePosition = position + 8 if size <= 4 else struct.unpack_from(byteOrder + "I", tiff, position + 8)[0]
+            if fieldType == 2:
+                entries[tag] = bytes(tiff[valuePosition:valuePosition + size]).split(b"\0")[0].decode("utf-8", "replace").strip()
+            elif fieldType == 3:
+                entries[tag] = struct.unpack_from(byteOrder + "H", tiff, valuePosition)[0]
+            elif fieldType == 4:
+                entries[tag] = struct.unpack_from(byteOrder + "I", tiff, valuePosition)[0]
+        return entries
+
+    tags = readIfd(struct.unpack_from(byteOrder + "I", tiff, 4)[0])
+    if TAG_EXIF_IFD in tags:
+        tags.update(readIfd(tags[TAG_EXIF_IFD]))
+    return tags
+
+
+def parseIptc(resources):
+    """Returns (keywords, caption) from a Photoshop image resource block (JPEG APP13)."""
+    keywords = []
+    caption = None
+
+    position = 0
+    while resources[position:position + 4] == b"8BIM":
+        resourceId, = struct.unpack_from(">H", resources, position + 4)
+        # the name is a pascal string, padded to an even length
+        nameLength = resources[position + 6]
+        position += 6 + (nameLength + 2) // 2 * 2
+        size, = struct.unpack_from(">I", resources, position)
+        data = resources[position + 4:position + 4 + size]
+        position += 4 + (size + 1) // 2 * 2
+
+        if resourceId != 0x0404:
+            continue
+
+        # IPTC-IIM: 0x1C, record, dataset, length, value
+        offset = 0
+        while offset + 5 <= len(data) and data[offset] == 0x1C:
+            record, dataset, length = data[offset + 1], data[offset + 2], struct.unpack_from(">H", data, offset + 3)[0]
+            value = bytes(data[offset + 5:offset + 5 + length]).decode("utf-8", "replace").strip()
+            offset += 5 + length
+            if record == 2 and dataset == IPTC_KEYWORDS:
+                keywords.append(value)
+            elif record == 2 and dataset == IPTC_CAPTION:
+                caption = value
+
+    return keywords, caption
+
+
+def parseJpegHeader(header):
+    """Returns (tiffTags, keywords, caption) from the APP segments of a JPEG."""
+    tags, keywords, caption = {}, [], None
+    if header[:2] != b"\xff\xd8":
+        return tags, keywords, caption
+
+    position = 2
+    while position + 4 <= len(header) and header[position] == 0xFF:
+        marker = header[position + 1]
+        # start of scan, the pixels come next
+        if marker == 0xDA:
+            break
+
+        length, = struct.unpack_from(">H", header, position + 2)
+        segment = header[position + 4:position + 2 + length]
+        if marker == 0xE1 and segment[:6] == b"Exif\0\0":
+            tags = parseTiffTags(segment[6:])
+        elif marker == 0xED and segment[:14] == b"Photoshop 3.0\0":
+            keywords, caption = parseIptc(segment[14:])
+        position += 2 + length
+
+    return tags, keywords, caption
+
+
+def captureTimeFromExif(value):
+    """'2021:06:14 18:03:22' -> '2021-06-14 18:03:22', which sorts properly as a string."""
+    if not value or len(value) < 19 or value.startswith("0000"):
+        return None
+    return value[:4] + "-" + value[5:7] + "-" + value[8:10] + value[10:19]
+
+
+def readMetadata(path, stat=None):
+    """Reads path's metadata from its headers only (nothing gets decoded). Returns an ImageMetadata, or None."""
+    try:
+        stat = stat if stat is not None else os.stat(path)
+        with open(path, "rb") as file:
+            header = file.read(HEADER_BYTES)
+    except OSError:
+        return None
+
+    tags, keywords, caption = {}, [], None
+    try:
+        if header[:2] == b"\xff\xd8":
+            tags, keywords, caption = parseJpegHeader(header)
+        elif header[:4] in (b"II*\0", b"MM\0*"):
+            tags = parseTiffTags(header)
+    except (struct.error, IndexError):
+        # a broken or truncated header still gets a row, just without the extras
+        pass
+
+    size, mapped = probeImage(path)
+    width, height = (size.width(), size.height()) if size.isValid() else (0, 0)
+    orientation = tags.get(TAG_ORIENTATION, 1)
+    # 5 to 8 are the rotated ones, which is how the image gets shown
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+
+    return ImageMetadata(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, width, height,
+                         os.path.splitext(path)[1][1:].lower(),
+                         captureTimeFromExif(tags.get(TAG_DATE_TIME_ORIGINAL) or tags.get(TAG_DATE_TIME)),
+                         tags.get(TAG_MAKE) or None, tags.get(TAG_MODEL) or None, orientation,
+                         ";".join(keywords) or None, caption)
+
+
+def captureTimeOrMtime(record):
+    """The capture time if the file has one, otherwise its modification time (in the same format)."""
+    return record.captureTime or time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.mtimeNs / 1e9))
+
+
+def cameraName(record):
+    if record.make and record.model and not record.model.startswith(record.make):
+        return f"{record.make} {record.model}"
+    return record.model or record.make
+
+
+class MetadataIndex:
+    """Every image's metadata in a SQLite file next to the thumbnails. Like ThumbnailStore, every thread
+    gets its own connection."""
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.path.join(getCacheDir(), "metadata.sqlite")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        db = self.connection()
+        if db.execute("PRAGMA user_version").fetchone()[0] != METADATA_VERSION:
+            db.execute("DROP TABLE IF EXISTS metadata")
+            db.execute(f"PRAGMA user_version = {METADATA_VERSION}")
+
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                mtimeNs INTEGER NOT NULL,
+                fileSize INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                format TEXT,
+                captureTime TEXT,
+                make TEXT,
+                model TEXT,
+                orientation INTEGER,
+                keywords TEXT,
+                caption TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS metadataFolder ON metadata (folder);
+        """)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def lookup(self, paths):
+        """Returns {path: ImageMetadata} for every path in paths that has a row."""
+        db = self.connection()
+        records = {}
+        # SQLite caps the number of parameters, so this goes in slices
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            query = (f"SELECT path, mtimeNs, fileSize, width, height, format, captureTime, make, model, orientation, "
+                     f"keywords, caption FROM metadata WHERE path IN ({','.join('?' * len(chunk))})")
+            for row in db.execute(query, chunk):
+                records[row[0]] = ImageMetadata(*row)
+        return records
+
+    def store(self, records):
+        if not records:
+            return
+
+        db = self.connection()
+        with self.lock:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(record.path, os.path.dirname(record.path)) + tuple(record[1:]) for record in records])
+            db.execute("COMMIT")
+
+    def forget(self, paths):
+        db = self.connection()
+        with self.lock:
+            db.executemany("DELETE FROM metadata WHERE path = ?", [(os.path.abspath(path),) for path in paths])
+
+
+metadataIndex = None
+
+
+def getMetadataIndex():
+    global metadataIndex
+    if metadataIndex is None:
+        metadataIndex = MetadataIndex()
+    return metadataIndex
+
+
+class MetadataSignals(QObject):
+    # requestId, a list of ImageMetadata
+    finished = pyqtSignal(int, list)
+    # requestId, once the task is done with (whether it indexed anything or not)
+    retired = pyqtSignal(int)
+
+
+class MetadataTask(QRunnable):
+    def __init__(self, requestId, paths, indexer):
+        super().__init__()
+
+        self.requestId = requestId
+        self.paths = paths
+        self.indexer = indexer
+        self.signals = indexer.signals
+
+    def run(self):
+        try:
+            self.indexPaths()
+        finally:
+            self.signals.retired.emit(self.requestId)
+
+    def indexPaths(self):
+        if not self.indexer.isPending(self.requestId):
+            return
+
+        known = self.indexer.index.lookup(self.paths)
+        records, fresh = [], []
+
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            # rows are only trusted while the file's mtime and size still match
+            record = known.get(path)
+            if record is None or record.mtimeNs != stat.st_mtime_ns or record.fileSize != stat.st_size:
+                record = readMetadata(path, stat)
+                if record is None:
+                    continue
+                fresh.append(record)
+            records.append(record)
+
+        self.indexer.index.store(fresh)
+        self.signals.finished.emit(self.requestId, records)
+
+
+class MetadataIndexer(QObject):
+    """Gets the metadata of whole folders into the index on a worker pool, handing back what it found in batches."""
+    metadataReady = pyqtSignal(list)
+
+    def __init__(self, index=None, parent=None):
+        super().__init__(parent)
+
+        self.index = index if index is not None else getMetadataIndex()
+
+        # headers only, but that's still a lot of small reads on a big folder. Kept apart from decoding for that reason
+        self.threadPool = QThreadPool(self)
+        self.threadPool.setMaxThreadCount(2)
+        self.signals = MetadataSignals()
+        self.signals.finished.connect(self.onTaskFinished, Qt.QueuedConnection)
+        self.signals.retired.connect(self.onTaskRetired, Qt.QueuedConnection)
+        self.nextRequestId = 0
+        self.pendingTasks = {}
+        # tasks stay referenced until they've reported back, cancelled ones too. Letting go of one the pool has
+        # already picked up would delete it out from under the pool thread
+        self.tasks = {}
+
+    def request(self, paths):
+        """Queues paths (absolute) for indexing. metadataReady comes back with their records, one batch at a time."""
+        for start in range(0, len(paths), INDEX_BATCH):
+            self.nextRequestId += 1
+            task = MetadataTask(self.nextRequestId, paths[start:start + INDEX_BATCH], self)
+            task.setAutoDelete(False)
+            self.pendingTasks[self.nextRequestId] = task
+            self.tasks[self.nextRequestId] = task
+            self.threadPool.start(task)
+
+    def isPending(self, requestId):
+        return requestId in self.pendingTasks
+
+    def isIdle(self):
+        return not self.pendingTasks
+
+    def cancelAll(self):
+        # the ones that are already running stay in tasks, their results just get dropped
+        for requestId, task in self.pendingTasks.items():
+            if self.threadPool.tryTake(task):
+                del self.tasks[requestId]
+        self.pendingTasks.clear()
+
+    def forget(self, paths):
+        self.index.forget(paths)
+
+    def onTaskRetired(self, requestId):
+        self.tasks.pop(requestId, None)
+
+    def onTaskFinished(self, requestId, records):
+        # results of cancelled requests (e.g. from the previous folder) get dropped
+        if self.pendingTasks.pop(requestId, None) is not None:
+            self.metadataReady.emit(records)
@@ -0,0 +1,140 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QSize, pyqtSignal
+
+from lib.image.loader import ImageLoader
+from lib.image.tiles import TILED_MIN_PIXELS
+
+
+def imageBytes(image):
+    return image.sizeInBytes()
+
+
+class PrefetchCache(QObject):
+    """Decodes the images around the current one ahead of time and keeps them within a memory budget.
+
+    Images are kept as QImages (so they can be decoded on any thread), the viewer turns them into pixmaps."""
+    imageReady = pyqtSignal(str)
+    prefetchFailed = pyqtSignal(str)
+
+    def __init__(self, maxBytes=512 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+
+        self.maxBytes = maxBytes
+        self.usedBytes = 0
+        self.images = OrderedDict()
+
+        self.wanted = []
+        self.requests = {}
+        # big JPEGs only get decoded as big as this (the viewer's size), see readDisplayImage
+        self.displaySize = None
+
+        self.loader = ImageLoader(self)
+        self.loader.imageLoaded.connect(self.onImageLoaded)
+        self.loader.loadFailed.connect(self.onLoadFailed)
+        self.loader.imageTooLarge.connect(self.onLoadFailed)
+
+    def get(self, path):
+        """Returns the cached QImage for path (or None) and marks it as recently used."""
+        image = self.images.get(path)
+        if image is not None:
+            self.images.move_to_end(path)
+        return image
+
+    def isLoading(self, path):
+        return path in self.requests
+
+    def insert(self, path, image):
+        if path in self.images:
+            self.usedBytes -= imageBytes(self.images.pop(path))
+
+        self.images[path] = image
+        self.usedBytes += imageBytes(image)
+        self.evict()
+
+    def prefetch(self, paths):
+        """Makes sure paths (closest first) are decoded or being decoded. Anything else that's still queued gets cancelled."""
+        self.wanted = list(paths)
+
+        for path in list(self.requests):
+            if path not in self.wanted:
+                self.loader.cancel(self.requests.pop(path))
+
+        for path in self.wanted:
+            if path not in self.images and path not in self.requests:
+                # lower priority than whatever the viewer itself is loading
+                self.requests[path] = self.loader.load(path, priority=-1 - self.wanted.index(path),
+                                                      maxPixels=TILED_MIN_PIXELS, displaySize=self.displaySize)
+
+    def setDisplaySize(self, size):
+        """Sets the size images get decoded at from now on. What's cached stays, the viewer upgrades those itself if needed."""
+        self.displaySize = QSize(size)
+
+    def evict(self):
+        """Drops images until we're under budget, unwanted ones first (least recently used), then the furthest wanted ones."""
+        if self.usedBytes <= self.maxBytes:
+            return
+
+        wanted = set(self.wanted)
+        candidates = [path for path in self.images if path not in wanted]
+        candidates += [path for path in reversed(self.wanted) if path in self.images]
+
+        # always keep the most recently used image, even if it's over budget on its own
+        for path in candidates:
+            if self.usedBytes <= self.maxBytes or len(self.images) <= 1:
+                break
+            self.usedBytes -= imageBytes(self.images.pop(path))
+
+    def retainOnly(self, paths):
+        """Drops every decoded image except the ones for paths, however much of the budget is left."""
+        for path in [path for path in self.images if path not in paths]:
+            self.usedBytes -= imageBytes(self.images.pop(path))
+
+    def invalidate(self, path):
+        """Forgets path, e.g. because the file changed on disk."""
+        if path in self.images:
+            self.usedBytes -= imageBytes(self.images.pop(path))
+        if path in self.requests:
+            self.loader.cancel(self.requests.pop(path))
+
+    def clear(self):
+        self.loader.cancelAll()
+        self.requests.clear()
+        self.images.clear()
+        self.wanted = []
+        self.usedBytes = 0
+
+    def onImageLoaded(self, requestId, path, image):
+        if self.requests.get(path) != requestId:
+            return
+
+        del self.requests[path]
+        self.insert(path, image)
+        self.imageReady.emit(path)
+
+    def onLoadFailed(self, requestId, path, *args):
+        if self.requests.get(path) == requestId:
+            del self.requests[path]
+            self.prefetchFailed.emit(path)
@@ -0,0 +1,129 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
+
+from lib.metrics import recordHit, recordMetric
+
+# levels smaller than this aren't worth keeping around
+MIN_LEVEL_SIDE = 64
+
+
+def pixmapBytes(pixmap):
+    """Returns a rough estimate of how much memory a pixmap takes up."""
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+class ScaledPixmapCache:
+    def __init__(self, pixmap, maxBytes=64 * 1024 * 1024):
+        """Init function. Wraps pixmap with a mip pyramid and an LRU of scaled copies (bounded by maxBytes)."""
+        self.source = pixmap
+        self.maxBytes = maxBytes
+        self.usedBytes = 0
+
+        # levels[0] is the source, every next level is half the size of the previous one.
+        # they're only built when something actually asks for them
+        self.levels = [pixmap]
+        self.scaledCopies = OrderedDict()
+
+    def isNull(self):
+        return self.source.isNull()
+
+    def level(self, index):
+        """Returns the pyramid level at index, building the missing levels on the way."""
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            if min(previous.width(), previous.height()) // 2 < MIN_LEVEL_SIDE:
+                break
+
+            self.levels.append(previous.scaled(previous.width() // 2, previous.height() // 2,
+                                               Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+
+        return self.levels[min(index, len(self.levels) - 1)]
+
+    def nearestLevel(self, size):
+        """Returns the smallest pyramid level that is still at least as big as size (so we only ever scale down)."""
+        # the image is fit with KeepAspectRatio, so compare against the fitted size rather than size itself
+        fitted = self.source.size().scaled(size, Qt.KeepAspectRatio)
+        width, height = self.source.width(), self.source.height()
+        index = 0
+
+        while (min(width // 2, height // 2) >= MIN_LEVEL_SIDE
+               and width // 2 >= fitted.width() and height // 2 >= fitted.height()):
+            width, height = width // 2, height // 2
+            index += 1
+
+        return self.level(index)
+
+    def levelForScale(self, scale):
+        """Returns the smallest pyramid level that still has at least one pixel per screen pixel at scale
+        (screen pixels per source pixel)."""
+        index = 0
+        while scale * 2 ** (index + 1) <= 1:
+            index += 1
+
+        return self.level(index)
+
+    def scaled(self, size, smooth=True):
+        """Returns the source fitted into size. Smooth results are cached, fast ones are cheap enough to just redo."""
+        if self.isNull():
+            return QPixmap()
+
+        key = (size.width(), size.height())
+        if smooth:
+            recordHit("scaledCacheHit", key in self.scaledCopies)
+            if key in self.scaledCopies:
+                self.scaledCopies.move_to_end(key)
+                return self.scaledCopies[key]
+
+        start = time.perf_counter()
+        pixmap = self.nearestLevel(size).scaled(size, Qt.KeepAspectRatio,
+                                                Qt.SmoothTransformation if smooth else Qt.FastTransformation)
+        recordMetric("scaleMs", (time.perf_counter() - start) * 1000, "smooth" if smooth else "fast")
+
+        if smooth:
+            self.scaledCopies[key] = pixmap
+            self.usedBytes += pixmapBytes(pixmap)
+            self._evict()
+
+        return pixmap
+
+    def _evict(self):
+        """Drops the least recently used scaled copies until we're back under the budget."""
+        # always keep the newest copy, even if it alone goes over the budget
+        while self.usedBytes > self.maxBytes and len(self.scaledCopies) > 1:
+            key, pixmap = self.scaledCopies.popitem(last=False)
+            self.usedBytes -= pixmapBytes(pixmap)
+
+    def totalBytes(self):
+        """Memory taken up by the source, the pyramid and the scaled copies together."""
+        return sum(pixmapBytes(level) for level in self.levels) + self.usedBytes
+
+    def clear(self):
+        """Releases every level and scaled copy except the source."""
+        self.levels = [self.source]
+        self.scaledCopies.clear()
+        self.usedBytes = 0
@@ -0,0 +1,235 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import time
+
+from PyQt5.QtCore import QObject, QSettings, QSize, QTimer
+from PyQt5.QtGui import QPixmap
+
+from lib.image.loader import fullImageSize
+from lib.image.scaled_cache import ScaledPixmapCache
+from lib.metrics import recordMetric
+
+SLIDESHOW_INTERVALS = (2000, 5000, 10000, 30000, 60000)
+DEFAULT_SLIDESHOW_INTERVAL = 5000
+
+# what decoding and preparing an image is assumed to take (in ms) until the first ones have been measured
+INITIAL_DECODE_ESTIMATE = 1000
+INITIAL_PREPARE_ESTIMATE = 200
+
+# how much the newest measurement counts in the running estimates
+ESTIMATE_WEIGHT = 0.3
+
+# on top of the estimates, so an image that's a bit slower than the average still makes it in time
+SAFETY_MARGIN = 500
+
+# the most images that are ever decoded ahead, however slow decoding is compared to the interval.
+# this is what keeps memory flat, it doesn't matter how many images the folder has or how long the show runs
+MAX_LOOKAHEAD = 3
+
+
+class SlideshowScheduler(QObject):
+    """Steps a FolderModel forward every interval, getting each next image decoded (through the PrefetchCache) and
+    turned into a screen sized pixmap just in time for its turn.
+
+    Decoding starts lead time before an image's deadline, where lead time is the measured decode and prepare times
+    (running averages) plus a safety margin. If that's longer than the interval, images further ahead get started
+    too, up to MAX_LOOKAHEAD. Nothing else gets decoded or kept."""
+    def __init__(self, folderModel, prefetchCache, parent=None):
+        super().__init__(parent)
+
+        self.folderModel = folderModel
+        self.prefetchCache = prefetchCache
+        self.prefetchCache.imageReady.connect(self.onImageReady)
+        self.prefetchCache.prefetchFailed.connect(self.onPrefetchFailed)
+
+        self.interval = int(QSettings("AscentViewer", "AscentViewer").value("slideshow/intervalMs", DEFAULT_SLIDESHOW_INTERVAL))
+        self.running = False
+        self.targetSize = QSize()
+
+        self.decodeEstimate = INITIAL_DECODE_ESTIMATE
+        self.prepareEstimate = INITIAL_PREPARE_ESTIMATE
+        # path -> when its decode was asked for (perf_counter seconds)
+        self.requestTimes = {}
+        # (path, pixmap, ScaledPixmapCache, full image size) of the next image, ready to go on screen
+        self.prepared = None
+
+        self.shownAt = 0
+        self.stalledSince = None
+
+        self.preloadTimer = QTimer(self)
+        self.preloadTimer.setSingleShot(True)
+        self.preloadTimer.timeout.connect(self.preload)
+        self.advanceTimer = QTimer(self)
+        self.advanceTimer.setSingleShot(True)
+        self.advanceTimer.timeout.connect(self.onDeadline)
+
+    def start(self, targetSize):
+        self.running = True
+        self.targetSize = QSize(targetSize)
+        self.slideShown()
+
+    def stop(self):
+        self.running = False
+        self.preloadTimer.stop()
+        self.advanceTimer.stop()
+        self.requestTimes.clear()
+        self.prepared = None
+        self.stalledSince = None
+
+    def isRunning(self):
+        return self.running
+
+    def setInterval(self, interval):
+        self.interval = interval
+        QSettings("AscentViewer", "AscentViewer").setValue("slideshow/intervalMs", interval)
+        if self.running:
+            self.slideShown()
+
+    def setTargetSize(self, size):
+        """The size images get prepared at, i.e. the canvas size."""
+        if size != self.targetSize:
+            self.targetSize = QSize(size)
+            # scaled for the old size, it'd just get scaled again on screen
+            self.prepared = None
+
+    def leadTime(self):
+        return self.decodeEstimate + self.prepareEstimate + SAFETY_MARGIN
+
+    def upcoming(self, count):
+        """The paths of the next count images, wrapping around at the end of the folder."""
+        paths, index = self.folderModel.paths, self.folderModel.currentIndex
+        if index == -1 or len(paths) < 2:
+            return []
+        return [paths[(index + step) % len(paths)] for step in range(1, min(count, len(paths) - 1) + 1)]
+
+    def slideShown(self):
+        """Called by the viewer whenever an image has gone on screen, which starts the next interval."""
+        if not self.running:
+            return
+
+        self.shownAt = time.perf_counter()
+        self.stalledSince = None
+        self.advanceTimer.start(self.interval)
+        self.preload()
+
+    def preload(self):
+        """Starts decoding every upcoming image whose start time (its deadline minus the lead time) has come, then
+        sets the timer for the next one."""
+        if not self.running:
+            return
+
+        elapsed = (time.perf_counter() - self.shownAt) * 1000
+        lead = self.leadTime()
+        due, nextStart = [], None
+
+        upcoming = self.upcoming(min(MAX_LOOKAHEAD, 1 + int(lead // self.interval)))
+        for step, path in enumerate(upcoming, 1):
+            startAt = step * self.interval - lead
+            if startAt <= elapsed or self.stalledSince is not None:
+                due.append(path)
+            elif nextStart is None:
+                nextStart = startAt
+
+        for path in due:
+            if self.prefetchCache.get(path) is None and not self.prefetchCache.isLoading(path):
+                self.requestTimes[path] = time.perf_counter()
+
+        # anything the show won't need (including what's on screen now, the viewer has its own copy) gets let go
+        self.prefetchCache.prefetch(due)
+        self.prefetchCache.retainOnly(set(upcoming))
+
+        if due and self.prepared is None and self.prefetchCache.get(due[0]) is not None:
+            self.prepare(due[0])
+
+        if nextStart is not None:
+            self.preloadTimer.start(max(0, int(nextStart - elapsed)))
+
+    def prepare(self, path):
+        """Makes the pixmap for path and its screen sized copy now, instead of when it's due on screen."""
+        start = time.perf_counter()
+        image = self.prefetchCache.get(path)
+        pixmap = QPixmap.fromImage(image)
+        cache = ScaledPixmapCache(pixmap)
+        if self.targetSize.isValid():
+            cache.scaled(self.targetSize)
+
+        seconds = time.perf_counter() - start
+        self.prepareEstimate += ESTIMATE_WEIGHT * (seconds * 1000 - self.prepareEstimate)
+        recordMetric("slideshowPrepareMs", seconds * 1000)
+        self.prepared = (path, pixmap, cache, fullImageSize(image))
+
+    def takePrepared(self, path):
+        """Returns (pixmap, ScaledPixmapCache, full image size) for path if it has been prepared (and forgets it),
+        otherwise None."""
+        if self.prepared is None or self.prepared[0] != path:
+            return None
+
+        prepared = self.prepared[1:]
+        self.prepared = None
+        return prepared
+
+    def onImageReady(self, path):
+        requestTime = self.requestTimes.pop(path, None)
+        if not self.running:
+            return
+
+        if requestTime is not None:
+            milliseconds = (time.perf_counter() - requestTime) * 1000
+            self.decodeEstimate += ESTIMATE_WEIGHT * (milliseconds - self.decodeEstimate)
+
+        upcoming = self.upcoming(1)
+        if upcoming and path == upcoming[0]:
+            self.prepare(path)
+            if self.stalledSince is not None:
+                self.advance()
+
+    def onPrefetchFailed(self, path):
+        self.requestTimes.pop(path, None)
+
+        # e.g. it needs tiled mode, which only the viewer can set up once it's the current image. So that one is late,
+        # the viewer restarts the interval once it's on screen
+        upcoming = self.upcoming(1)
+        if self.running and self.stalledSince is not None and upcoming and path == upcoming[0]:
+            self.advance()
+
+    def onDeadline(self):
+        upcoming = self.upcoming(1)
+        if not upcoming:
+            return
+
+        if self.prepared is None and self.prefetchCache.get(upcoming[0]) is not None:
+            self.prepare(upcoming[0])
+
+        if self.prepared is not None and self.prepared[0] == upcoming[0]:
+            self.advance()
+            return
+
+        # late: move on as soon as it's there
+        self.stalledSince = time.perf_counter()
+        self.preload()
+
+    def advance(self):
+        if self.stalledSince is not None:
+            recordMetric("slideshowStallMs", (time.perf_counter() - self.stalledSince) * 1000)
+            self.stalledSince = None
+        self.folderModel.next()
@@ -0,0 +1,264 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QObject, QRunnable, QSize, Qt, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from lib.image.loader import readImage
+from lib.metrics import recordHit
+from lib.paths import getCacheDir
+
+# thumbnails are fit into a square this big
+THUMBNAIL_SIZE = 256
+
+# once the store gets this big, the least recently used thumbnails get thrown out
+THUMBNAIL_STORE_MAX_BYTES = 512 * 1024 * 1024
+
+# how much gets evicted past the cap in one go, so we don't evict on every single insert
+EVICTION_SLACK = 0.9
+
+thumbnailStore = None
+
+
+def getThumbnailStore():
+    """Returns the ThumbnailStore shared by everything that doesn't bring its own."""
+    global thumbnailStore
+    if thumbnailStore is None:
+        thumbnailStore = ThumbnailStore()
+    return thumbnailStore
+
+
+def thumbnailKey(path):
+    """Returns the cache key for path: a hash of its absolute path, mtime and size (so edited files get new thumbnails).
+    Returns None if the file can't be stat'd."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return hashlib.sha1(f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}".encode("utf-8")).digest()
+
+
+def encodeThumbnail(image):
+    """Compresses a thumbnail for storage. JPEG unless it has transparency."""
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+
+    if image.hasAlphaChannel():
+        image.save(buffer, "PNG")
+    else:
+        image.save(buffer, "JPEG", 85)
+
+    return bytes(data)
+
+
+class ThumbnailStore:
+    """Thumbnails packed into a single SQLite file. Every thread gets its own connection, so workers can read and
+    write it directly."""
+
+    def __init__(self, path=None, maxBytes=THUMBNAIL_STORE_MAX_BYTES):
+        self.path = path if path is not None else os.path.join(getCacheDir(), "thumbnails.sqlite")
+        self.maxBytes = maxBytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        db = self.connection()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                key BLOB PRIMARY KEY,
+                path TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                lastAccess INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS thumbnailsLastAccess ON thumbnails (lastAccess);
+            CREATE INDEX IF NOT EXISTS thumbnailsPath ON thumbnails (path);
+        """)
+        self.totalBytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails").fetchone()[0]
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def get(self, key):
+        """Returns the stored (encoded) thumbnail for key, or None."""
+        db = self.connection()
+        row = db.execute("SELECT data FROM thumbnails WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        db.execute("UPDATE thumbnails SET lastAccess = ? WHERE key = ?", (int(time.time()), key))
+        return row[0]
+
+    def put(self, key, path, data):
+        db = self.connection()
+        path = os.path.abspath(path)
+
+        with self.lock:
+            # older versions of the same file will never be asked for again
+            freed = db.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails WHERE path = ?", (path,)).fetchone()[0]
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM thumbnails WHERE path = ?", (path,))
+            db.execute("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?)", (key, path, data, len(data), int(time.time())))
+            db.execute("COMMIT")
+            self.totalBytes += len(data) - freed
+
+            if self.totalBytes > self.maxBytes:
+                self.evict(db)
+
+    def evict(self, db):
+        """Deletes the least recently used thumbnails until the store is comfortably under the cap."""
+        target = self.maxBytes * EVICTION_SLACK
+        freed = 0
+        keys = []
+
+        for key, size in db.execute("SELECT key, size FROM thumbnails ORDER BY lastAccess"):
+            if self.totalBytes - freed <= target:
+                break
+            keys.append((key,))
+            freed += size
+
+        db.execute("BEGIN IMMEDIATE")
+        db.executemany("DELETE FROM thumbnails WHERE key = ?", keys)
+        db.execute("COMMIT")
+        self.totalBytes -= freed
+
+    def invalidate(self, path):
+        """Forgets every thumbnail of path."""
+        db = self.connection()
+        with self.lock:
+            path = os.path.abspath(path)
+            freed = db.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails WHERE path = ?", (path,)).fetchone()[0]
+            db.execute("DELETE FROM thumbnails WHERE path = ?", (path,))
+            self.totalBytes -= freed
+
+
+class ThumbnailSignals(QObject):
+    # path, thumbnail
+    finished = pyqtSignal(str, QImage)
+    # the task, once it's done with (whether it made a thumbnail or not)
+    retired = pyqtSignal(object)
+
+
+class ThumbnailTask(QRunnable):
+    def __init__(self, path, provider):
+        super().__init__()
+
+        self.path = path
+        self.provider = provider
+        self.signals = provider.signals
+
+    def run(self):
+        try:
+            self.makeThumbnail()
+        finally:
+            self.signals.retired.emit(self)
+
+    def makeThumbnail(self):
+        if not self.provider.isPending(self.path):
+            return
+
+        key = thumbnailKey(self.path)
+        if key is None:
+            self.signals.finished.emit(self.path, QImage())
+            return
+
+        data = self.provider.store.get(key)
+        recordHit("thumbnailStoreHit", data is not None)
+        if data is not None:
+            self.signals.finished.emit(self.path, QImage.fromData(data))
+            return
+
+        # JPEGs get scaled while they're decoded, so those never get decoded whole. Other formats do, then get scaled
+        image, error = readImage(self.path, QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        if not image.isNull():
+            if image.width() > THUMBNAIL_SIZE or image.height() > THUMBNAIL_SIZE:
+                image = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.provider.store.put(key, self.path, encodeThumbnail(image))
+
+        self.signals.finished.emit(self.path, image)
+
+
+class ThumbnailProvider(QObject):
+    """Hands out thumbnails, generating (and storing) the ones that aren't in the store yet on a worker pool."""
+    thumbnailReady = pyqtSignal(str, QImage)
+
+    def __init__(self, store=None, parent=None):
+        super().__init__(parent)
+
+        self.store = store if store is not None else getThumbnailStore()
+
+        # separate from the decode pool, so a folder full of thumbnails never holds up the image being looked at
+        self.threadPool = QThreadPool(self)
+        self.signals = ThumbnailSignals()
+        self.signals.finished.connect(self.onTaskFinished, Qt.QueuedConnection)
+        self.signals.retired.connect(self.onTaskRetired, Qt.QueuedConnection)
+        self.pendingTasks = {}
+        # tasks stay referenced until they've reported back, cancelled ones too. Letting go of one the pool has
+        # already picked up would delete it out from under the pool thread
+        self.tasks = set()
+
+    def request(self, path, priority=0):
+        """Queues a thumbnail for path. thumbnailReady is emitted once it's there (with a null image if it failed)."""
+        if path in self.pendingTasks:
+            return
+
+        task = ThumbnailTask(path, self)
+        task.setAutoDelete(False)
+        self.pendingTasks[path] = task
+        self.tasks.add(task)
+        self.threadPool.start(task, priority)
+
+    def isPending(self, path):
+        return path in self.pendingTasks
+
+    def cancel(self, path):
+        task = self.pendingTasks.pop(path, None)
+        if task is not None and self.threadPool.tryTake(task):
+            self.tasks.discard(task)
+
+    def cancelAll(self):
+        for path in list(self.pendingTasks):
+            self.cancel(path)
+
+    def invalidate(self, path):
+        self.cancel(path)
+        self.store.invalidate(path)
+
+    def onTaskRetired(self, task):
+        self.tasks.discard(task)
+
+    def onTaskFinished(self, path, image):
+        if self.pendingTasks.pop(path, None) is not None:
+            self.thumbnailReady.emit(path, image)
@@ -0,0 +1,276 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import math
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QPoint, QRect, QRunnable, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+
+from lib.image.loader import getDecodeThreadPool, readImage
+from lib.image.mapped import isMappable, mapImage
+from lib.metrics import recordHit, recordMetric
+
+# side length (in level pixels) of every tile
+TILE_SIZE = 512
+
+# images with more pixels than this are shown tile by tile instead of as one big pixmap
+TILED_MIN_PIXELS = 100 * 1000 * 1000
+
+
+def imageBytes(image):
+    return image.sizeInBytes()
+
+
+class TileCache:
+    def __init__(self, maxBytes=256 * 1024 * 1024):
+        """Init function. An LRU of decoded tiles keyed by (level, x, y), bounded by maxBytes."""
+        self.maxBytes = maxBytes
+        self.usedBytes = 0
+        self.tiles = OrderedDict()
+
+    def get(self, key):
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def insert(self, key, tile):
+        if key in self.tiles:
+            self.usedBytes -= imageBytes(self.tiles.pop(key))
+
+        self.tiles[key] = tile
+        self.usedBytes += imageBytes(tile)
+
+        while self.usedBytes > self.maxBytes and len(self.tiles) > 1:
+            oldKey, oldTile = self.tiles.popitem(last=False)
+            self.usedBytes -= imageBytes(oldTile)
+
+    def clear(self):
+        self.tiles.clear()
+        self.usedBytes = 0
+
+
+class TileSignals(QObject):
+    # level, x, y, tile
+    tileDecoded = pyqtSignal(int, int, int, QImage)
+    # level, the whole level's image
+    levelDecoded = pyqtSignal(int, QImage)
+    # the task, once it's done with (whether it decoded anything or not)
+    retired = pyqtSignal(object)
+
+
+class TileTask(QRunnable):
+    def __init__(self, source, level, x, y):
+        super().__init__()
+
+        self.source = source
+        self.signals = source.signals
+        self.level = level
+        self.x = x
+        self.y = y
+
+    def run(self):
+        try:
+            self.decode()
+        finally:
+            self.signals.retired.emit(self)
+
+    def decode(self):
+        if not self.source.isPending((self.level, self.x, self.y)):
+            return
+
+        start = time.perf_counter()
+        if self.source.mapped is not None:
+            # no decoding at all, just the tile's rows copied out of the mapped file
+            sourceRect = self.source.tileSourceRect(self.level, self.x, self.y)
+            image = self.source.mapped.read(self.source.tileRect(self.level, self.x, self.y).size(), sourceRect)
+            recordMetric("tileDecodeMs", (time.perf_counter() - start) * 1000, "mapped")
+            self.signals.tileDecoded.emit(self.level, self.x, self.y, image)
+            return
+
+        if self.source.supportsClipping:
+            # the reader decodes just this tile's part of the file, at the level's resolution
+            sourceRect = self.source.tileSourceRect(self.level, self.x, self.y)
+            image, error = readImage(self.source.path, self.source.tileRect(self.level, self.x, self.y).size(), sourceRect)
+            recordMetric("tileDecodeMs", (time.perf_counter() - start) * 1000, "clipped")
+            self.signals.tileDecoded.emit(self.level, self.x, self.y, image)
+            return
+
+        # the handler can't decode a region, so decode the whole level once and slice every tile out of it
+        levelSize = self.source.levelSize(self.level)
+        image, error = readImage(self.source.path, levelSize)
+        recordMetric("tileDecodeMs", (time.perf_counter() - start) * 1000, "wholeLevel")
+        self.signals.levelDecoded.emit(self.level, image)
+
+
+class TileSource(QObject):
+    """Decodes one image a tile at a time. Level 0 is full resolution, every next level is half of the previous one."""
+    tileReady = pyqtSignal(int, int, int)
+
+    def __init__(self, path, cache=None, parent=None):
+        super().__init__(parent)
+
+        self.path = path
+        self.cache = cache if cache is not None else TileCache()
+        self.threadPool = getDecodeThreadPool()
+
+        # uncompressed files get used straight from disk, so only the rows of the visible tiles get paged in
+        self.mapped = mapImage(path) if isMappable(path) else None
+        if self.mapped is not None:
+            self.sourceSize = self.mapped.size()
+            self.supportsClipping = True
+        else:
+            reader = QImageReader(path)
+            reader.setAutoTransform(True)
+            self.sourceSize = reader.size()
+            self.supportsClipping = reader.supportsOption(QImageIOHandler.ClipRect)
+
+        # stop once the whole image fits in a single tile
+        longestSide = max(self.sourceSize.width(), self.sourceSize.height(), 1)
+        self.levelCount = max(1, math.ceil(math.log2(longestSide / TILE_SIZE)) + 1)
+
+        self.signals = TileSignals()
+        self.signals.tileDecoded.connect(self.onTileDecoded, Qt.QueuedConnection)
+        self.signals.levelDecoded.connect(self.onLevelDecoded, Qt.QueuedConnection)
+        self.signals.retired.connect(self.onTaskRetired, Qt.QueuedConnection)
+        self.pendingTasks = {}
+        # tasks stay referenced until they've reported back, cancelled ones too. Letting go of one the pool has
+        # already picked up would delete it out from under the pool thread
+        self.tasks = set()
+
+        # level -> image of the levels decoded whole (when the format can't decode a region): the last one and the
+        # overview. Tiles get cut out of them again if the cache evicts them, decoding the level again would just
+        # evict the first tiles again
+        self.levelImages = {}
+
+    def isNull(self):
+        return not self.sourceSize.isValid() or self.sourceSize.isEmpty()
+
+    def levelSize(self, level):
+        scale = 2 ** level
+        return QSize(max(1, math.ceil(self.sourceSize.width() / scale)), max(1, math.ceil(self.sourceSize.height() / scale)))
+
+    def levelForScale(self, scale):
+        """Returns the coarsest level that still has at least as many pixels as the screen at scale."""
+        if scale >= 1:
+            return 0
+        if scale <= 0:
+            return self.levelCount - 1
+        return min(self.levelCount - 1, int(math.floor(math.log2(1 / scale))))
+
+    def tileGrid(self, level):
+        size = self.levelSize(level)
+        return math.ceil(size.width() / TILE_SIZE), math.ceil(size.height() / TILE_SIZE)
+
+    def tileRect(self, level, x, y):
+        """The tile's rectangle in level pixels."""
+        return QRect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(QRect(QPoint(0, 0), self.levelSize(level)))
+
+    def tileSourceRect(self, level, x, y):
+        """The tile's rectangle in full resolution pixels."""
+        scale = 2 ** level
+        rect = QRect(x * TILE_SIZE * scale, y * TILE_SIZE * scale, TILE_SIZE * scale, TILE_SIZE * scale)
+        return rect.intersected(QRect(QPoint(0, 0), self.sourceSize))
+
+    def key(self, level, x, y):
+        return (self.path, level, x, y)
+
+    def tile(self, level, x, y):
+        """Returns the tile if it's cached, otherwise queues it up and returns None."""
+        tile = self.cachedTile(level, x, y)
+        recordHit("tileCacheHit", tile is not None)
+        if tile is None:
+            self.request(level, x, y)
+        return tile
+
+    def cachedTile(self, level, x, y):
+        tile = self.cache.get(self.key(level, x, y))
+        if tile is None and level in self.levelImages:
+            tile = self.levelImages[level].copy(self.tileRect(level, x, y))
+            self.cache.insert(self.key(level, x, y), tile)
+        return tile
+
+    def usedBytes(self):
+        """What the source holds on to itself, on top of its tiles in the cache."""
+        return sum(imageBytes(image) for image in self.levelImages.values())
+
+    def isPending(self, tileKey):
+        return tileKey in self.pendingTasks
+
+    def request(self, level, x, y, priority=0):
+        tileKey = (level, x, y)
+        if tileKey in self.pendingTasks:
+            return
+
+        if not self.supportsClipping:
+            # one task decodes the whole level, so don't queue another one for the same level
+            if any(key[0] == level for key in self.pendingTasks):
+                return
+            tileKey = (level, -1, -1)
+
+        task = TileTask(self, *tileKey)
+        task.setAutoDelete(False)
+        self.pendingTasks[tileKey] = task
+        self.tasks.add(task)
+        self.threadPool.start(task, priority)
+
+    def keepOnly(self, tileKeys):
+        """Cancels every queued tile that isn't in tileKeys (e.g. because it scrolled out of view)."""
+        for tileKey in list(self.pendingTasks):
+            if tileKey not in tileKeys and tileKey[1] != -1 and self.threadPool.tryTake(self.pendingTasks[tileKey]):
+                self.tasks.discard(self.pendingTasks.pop(tileKey))
+
+    def cancelAll(self):
+        # the ones that are already running stay in tasks, their results just get ignored
+        for task in self.pendingTasks.values():
+            if self.threadPool.tryTake(task):
+                self.tasks.discard(task)
+        self.pendingTasks.clear()
+
+    def onTaskRetired(self, task):
+        self.tasks.discard(task)
+
+    def onTileDecoded(self, level, x, y, tile):
+        if self.pendingTasks.pop((level, x, y), None) is None:
+            return
+
+        if not tile.isNull():
+            self.cache.insert(self.key(level, x, y), tile)
+            self.tileReady.emit(level, x, y)
+
+    def onLevelDecoded(self, level, image):
+        if self.pendingTasks.pop((level, -1, -1), None) is None or image.isNull():
+            return
+
+        # tiles only get cut out (and cached) once something asks for them
+        overview = self.levelCount - 1
+        self.levelImages = {kept: keptImage for kept, keptImage in self.levelImages.items() if kept == overview}
+        self.levelImages[level] = image
+        columns, rows = self.tileGrid(level)
+        for y in range(rows):
+            for x in range(columns):
+                self.tileReady.emit(level, x, y)
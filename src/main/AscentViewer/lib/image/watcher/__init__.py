@@ -0,0 +1,223 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+from PyQt5.QtCore import QElapsedTimer, QFileSystemWatcher, QObject, QSocketNotifier, QTimer, pyqtSignal
+
+# changes are collected until things have been quiet for this long (in ms)...
+DEBOUNCE_DELAY = 200
+# ...but a steady stream of new files still gets through at least this often
+MAX_DEBOUNCE_DELAY = 1000
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# files only count as added once they've been written and closed (or moved in), not as soon as they're created
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# wd, mask, cookie, len, followed by len bytes of name
+EVENT_HEADER = struct.Struct("iIII")
+
+libc = None
+
+
+def getLibc():
+    global libc
+    if libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return libc
+
+
+class FolderWatcher(QObject):
+    """Reports which files in a folder changed, in debounced batches.
+
+    On Linux this is inotify, which names the files itself, so a batch costs nothing per file that didn't change.
+    Everywhere else it's QFileSystemWatcher, which only says that the folder changed, so the folder gets listed
+    and compared against the last listing instead."""
+    # absolute paths of everything that was added, removed, renamed or written to. Which of those it was is
+    # up to the receiver (a stat will tell)
+    changed = pyqtSignal(list)
+    # inotify dropped events, so nothing short of a rescan will do
+    overflowed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.folder = None
+        self.dirtyPaths = set()
+        # QFileSystemWatcher only: the folder needs listing again before the next flush
+        self.folderDirty = False
+        self.notifier = None
+        self.fd = -1
+        self.fallbackWatcher = None
+        self.snapshot = {}
+
+        self.debounceTimer = QTimer(self)
+        self.debounceTimer.setSingleShot(True)
+        self.debounceTimer.setInterval(DEBOUNCE_DELAY)
+        self.debounceTimer.timeout.connect(self.flush)
+        # since the first change of the current batch
+        self.batchTimer = QElapsedTimer()
+
+    def watch(self, folder):
+        self.stop()
+        self.folder = os.path.abspath(folder)
+
+        if sys.platform.startswith("linux"):
+            try:
+                self.watchInotify()
+                return
+            except (OSError, AttributeError) as e:
+                print(f'[!] inotify unavailable for "{self.folder}" ({e}), falling back to QFileSystemWatcher')
+
+        self.snapshot = self.listFolder()
+        self.fallbackWatcher = QFileSystemWatcher([self.folder], self)
+        self.fallbackWatcher.directoryChanged.connect(self.onDirectoryChanged)
+
+    def stop(self):
+        self.debounceTimer.stop()
+        self.dirtyPaths.clear()
+        self.folderDirty = False
+        self.folder = None
+
+        if self.notifier is not None:
+            # closing the fd is tied to the notifier, see watchInotify()
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+            self.fd = -1
+
+        if self.fallbackWatcher is not None:
+            self.fallbackWatcher.deleteLater()
+            self.fallbackWatcher = None
+            self.snapshot = {}
+
+    def watchInotify(self):
+        libc = getLibc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        if libc.inotify_add_watch(fd, os.fsencode(self.folder), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno))
+
+        self.fd = fd
+        self.notifier = QSocketNotifier(fd, QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.readInotifyEvents)
+        # the fd goes away with the notifier, whether that's from stop() or from us getting deleted
+        self.notifier.destroyed.connect(lambda *args, fd=fd: os.close(fd))
+
+    def readInotifyEvents(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                print(f'[!] Could not read inotify events for "{self.folder}": {e}')
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.dirtyPaths.clear()
+                    self.overflowed.emit()
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    print(f'[!] "{self.folder}" went away, not watching it anymore')
+                    self.stop()
+                    return
+                elif name and not mask & IN_ISDIR:
+                    # a rename shows up as MOVED_FROM + MOVED_TO, so both names end up dirty
+                    self.markDirty([os.path.join(self.folder, os.fsdecode(name))])
+
+    def listFolder(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f'[!] Could not list "{self.folder}": {e}')
+        return snapshot
+
+    def onDirectoryChanged(self, folder):
+        # a file being copied in can fire this over and over, so the listing waits for flush()
+        if not self.folderDirty:
+            if not self.dirtyPaths:
+                self.batchTimer.start()
+            self.folderDirty = True
+        self.scheduleFlush()
+
+    def markDirty(self, paths):
+        if not paths:
+            return
+
+        if not self.dirtyPaths and not self.folderDirty:
+            self.batchTimer.start()
+        self.dirtyPaths.update(paths)
+        self.scheduleFlush()
+
+    def scheduleFlush(self):
+        if self.batchTimer.elapsed() >= MAX_DEBOUNCE_DELAY:
+            self.flush()
+        else:
+            self.debounceTimer.start()
+
+    def flush(self):
+        self.debounceTimer.stop()
+        if self.folderDirty:
+            self.folderDirty = False
+            snapshot = self.listFolder()
+            # added and removed files, plus the ones whose mtime or size changed
+            self.dirtyPaths.update([path for path in snapshot.keys() ^ self.snapshot.keys()]
+                                   + [path for path, stat in snapshot.items() if self.snapshot.get(path, stat) != stat])
+            self.snapshot = snapshot
+
+        if self.dirtyPaths:
+            paths = sorted(self.dirtyPaths)
+            self.dirtyPaths.clear()
+            self.changed.emit(paths)
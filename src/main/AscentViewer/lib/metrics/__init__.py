@@ -0,0 +1,127 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+# hot path instrumentation: decode/scale latencies, cache hit rates and memory, recorded into a fixed size ring buffer.
+# like lib.profiling this is standard library only, so anything can import it without pulling Qt in
+
+import itertools
+import json
+import os
+import socket
+import time
+
+# how many samples are kept, the oldest get overwritten
+METRICS_BUFFER_SIZE = 8192
+
+# the shared MetricsRecorder. Recording is off until something turns it on (--metrics, or the overlay)
+recorder = None
+
+
+class MetricsRecorder:
+    """Samples of (sequence number, wall clock time, name, value, tag), kept in a ring buffer.
+
+    Recording never locks: the slot comes from an itertools.count, whose next() is atomic, so decode threads and the
+    GUI thread can all record at once. When the buffer wraps around, old samples just get overwritten."""
+    def __init__(self, size=METRICS_BUFFER_SIZE):
+        self.size = size
+        self.buffer = [None] * size
+        self.counter = itertools.count()
+        self.enabled = False
+        self.exportPath = None
+
+    def record(self, name, value, tag=""):
+        sequence = next(self.counter)
+        self.buffer[sequence % self.size] = (sequence, time.time(), name, value, tag)
+
+    def samples(self, name=None):
+        """Returns the samples that are still in the buffer (optionally only those called name), oldest first."""
+        samples = sorted(sample for sample in self.buffer if sample is not None)
+        return [sample for sample in samples if name is None or sample[2] == name]
+
+    def summary(self):
+        """Returns {name: {"count", "last", "mean", "p50", "p95", "max", "tags": {tag: last value}}} over the buffer."""
+        grouped = {}
+        for sequence, timestamp, name, value, tag in self.samples():
+            entry = grouped.setdefault(name, {"values": [], "tags": {}})
+            entry["values"].append(value)
+            entry["tags"][tag] = value
+
+        summary = {}
+        for name, entry in grouped.items():
+            values = entry["values"]
+            ordered = sorted(values)
+            summary[name] = {
+                "count": len(values),
+                "last": values[-1],
+                "mean": sum(values) / len(values),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+                "tags": entry["tags"],
+            }
+        return summary
+
+    def exportJsonLines(self, path):
+        """Appends every buffered sample to path as one JSON object per line, tagged with the host and process, so files
+        from several machines can just be concatenated. Returns how many samples were written."""
+        host, pid = socket.gethostname(), os.getpid()
+        samples = self.samples()
+
+        with open(path, "a", encoding="utf-8") as f:
+            for sequence, timestamp, name, value, tag in samples:
+                f.write(json.dumps({"time": timestamp, "host": host, "pid": pid, "name": name, "value": value, "tag": tag}) + "\n")
+
+        return len(samples)
+
+    def clear(self):
+        self.buffer = [None] * self.size
+
+
+def getMetrics():
+    global recorder
+    if recorder is None:
+        recorder = MetricsRecorder()
+    return recorder
+
+
+def enableFromArgs(argv):
+    """Turns recording on if argv has --metrics, and sets the export path if it's --metrics=path.jsonl."""
+    metrics = getMetrics()
+    for arg in argv:
+        if arg == "--metrics":
+            metrics.enabled = True
+        elif arg.startswith("--metrics="):
+            metrics.enabled = True
+            metrics.exportPath = arg.split("=", 1)[1]
+    return metrics
+
+
+def recordMetric(name, value, tag=""):
+    """Records a sample if recording is on, otherwise does (almost) nothing."""
+    if recorder is not None and recorder.enabled:
+        recorder.record(name, value, tag)
+
+
+def recordHit(name, hit, tag=""):
+    """Records a cache lookup: 1 for a hit, 0 for a miss. The mean of these is the hit rate."""
+    if recorder is not None and recorder.enabled:
+        recorder.record(name, 1 if hit else 0, tag)
@@ -0,0 +1,143 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+# this module gets imported before PyQt5 (so the PyQt5 import itself can be timed), keep it standard library only
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+
+# the active StartupProfiler, if --profile-startup was passed
+profiler = None
+
+
+class StartupProfiler:
+    def __init__(self, mode="json", outputPath=None):
+        """Init function. mode is "json" (a timeline of spans) or "cprofile" (a full cProfile run)."""
+        self.mode = mode
+        self.outputPath = outputPath
+        self.origin = time.perf_counter()
+        self.events = []
+        self.extra = {}
+
+        self.cProfile = None
+        if mode == "cprofile":
+            self.cProfile = cProfile.Profile()
+            self.cProfile.enable()
+
+    def now(self):
+        """Milliseconds since the profiler was created."""
+        return (time.perf_counter() - self.origin) * 1000
+
+    def mark(self, name):
+        """Records a single point in time."""
+        self.events.append({"name": name, "start": self.now(), "duration": 0})
+
+    @contextmanager
+    def span(self, name):
+        """Records how long the with block took."""
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.events.append({"name": name, "start": start, "duration": self.now() - start})
+
+    def report(self):
+        return {"totalMs": self.now(), "events": sorted(self.events, key=lambda event: event["start"]), **self.extra}
+
+    def finish(self):
+        """Stops profiling and writes the report (to outputPath, or stdout)."""
+        if self.cProfile is not None:
+            self.cProfile.disable()
+
+            if self.outputPath:
+                self.cProfile.dump_stats(self.outputPath)
+            else:
+                stream = io.StringIO()
+                pstats.Stats(self.cProfile, stream=stream).sort_stats("cumulative").print_stats(40)
+                print(stream.getvalue())
+            return
+
+        if self.outputPath:
+            with open(self.outputPath, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, indent=4)
+        else:
+            json.dump(self.report(), sys.stdout, indent=4)
+            print()
+
+
+def enableFromArgs(argv):
+    """Turns the profiler on if argv has --profile-startup[=json|cprofile] (and optionally --profile-output=path)."""
+    global profiler
+
+    mode = None
+    outputPath = None
+    for arg in argv:
+        if arg == "--profile-startup":
+            mode = "json"
+        elif arg.startswith("--profile-startup="):
+            mode = arg.split("=", 1)[1]
+        elif arg.startswith("--profile-output="):
+            outputPath = arg.split("=", 1)[1]
+
+    if mode is not None:
+        if mode not in ("json", "cprofile"):
+            print(f'[!] Unknown profiling mode "{mode}", using json.')
+            mode = "json"
+        profiler = StartupProfiler(mode, outputPath)
+
+    return profiler
+
+
+@contextmanager
+def profileSpan(name):
+    """profiler.span(name) if profiling is on, otherwise does nothing."""
+    if profiler is None:
+        yield
+    else:
+        with profiler.span(name):
+            yield
+
+
+def profileMark(name):
+    if profiler is not None:
+        profiler.mark(name)
+
+
+def watchFirstPaint(widget, callback):
+    """Calls callback once widget gets painted for the first time."""
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+
+    class FirstPaintFilter(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint:
+                obj.removeEventFilter(self)
+                # let the paint itself finish first
+                QTimer.singleShot(0, callback)
+            return False
+
+    widget.firstPaintFilter = FirstPaintFilter(widget)
+    widget.installEventFilter(widget.firstPaintFilter)
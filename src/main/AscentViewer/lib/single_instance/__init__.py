@@ -0,0 +1,116 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import getpass
+import hashlib
+import json
+
+# only QtCore and QtNetwork, so that a launch that just hands off its paths never has to load QtWidgets
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtNetwork import QAbstractSocket, QLocalServer, QLocalSocket
+
+# how long (in ms) a new launch waits on the running instance before giving up and starting normally
+HANDOFF_TIMEOUT = 2000
+
+
+def serverName():
+    """Per user, so two people on one machine don't end up in each other's windows."""
+    return "AscentViewer-" + hashlib.sha1(getpass.getuser().encode("utf-8")).hexdigest()[:16]
+
+
+def forwardToRunningInstance(paths, timeout=HANDOFF_TIMEOUT):
+    """Hands paths (absolute) to the AscentViewer that's already running, which opens them.
+    Returns False if there isn't one, or it didn't answer in time.
+
+    This works without a QApplication, the socket is used in blocking mode."""
+    socket = QLocalSocket()
+    socket.connectToServer(serverName())
+    if not socket.waitForConnected(timeout):
+        return False
+
+    socket.write(json.dumps({"paths": paths}).encode("utf-8") + b"\n")
+    if not socket.waitForBytesWritten(timeout):
+        return False
+
+    # wait for the acknowledgement, otherwise we'd quit without knowing if anything got opened
+    while not socket.canReadLine():
+        if not socket.waitForReadyRead(timeout):
+            return False
+
+    answer = bytes(socket.readLine()).strip()
+    socket.disconnectFromServer()
+    return answer == b"ok"
+
+
+class InstanceServer(QObject):
+    """Listens for later launches handing over their paths (see forwardToRunningInstance())."""
+    # absolute paths, possibly none (then the launch was just meant to bring the window up)
+    pathsReceived = pyqtSignal(list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)
+        self.server.newConnection.connect(self.onNewConnection)
+
+    def listen(self):
+        """Starts listening. Returns False if another instance already does."""
+        name = serverName()
+        if self.server.listen(name):
+            return True
+
+        if self.server.serverError() == QAbstractSocket.AddressInUseError:
+            # either another instance is listening, or one crashed and left its socket file behind
+            probe = QLocalSocket()
+            probe.connectToServer(name)
+            if probe.waitForConnected(100):
+                probe.disconnectFromServer()
+                return False
+
+            QLocalServer.removeServer(name)
+            if self.server.listen(name):
+                return True
+
+        print(f"[!] Could not listen for other launches: {self.server.errorString()}")
+        return False
+
+    def onNewConnection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.onReadyRead(socket))
+            socket.disconnected.connect(socket.deleteLater)
+
+    def onReadyRead(self, socket):
+        if not socket.canReadLine():
+            return
+
+        try:
+            paths = [str(path) for path in json.loads(bytes(socket.readLine()).decode("utf-8"))["paths"]]
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[!] Got a broken message from another launch: {e}")
+            socket.disconnectFromServer()
+            return
+
+        socket.write(b"ok\n")
+        socket.flush()
+        self.pathsReceived.emit(paths)
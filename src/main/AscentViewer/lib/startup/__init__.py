@@ -0,0 +1,132 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRunnable, Qt, QThreadPool, QTimer, pyqtSignal
+
+
+class StageSignals(QObject):
+    # stage name, result, error message (empty if it worked)
+    finished = pyqtSignal(str, object, str)
+
+
+class StageTask(QRunnable):
+    def __init__(self, stage, signals):
+        super().__init__()
+
+        self.stage = stage
+        self.signals = signals
+
+    def run(self):
+        try:
+            result = self.stage["function"]()
+        except Exception as e:
+            self.signals.finished.emit(self.stage["name"], None, f"{type(e).__name__}: {e}")
+        else:
+            self.signals.finished.emit(self.stage["name"], result, "")
+
+
+class StartupPipeline(QObject):
+    """Runs startup as a list of named stages, one after the other, and times each of them.
+
+    Background stages run on a worker thread; the rest run on the GUI thread, but control goes back to the event
+    loop between any two stages, so the splash screen can repaint. Every stage's return value ends up in results."""
+    stageStarted = pyqtSignal(str, str, int)
+    stageFinished = pyqtSignal(str, float)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.stages = []
+        self.results = {}
+        self.timings = OrderedDict()
+        self.currentIndex = -1
+        self.stageStartTime = 0
+        self.startTime = 0
+
+        # its own pool, see getDecodeThreadPool in lib.image.loader for why python code stays off the global one
+        self.threadPool = QThreadPool(self)
+        self.threadPool.setMaxThreadCount(1)
+        self.signals = StageSignals()
+        self.signals.finished.connect(self.onStageFinished, Qt.QueuedConnection)
+
+    def addStage(self, name, label, function, background=False, weight=1):
+        """Adds a stage. label is what the splash shows, weight is how much of the progress bar the stage is worth."""
+        self.stages.append({"name": name, "label": label, "function": function, "background": background, "weight": weight})
+
+    def start(self):
+        self.startTime = time.perf_counter()
+        QTimer.singleShot(0, self.runNextStage)
+
+    def isFinished(self):
+        return "total" in self.timings
+
+    def progress(self):
+        """How far along startup is, in percent."""
+        total = sum(stage["weight"] for stage in self.stages) or 1
+        done = sum(stage["weight"] for stage in self.stages[:max(self.currentIndex, 0)])
+        return int(done * 100 / total)
+
+    def runNextStage(self):
+        self.currentIndex += 1
+        if self.currentIndex >= len(self.stages):
+            self.timings["total"] = time.perf_counter() - self.startTime
+            self.finished.emit()
+            return
+
+        stage = self.stages[self.currentIndex]
+        self.stageStarted.emit(stage["name"], stage["label"], self.progress())
+        self.stageStartTime = time.perf_counter()
+
+        if stage["background"]:
+            self.threadPool.start(StageTask(stage, self.signals))
+            return
+
+        try:
+            result = stage["function"]()
+        except Exception as e:
+            self.onStageFinished(stage["name"], None, f"{type(e).__name__}: {e}")
+        else:
+            self.onStageFinished(stage["name"], result, "")
+
+    def onStageFinished(self, name, result, error):
+        self.timings[name] = time.perf_counter() - self.stageStartTime
+
+        # a broken stage doesn't stop startup, whatever uses its result has to cope with None
+        self.results[name] = result
+        if error:
+            print(f'[!] Startup stage "{name}" failed: {error}')
+            self.failed.emit(name, error)
+
+        self.stageFinished.emit(name, self.timings[name])
+
+        # back to the event loop before the next stage, so the splash gets a chance to repaint
+        QTimer.singleShot(0, self.runNextStage)
+
+    def printTimings(self):
+        print("Startup timings\n=====================================================")
+        for name, seconds in self.timings.items():
+            print(f"{name}: {seconds * 1000:.1f} ms")
@@ -0,0 +1,127 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from PyQt5.QtCore import QPointF, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPolygonF
+from PyQt5.QtWidgets import QFormLayout, QPushButton, QSlider, QVBoxLayout, QWidget
+
+from lib.image.adjustments import Adjustments
+
+HISTOGRAM_COLORS = (QColor(255, 80, 80, 110), QColor(80, 255, 80, 110), QColor(80, 120, 255, 110))
+
+
+class HistogramWidget(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.channels = ()
+        self.setMinimumSize(256, 100)
+
+    def setHistogram(self, channels):
+        self.channels = channels
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+        if not self.channels:
+            return
+
+        # square root scale, otherwise a single spike (e.g. a black background) flattens everything else
+        peak = max(max(counts) for counts in self.channels) ** 0.5 or 1
+        width, height = self.width(), self.height()
+
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        for counts, color in zip(self.channels, HISTOGRAM_COLORS):
+            points = [QPointF(0, height)]
+            points += [QPointF(value * width / 255, height - count ** 0.5 / peak * height) for value, count in enumerate(counts)]
+            points.append(QPointF(width, height))
+            painter.setBrush(color)
+            painter.drawPolygon(QPolygonF(points))
+
+
+class AdjustmentsPanel(QWidget):
+    """Sliders for the viewer's adjustments, with a histogram on top.
+
+    adjustmentsChanged fires continuously while a slider is dragged, adjustmentsCommitted once it's let go
+    (or once for every step when the keyboard is used)."""
+    adjustmentsChanged = pyqtSignal()
+    adjustmentsCommitted = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.histogram = HistogramWidget()
+
+        self.brightnessSlider = self.makeSlider(-100, 100, 0)
+        self.contrastSlider = self.makeSlider(-100, 100, 0)
+        # in hundredths
+        self.gammaSlider = self.makeSlider(10, 400, 100)
+        self.blackPointSlider = self.makeSlider(0, 254, 0)
+        self.whitePointSlider = self.makeSlider(1, 255, 255)
+
+        resetButton = QPushButton("Reset")
+        resetButton.clicked.connect(self.reset)
+
+        form = QFormLayout()
+        form.addRow("Brightness:", self.brightnessSlider)
+        form.addRow("Contrast:", self.contrastSlider)
+        form.addRow("Gamma:", self.gammaSlider)
+        form.addRow("Black point:", self.blackPointSlider)
+        form.addRow("White point:", self.whitePointSlider)
+
+        mainVBox = QVBoxLayout(self)
+        mainVBox.setAlignment(Qt.AlignTop)
+        mainVBox.addWidget(self.histogram)
+        mainVBox.addLayout(form)
+        mainVBox.addWidget(resetButton, alignment=Qt.AlignRight)
+
+        self.setFixedWidth(300)
+
+    def makeSlider(self, minimum, maximum, value):
+        slider = QSlider(Qt.Horizontal)
+        slider.setRange(minimum, maximum)
+        slider.setValue(value)
+        slider.valueChanged.connect(lambda value, slider=slider: self.onSliderChanged(slider))
+        slider.sliderReleased.connect(self.adjustmentsCommitted)
+        return slider
+
+    def onSliderChanged(self, slider):
+        self.adjustmentsChanged.emit()
+        if not slider.isSliderDown():
+            self.adjustmentsCommitted.emit()
+
+    def adjustments(self):
+        return Adjustments(self.brightnessSlider.value(), self.contrastSlider.value(), self.gammaSlider.value() / 100,
+                           self.blackPointSlider.value(), self.whitePointSlider.value())
+
+    def reset(self):
+        sliders = ((self.brightnessSlider, 0), (self.contrastSlider, 0), (self.gammaSlider, 100),
+                   (self.blackPointSlider, 0), (self.whitePointSlider, 255))
+        for slider, value in sliders:
+            slider.blockSignals(True)
+            slider.setValue(value)
+            slider.blockSignals(False)
+
+        self.adjustmentsChanged.emit()
+        self.adjustmentsCommitted.emit()
@@ -0,0 +1,404 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import time
+
+from PyQt5.QtCore import QPointF, QRectF, QSize, QSizeF, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QPainter
+from PyQt5.QtWidgets import QWidget
+
+from lib.image.tiles import TILE_SIZE
+from lib.metrics import recordMetric
+
+# how long (in ms) things have to calm down (resizing, wheel zooming) before we do the proper smooth repaint
+SMOOTH_REPAINT_DELAY = 150
+
+# every wheel notch zooms by this much
+WHEEL_ZOOM_STEP = 1.25
+
+MAX_ZOOM = 32
+
+
+class ImageCanvas(QWidget):
+    """Draws an image with zoom (fit, fill, 1:1 or anything in between) and drag panning.
+
+    The image either comes from a ScaledPixmapCache (the pyramid level closest to the zoom gets drawn) or, for really
+    big images, a TileSource (only the visible tiles get decoded). Panning scrolls what's already on screen and only
+    paints the newly exposed strips, so it stays fast no matter how big the image is.
+
+    zoom is in screen pixels per image pixel and offset is where the image's top left corner is on the widget.
+    Both are in terms of imageSize, which can be bigger than the pixmap itself (e.g. while a preview is shown)."""
+    viewChanged = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.pixmapCache = None
+        self.source = None
+        self.imageSize = QSize()
+        self.message = ""
+
+        self.zoom = 1.0
+        self.offset = QPointF(0, 0)
+        # "fit", "fill" or None (the user picked a zoom themselves)
+        self.fitMode = "fit"
+
+        self.smooth = True
+        self.dragStart = None
+
+        self.setMinimumSize(1, 1)
+        # we paint every pixel ourselves, which is what lets scroll() only ask for the exposed strips
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+
+        self.smoothRepaintTimer = QTimer(self)
+        self.smoothRepaintTimer.setSingleShot(True)
+        self.smoothRepaintTimer.setInterval(SMOOTH_REPAINT_DELAY)
+        self.smoothRepaintTimer.timeout.connect(self.repaintSmooth)
+
+    # sources
+
+    def setPixmapCache(self, cache, imageSize=None, keepView=False):
+        """Shows the pixmap in cache. imageSize is the size of the actual image, if cache only holds a smaller copy.
+        keepView keeps the zoom and position, e.g. when a preview gets replaced by the real thing."""
+        self.setTileSource(None)
+        self.pixmapCache = cache if cache is not None and not cache.isNull() else None
+        self.setImageSize(imageSize if imageSize is not None else (cache.source.size() if self.pixmapCache else QSize()), keepView)
+
+    def setTileSource(self, source, keepView=False):
+        if self.source is not None:
+            self.source.cancelAll()
+            self.source.tileReady.disconnect(self.onTileReady)
+
+        self.source = source if source is not None and not source.isNull() else None
+        if self.source is not None:
+            self.pixmapCache = None
+            self.source.tileReady.connect(self.onTileReady)
+            self.setImageSize(self.source.sourceSize, keepView)
+
+    def setImageSize(self, size, keepView):
+        if keepView and self.hasImage() and not self.imageSize.isEmpty() and self.fitMode is None:
+            # same view, just measured in the new size's pixels
+            self.zoom *= self.imageSize.width() / max(size.width(), 1)
+            self.imageSize = QSize(size)
+        else:
+            self.imageSize = QSize(size)
+            self.fitMode = self.fitMode or "fit"
+            self.updateFit()
+
+        self.message = ""
+        self.update()
+        self.viewChanged.emit()
+
+    def clear(self, message=""):
+        self.setTileSource(None)
+        self.pixmapCache = None
+        self.imageSize = QSize()
+        self.message = message
+        self.update()
+
+    def setMessage(self, message):
+        """Text shown in the middle while there's no image."""
+        self.message = message
+        self.update()
+
+    def hasImage(self):
+        return self.pixmapCache is not None or self.source is not None
+
+    def onTileReady(self, level, x, y):
+        # only the tile's own area needs painting, unless it's from another level (then it's only used as a fallback)
+        if level == self.source.levelForScale(self.zoom):
+            self.update(self.tileTargetRect(self.imageRect(), self.zoom * 2 ** level, self.source.tileRect(level, x, y)).toAlignedRect())
+        else:
+            self.update()
+
+    # zooming
+
+    def fitZoom(self):
+        return min(self.width() / self.imageSize.width(), self.height() / self.imageSize.height())
+
+    def fillZoom(self):
+        return max(self.width() / self.imageSize.width(), self.height() / self.imageSize.height())
+
+    def updateFit(self):
+        if self.imageSize.isEmpty():
+            return
+
+        if self.fitMode == "fit":
+            self.zoom = self.fitZoom()
+        elif self.fitMode == "fill":
+            self.zoom = self.fillZoom()
+        else:
+            return
+
+        self.offset = QPointF(round((self.width() - self.imageSize.width() * self.zoom) / 2),
+                              round((self.height() - self.imageSize.height() * self.zoom) / 2))
+
+    def setFitMode(self, fitMode):
+        self.fitMode = fitMode
+        self.updateFit()
+        self.clampOffset()
+        self.update()
+        self.viewChanged.emit()
+
+    def fitToWindow(self):
+        self.setFitMode("fit")
+
+    def fillWindow(self):
+        self.setFitMode("fill")
+
+    def actualSize(self):
+        self.zoomTo(1.0)
+
+    def zoomBy(self, factor, anchor=None):
+        self.zoomTo(self.zoom * factor, anchor)
+
+    def zoomTo(self, zoom, anchor=None):
+        """Zooms to zoom, keeping the image point under anchor (widget coordinates, defaults to the middle) in place."""
+        if not self.hasImage():
+            return
+
+        zoom = max(min(zoom, MAX_ZOOM), min(self.fitZoom(), 1.0) / 4)
+        anchor = QPointF(anchor) if anchor is not None else QPointF(self.width() / 2, self.height() / 2)
+
+        imagePoint = (anchor - self.offset) / self.zoom
+        self.zoom = zoom
+        self.offset = anchor - imagePoint * zoom
+        self.fitMode = None
+
+        self.clampOffset()
+        self.repaintFast()
+        self.viewChanged.emit()
+
+    def viewCenter(self):
+        """The image point in the middle of the widget, as a fraction of the image size."""
+        if self.imageSize.isEmpty():
+            return QPointF(0.5, 0.5)
+
+        center = (QPointF(self.width() / 2, self.height() / 2) - self.offset) / self.zoom
+        return QPointF(center.x() / self.imageSize.width(), center.y() / self.imageSize.height())
+
+    def setView(self, zoom, center):
+        """Sets zoom (relative to fit) and center (a fraction of the image size), e.g. to mirror another canvas."""
+        if not self.hasImage():
+            return
+
+        self.fitMode = None
+        self.zoom = zoom
+        self.offset = QPointF(self.width() / 2 - center.x() * self.imageSize.width() * zoom,
+                              self.height() / 2 - center.y() * self.imageSize.height() * zoom)
+        self.clampOffset()
+        self.repaintFast()
+
+    # panning
+
+    def clampOffset(self):
+        """Keeps the image from being dragged out of view. Sides that fit into the widget stay centered."""
+        width, height = self.imageSize.width() * self.zoom, self.imageSize.height() * self.zoom
+
+        x = (self.width() - width) / 2 if width <= self.width() else min(0, max(self.width() - width, self.offset.x()))
+        y = (self.height() - height) / 2 if height <= self.height() else min(0, max(self.height() - height, self.offset.y()))
+
+        # whole pixels only, otherwise scrolled content and freshly painted strips wouldn't line up
+        self.offset = QPointF(round(x), round(y))
+
+    def panBy(self, dx, dy):
+        if not self.hasImage():
+            return
+
+        oldOffset = self.offset
+        self.offset = self.offset + QPointF(dx, dy)
+        self.clampOffset()
+
+        delta = self.offset - oldOffset
+        if delta.x() or delta.y():
+            self.fitMode = None
+            # moves the pixels that are already on screen, paintEvent only gets the newly exposed strips
+            self.scroll(int(delta.x()), int(delta.y()))
+            self.viewChanged.emit()
+
+    def canPan(self):
+        return self.imageSize.width() * self.zoom > self.width() or self.imageSize.height() * self.zoom > self.height()
+
+    # painting
+
+    def repaintFast(self):
+        self.smooth = False
+        self.update()
+        self.smoothRepaintTimer.start()
+
+    def repaintSmooth(self):
+        self.smooth = True
+        self.update()
+
+    def imageRect(self):
+        return QRectF(self.offset, QSizeF(self.imageSize) * self.zoom)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.palette().window())
+
+        if not self.hasImage():
+            if self.message:
+                painter.drawText(self.rect(), Qt.AlignCenter, self.message)
+            return
+
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.smooth)
+
+        start = time.perf_counter()
+        if self.source is not None:
+            self.paintTiles(painter, event.rect(), self.imageRect(), self.zoom)
+        else:
+            self.paintPixmap(painter, event.rect())
+        recordMetric("paintMs", (time.perf_counter() - start) * 1000, "smooth" if self.smooth else "fast")
+
+    def paintPixmap(self, painter, exposedRect):
+        cache = self.pixmapCache
+
+        if self.fitMode == "fit":
+            # a cached copy that's already the right size, so all that's left is a plain blit
+            pixmap = cache.scaled(self.size(), self.smooth)
+            painter.drawPixmap(QPointF((self.width() - pixmap.width()) // 2, (self.height() - pixmap.height()) // 2), pixmap)
+            return
+
+        imageRect = self.imageRect()
+        visible = QRectF(exposedRect).intersected(imageRect)
+        if visible.isEmpty():
+            return
+
+        # draw from the pyramid level closest to the zoom, and only the part of it that's exposed
+        level = cache.levelForScale(self.zoom * self.imageSize.width() / cache.source.width())
+        levelScale = imageRect.width() / level.width()
+        sourceRect = QRectF((visible.left() - imageRect.left()) / levelScale, (visible.top() - imageRect.top()) / levelScale,
+                            visible.width() / levelScale, visible.height() / levelScale)
+        painter.drawPixmap(visible, level, sourceRect)
+
+    def paintTiles(self, painter, exposedRect, imageRect, scale):
+        """Draws the tiles covering exposedRect. Tiles that aren't decoded yet get queued,
+        and a coarser level that is already cached gets drawn in their place for now."""
+        source = self.source
+        level = source.levelForScale(scale)
+        levelScale = scale * 2 ** level
+        columns, rows = source.tileGrid(level)
+
+        def tilesIn(rect):
+            visible = QRectF(rect).intersected(imageRect)
+            if visible.isEmpty():
+                return []
+
+            left = int((visible.left() - imageRect.left()) / levelScale) // TILE_SIZE
+            top = int((visible.top() - imageRect.top()) / levelScale) // TILE_SIZE
+            right = min(int((visible.right() - imageRect.left()) / levelScale) // TILE_SIZE, columns - 1)
+            bottom = min(int((visible.bottom() - imageRect.top()) / levelScale) // TILE_SIZE, rows - 1)
+            return [(x, y) for y in range(top, bottom + 1) for x in range(left, right + 1)]
+
+        for x, y in tilesIn(exposedRect):
+            tile = source.tile(level, x, y)
+            if tile is not None:
+                painter.drawImage(self.tileTargetRect(imageRect, levelScale, source.tileRect(level, x, y)), tile)
+            else:
+                self.paintFallback(painter, imageRect, scale, level, x, y)
+
+        # everything on screen stays wanted, not just what this paint event covers (which might be a thin strip)
+        wanted = {(level, x, y) for x, y in tilesIn(self.rect())}
+
+        # keep the overview around too, it's what gets drawn while everything else loads
+        overview = source.levelCount - 1
+        for y in range(source.tileGrid(overview)[1]):
+            for x in range(source.tileGrid(overview)[0]):
+                wanted.add((overview, x, y))
+                source.tile(overview, x, y)
+
+        source.keepOnly(wanted)
+
+    def paintFallback(self, painter, imageRect, scale, level, x, y):
+        """Draws the area of tile (level, x, y) from the closest coarser level that's cached."""
+        source = self.source
+        for coarser in range(level + 1, source.levelCount):
+            shift = coarser - level
+            tile = source.cachedTile(coarser, x >> shift, y >> shift)
+            if tile is None:
+                continue
+
+            # the part of the coarser tile that covers the missing one, in that tile's pixels
+            wantedRect = source.tileSourceRect(level, x, y)
+            coarserRect = source.tileSourceRect(coarser, x >> shift, y >> shift)
+            coarserScale = 2 ** coarser
+            sourceRect = QRectF((wantedRect.left() - coarserRect.left()) / coarserScale,
+                                (wantedRect.top() - coarserRect.top()) / coarserScale,
+                                wantedRect.width() / coarserScale, wantedRect.height() / coarserScale)
+
+            targetRect = QRectF(imageRect.left() + wantedRect.left() * scale, imageRect.top() + wantedRect.top() * scale,
+                                wantedRect.width() * scale, wantedRect.height() * scale)
+            painter.drawImage(targetRect, tile, sourceRect)
+            return
+
+    def tileTargetRect(self, imageRect, levelScale, tileRect):
+        return QRectF(imageRect.left() + tileRect.left() * levelScale, imageRect.top() + tileRect.top() * levelScale,
+                      tileRect.width() * levelScale, tileRect.height() * levelScale)
+
+    # events
+
+    def resizeEvent(self, event):
+        if self.fitMode is not None:
+            self.updateFit()
+        else:
+            # keep whatever was in the middle in the middle
+            self.offset += QPointF((event.size().width() - event.oldSize().width()) / 2,
+                                   (event.size().height() - event.oldSize().height()) / 2)
+            self.clampOffset()
+
+        # resize events come in bursts while the window edge gets dragged, so smooth scaling waits until they stop
+        self.repaintFast()
+        self.viewChanged.emit()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.zoomBy(WHEEL_ZOOM_STEP ** steps, event.pos())
+        event.accept()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self.canPan():
+            self.dragStart = event.pos()
+            self.setCursor(Qt.ClosedHandCursor)
+        else:
+            super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if self.dragStart is not None:
+            delta = event.pos() - self.dragStart
+            self.dragStart = event.pos()
+            self.panBy(delta.x(), delta.y())
+        else:
+            self.setCursor(Qt.OpenHandCursor if self.canPan() else Qt.ArrowCursor)
+
+    def mouseReleaseEvent(self, event):
+        if self.dragStart is not None:
+            self.dragStart = None
+            self.setCursor(Qt.OpenHandCursor if self.canPan() else Qt.ArrowCursor)
+
+    def mouseDoubleClickEvent(self, event):
+        # flips between fit and 1:1, zooming in on the spot that got clicked
+        if self.fitMode == "fit":
+            self.zoomTo(1.0, event.pos())
+        else:
+            self.fitToWindow()
@@ -0,0 +1,122 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from PyQt5.QtCore import QRectF, Qt, QTimer
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPainter
+from PyQt5.QtWidgets import QWidget
+
+from lib.image.memory import getMemoryManager
+from lib.metrics import getMetrics
+
+OVERLAY_REFRESH_INTERVAL = 500
+OVERLAY_MARGIN = 8
+OVERLAY_PADDING = 6
+
+# (label, metric name), in the order they're shown
+LATENCY_ROWS = (("Decode", "decodeMs"), ("Preview decode", "previewDecodeMs"), ("Tile decode", "tileDecodeMs"),
+                ("Scale", "scaleMs"), ("Paint", "paintMs"), ("Theme apply", "themeApplyMs"))
+HIT_RATE_ROWS = (("Prefetch hits", "prefetchHit"), ("Scaled copy hits", "scaledCacheHit"), ("Tile hits", "tileCacheHit"),
+                 ("Thumbnail hits", "thumbnailStoreHit"))
+
+# width of the label column, in characters
+LABEL_WIDTH = 17
+
+
+class MetricsOverlay(QWidget):
+    """A translucent box in the corner of its parent with what the metrics buffer has seen lately.
+    Showing it turns recording on."""
+    def __init__(self, memoryTag=None, parent=None):
+        super().__init__(parent)
+
+        # the owner key this tab reports its memory under
+        self.memoryTag = memoryTag
+        self.lines = []
+
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.textFont = QFont("monospace", 9)
+        self.textFont.setStyleHint(QFont.Monospace)
+
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setInterval(OVERLAY_REFRESH_INTERVAL)
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.hide()
+
+    def toggle(self):
+        if self.isVisible():
+            self.hide()
+            return
+
+        getMetrics().enabled = True
+        self.refresh()
+        self.show()
+        self.raise_()
+
+    def refresh(self):
+        summary = getMetrics().summary()
+        lines = []
+
+        for label, name in LATENCY_ROWS:
+            entry = summary.get(name)
+            if entry is None:
+                lines.append(f"{label:<{LABEL_WIDTH}} -")
+            else:
+                lines.append(f"{label:<{LABEL_WIDTH}} {entry['last']:7.1f} ms  p50 {entry['p50']:.1f}  p95 {entry['p95']:.1f}  n={entry['count']}")
+
+        for label, name in HIT_RATE_ROWS:
+            entry = summary.get(name)
+            if entry is None:
+                lines.append(f"{label:<{LABEL_WIDTH}} -")
+            else:
+                lines.append(f"{label:<{LABEL_WIDTH}} {entry['mean']:7.0%}     of {entry['count']}")
+
+        tabBytes = summary.get("memoryBytes", {}).get("tags", {}).get(self.memoryTag)
+        manager = getMemoryManager()
+        lines.append(f"{'This tab':<{LABEL_WIDTH}} {tabBytes / (1024 * 1024):7.1f} MB" if tabBytes is not None else f"{'This tab':<{LABEL_WIDTH}} -")
+        lines.append(f"{'All tabs':<{LABEL_WIDTH}} {manager.usedBytes() / (1024 * 1024):7.1f} MB of {manager.budgetBytes / (1024 * 1024):.0f}")
+        lines.append("F12 hides this, Shift+F12 exports")
+
+        self.lines = lines
+        fontMetrics = QFontMetrics(self.textFont)
+        self.setGeometry(OVERLAY_MARGIN, OVERLAY_MARGIN,
+                         max(fontMetrics.horizontalAdvance(line) for line in lines) + 2 * OVERLAY_PADDING,
+                         fontMetrics.lineSpacing() * len(lines) + 2 * OVERLAY_PADDING)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 170))
+        painter.drawRoundedRect(QRectF(self.rect()), 4, 4)
+
+        painter.setFont(self.textFont)
+        painter.setPen(QColor(235, 235, 235))
+        lineSpacing = QFontMetrics(self.textFont).lineSpacing()
+        for index, line in enumerate(self.lines):
+            painter.drawText(OVERLAY_PADDING, OVERLAY_PADDING + index * lineSpacing, self.width(), lineSpacing,
+                             Qt.AlignLeft | Qt.AlignVCenter, line)
+
+    def showEvent(self, event):
+        self.refreshTimer.start()
+
+    def hideEvent(self, event):
+        self.refreshTimer.stop()
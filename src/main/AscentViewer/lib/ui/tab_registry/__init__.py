@@ -0,0 +1,88 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+from PyQt5.QtCore import QObject
+
+
+class TabRegistry(QObject):
+    """Builds tab widgets on first use instead of at startup.
+
+    Every tab is registered with a factory; the widget only gets made the first time the tab is opened,
+    and (unless told otherwise) it gets deleted again when the tab is closed."""
+
+    def __init__(self, tabWidget):
+        super().__init__(tabWidget)
+
+        self.tabWidget = tabWidget
+        self.factories = {}
+        self.widgets = {}
+        self.instanceCount = 0
+
+        self.tabWidget.tabCloseRequested.connect(self.closeTab)
+
+    def register(self, name, factory, title, releaseOnClose=True):
+        """factory gets called with no arguments and has to return the widget."""
+        self.factories[name] = {"factory": factory, "title": title, "releaseOnClose": releaseOnClose}
+
+    def widget(self, name, create=True):
+        """Returns the widget of the tab called name, building it if it doesn't exist yet (and create is True)."""
+        if name not in self.widgets and create:
+            self.widgets[name] = self.factories[name]["factory"]()
+        return self.widgets.get(name)
+
+    def isOpen(self, name):
+        return name in self.widgets and self.tabWidget.indexOf(self.widgets[name]) != -1
+
+    def open(self, name):
+        """Shows the tab called name (adding it if needed) and returns its widget."""
+        widget = self.widget(name)
+        if self.tabWidget.indexOf(widget) == -1:
+            self.tabWidget.addTab(widget, self.factories[name]["title"])
+
+        self.tabWidget.setCurrentWidget(widget)
+        return widget
+
+    def openNew(self, name):
+        """Like open, but always builds a new widget, so there can be several tabs of the same kind."""
+        self.instanceCount += 1
+        key = f"{name}#{self.instanceCount}"
+        self.widgets[key] = self.factories[name]["factory"]()
+        self.factories[key] = self.factories[name]
+
+        return self.open(key)
+
+    def nameOf(self, widget):
+        return next((name for name, item in self.widgets.items() if item is widget), None)
+
+    def closeTab(self, index):
+        widget = self.tabWidget.widget(index)
+        self.tabWidget.removeTab(index)
+
+        name = self.nameOf(widget)
+        if name is None or self.factories[name]["releaseOnClose"]:
+            # unregistered tabs can't be reopened anyway
+            self.widgets.pop(name, None)
+            if name is not None and "#" in name:
+                del self.factories[name]
+            # closing first gives the widget a closeEvent, to stop whatever it still has running in the background
+            widget.close()
+            widget.deleteLater()
@@ -0,0 +1,327 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import math
+import os
+
+from PyQt5 import sip
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QImageIOHandler, QImageReader, QPixmap
+from PyQt5.QtWidgets import (QCheckBox, QFileDialog, QGridLayout, QHBoxLayout, QLabel, QPushButton, QToolButton,
+                             QVBoxLayout, QWidget)
+
+from lib.image.loader import (FULL_RESOLUTION_SLACK, ImageLoader, fullImageSize, imageFileFilter, probeImage,
+                              tiledMinPixels)
+from lib.image.memory import getMemoryManager
+from lib.image.scaled_cache import ScaledPixmapCache
+from lib.image.tiles import TILED_MIN_PIXELS, TileCache, TileSource
+from lib.ui.canvas import ImageCanvas
+
+MAX_PANES = 4
+
+# how much the zoom keys zoom by
+KEY_ZOOM_STEP = 1.25
+
+
+class ComparePane(QWidget):
+    """One image of the comparison: its file name over a canvas that draws it.
+
+    Images that can be read a piece at a time (mapped files, and formats whose reader can clip, like JPEG) get drawn
+    tile by tile from the shared cache, only what's visible and at the level the zoom needs.
+    The rest are decoded to about the pane's size first, and only decoded whole once the zoom needs it."""
+    removeRequested = pyqtSignal(object)
+    memoryChanged = pyqtSignal()
+
+    def __init__(self, path, tileCache, parent=None):
+        super().__init__(parent)
+
+        self.path = path
+
+        nameLabel = QLabel(os.path.basename(path))
+        nameLabel.setToolTip(path)
+        nameLabel.setMinimumSize(1, 1)
+        removeButton = QToolButton()
+        removeButton.setText("×")
+        removeButton.setToolTip("Remove from the comparison")
+        removeButton.clicked.connect(lambda: self.removeRequested.emit(self))
+
+        captionHBox = QHBoxLayout()
+        captionHBox.setContentsMargins(4, 0, 0, 0)
+        captionHBox.addWidget(nameLabel, 1)
+        captionHBox.addWidget(removeButton)
+
+        self.canvas = ImageCanvas()
+        self.canvas.viewChanged.connect(self.checkResolution)
+        self.tileCache = tileCache
+        self.source = None
+        self.scaledCache = None
+
+        self.loader = ImageLoader(self)
+        self.loader.imageLoaded.connect(self.onImageLoaded)
+        self.loader.loadFailed.connect(self.onLoadFailed)
+        self.loader.imageTooLarge.connect(lambda requestId, path, size: self.setTileSource())
+        self.loadRequest = None
+
+        size, mapped = probeImage(path)
+        # tiles of anything else would mean decoding the whole level for each of them
+        canClip = mapped is not None or QImageReader(path).supportsOption(QImageIOHandler.ClipRect)
+        if size.isValid() and (canClip or size.width() * size.height() > tiledMinPixels(mapped, TILED_MIN_PIXELS)):
+            self.setTileSource()
+        else:
+            # waits for the first resize, which is when the pane knows how big it is
+            self.canvas.setMessage(f"Loading {os.path.basename(path)}...")
+
+        mainVBox = QVBoxLayout(self)
+        mainVBox.setContentsMargins(0, 0, 0, 0)
+        mainVBox.setSpacing(2)
+        mainVBox.addLayout(captionHBox)
+        mainVBox.addWidget(self.canvas, 1)
+
+    def setTileSource(self):
+        self.loadRequest = None
+        self.source = TileSource(self.path, self.tileCache, self)
+        self.source.tileReady.connect(lambda *args: self.memoryChanged.emit())
+        if self.source.isNull():
+            self.canvas.setMessage(f"Could not open {os.path.basename(self.path)}")
+        else:
+            self.canvas.setTileSource(self.source)
+
+    def checkResolution(self):
+        """Decodes the whole image once the view is zoomed in past what was decoded for the pane."""
+        if self.scaledCache is None or self.loadRequest is not None:
+            return
+
+        width = self.scaledCache.source.width()
+        if width < self.canvas.imageSize.width() and self.canvas.zoom * self.canvas.imageSize.width() > width * FULL_RESOLUTION_SLACK:
+            self.loadRequest = self.loader.load(self.path, maxPixels=TILED_MIN_PIXELS)
+
+    def onImageLoaded(self, requestId, path, image):
+        if requestId == self.loadRequest:
+            self.loadRequest = None
+            self.scaledCache = ScaledPixmapCache(QPixmap.fromImage(image))
+            self.canvas.setPixmapCache(self.scaledCache, fullImageSize(image), keepView=True)
+            self.memoryChanged.emit()
+
+    def onLoadFailed(self, requestId, path, error):
+        if requestId == self.loadRequest:
+            self.loadRequest = None
+            self.canvas.setMessage(f"Could not open {os.path.basename(path)}\n{error}")
+
+    def memoryUsage(self):
+        pixmapBytes = self.scaledCache.totalBytes() if self.scaledCache is not None else 0
+        return pixmapBytes + (self.source.usedBytes() if self.source is not None else 0)
+
+    def releaseMemory(self):
+        """Goes back to a pane sized copy of the image, like the viewer does. Zooming in decodes it whole again."""
+        if self.scaledCache is None:
+            return
+
+        if self.loadRequest is not None:
+            self.loader.cancelAll()
+            self.loadRequest = None
+        preview = self.scaledCache.scaled(self.canvas.size(), True)
+        if preview.width() < self.scaledCache.source.width():
+            self.scaledCache = ScaledPixmapCache(preview)
+            # still measured in the full image's pixels, so the view doesn't budge
+            self.canvas.setPixmapCache(self.scaledCache, self.canvas.imageSize, keepView=True)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # the view might still be zoomed in past what releaseMemory() left
+        self.checkResolution()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.source is None and self.scaledCache is None and self.loadRequest is None:
+            self.loadRequest = self.loader.load(self.path, maxPixels=TILED_MIN_PIXELS, displaySize=self.size())
+
+    def release(self):
+        self.loader.cancelAll()
+        self.loadRequest = None
+        self.canvas.clear()
+        self.scaledCache = None
+
+
+class CompareWidget(QWidget):
+    """Shows 2 to 4 images next to each other, zoomed and panned together."""
+    def __init__(self, themeLoaderObject):
+        super().__init__()
+
+        self.panes = []
+        # the panes all draw from (and fill) this one, so it's one memory budget for the whole comparison
+        self.tileCache = TileCache()
+        # set while the other panes are being moved to match one, so they don't try to match each other back
+        self.syncing = False
+
+        self.addButton = QPushButton("Add images...")
+        self.addButton.clicked.connect(self.browse)
+        clearButton = QPushButton("Clear")
+        clearButton.clicked.connect(self.clear)
+        self.syncCheckBox = QCheckBox("Zoom and pan together")
+        self.syncCheckBox.setChecked(True)
+        self.syncCheckBox.toggled.connect(lambda checked: self.syncTo(self.panes[0].canvas) if checked and self.panes else None)
+        self.statusLabel = QLabel()
+
+        toolbarHBox = QHBoxLayout()
+        toolbarHBox.addWidget(self.addButton)
+        toolbarHBox.addWidget(clearButton)
+        toolbarHBox.addWidget(self.syncCheckBox)
+        toolbarHBox.addWidget(self.statusLabel, 1)
+
+        self.grid = QGridLayout()
+        self.grid.setSpacing(4)
+
+        mainVBox = QVBoxLayout(self)
+        mainVBox.addLayout(toolbarHBox)
+        mainVBox.addLayout(self.grid, 1)
+
+        self.setFocusPolicy(Qt.StrongFocus)
+
+        self.memoryManager = getMemoryManager()
+        self.memoryKey = f"compare-{id(self)}"
+        self.memoryManager.register(self.memoryKey, "Compare", self.releaseMemory)
+        self.destroyed.connect(lambda *args, manager=self.memoryManager, key=self.memoryKey:
+                               manager.unregister(key) if not sip.isdeleted(manager) else None)
+
+        self.updateStatus()
+
+    def browse(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, "Add images to compare", "", imageFileFilter())
+        self.addPaths(paths)
+
+    def addPaths(self, paths):
+        """Adds a pane for each of paths, as long as there's room."""
+        if len(paths) > MAX_PANES - len(self.panes):
+            print(f"[!] Only {MAX_PANES} images can be compared at once")
+
+        for path in paths[:MAX_PANES - len(self.panes)]:
+            pane = ComparePane(os.path.abspath(path), self.tileCache)
+            pane.removeRequested.connect(self.removePane)
+            pane.canvas.viewChanged.connect(lambda canvas=pane.canvas: self.onViewChanged(canvas))
+            pane.memoryChanged.connect(self.reportMemory)
+            self.panes.append(pane)
+
+        self.layoutPanes()
+        if self.panes and self.syncCheckBox.isChecked():
+            self.syncTo(self.panes[0].canvas)
+
+    def removePane(self, pane):
+        self.panes.remove(pane)
+        pane.release()
+        pane.deleteLater()
+        self.layoutPanes()
+        self.reportMemory()
+
+    def clear(self):
+        for pane in list(self.panes):
+            self.removePane(pane)
+        self.tileCache.clear()
+        self.reportMemory()
+
+    def layoutPanes(self):
+        """Puts the panes in a grid: side by side for two, two by two for three or four."""
+        for pane in self.panes:
+            self.grid.removeWidget(pane)
+
+        columns = math.ceil(math.sqrt(len(self.panes))) if self.panes else 1
+        for index, pane in enumerate(self.panes):
+            self.grid.addWidget(pane, index // columns, index % columns)
+
+        self.addButton.setEnabled(len(self.panes) < MAX_PANES)
+        self.updateStatus()
+
+    def updateStatus(self):
+        if len(self.panes) < 2:
+            self.statusLabel.setText(f"Add {2 - len(self.panes)} more image{'s' if len(self.panes) == 0 else ''} to compare (up to {MAX_PANES})")
+        else:
+            self.statusLabel.setText("")
+
+    def onViewChanged(self, canvas):
+        if not self.syncing and self.syncCheckBox.isChecked():
+            self.syncTo(canvas)
+
+    def syncTo(self, canvas):
+        """Moves every other pane to show the same part of its image as canvas, at the same zoom (relative to fit,
+        so images of different sizes still line up)."""
+        if not canvas.hasImage():
+            return
+
+        self.syncing = True
+        try:
+            relativeZoom = canvas.zoom / canvas.fitZoom()
+            center = canvas.viewCenter()
+            for pane in self.panes:
+                other = pane.canvas
+                if other is canvas or not other.hasImage():
+                    continue
+                if canvas.fitMode is not None:
+                    other.setFitMode(canvas.fitMode)
+                else:
+                    other.setView(relativeZoom * other.fitZoom(), center)
+                    # setView() doesn't emit viewChanged
+                    pane.checkResolution()
+        finally:
+            self.syncing = False
+
+    def targetCanvases(self):
+        """The panes the zoom keys act on: the first one if the rest follow it anyway, otherwise all of them."""
+        canvases = [pane.canvas for pane in self.panes if pane.canvas.hasImage()]
+        return canvases[:1] if self.syncCheckBox.isChecked() else canvases
+
+    def reportMemory(self):
+        self.memoryManager.update(self.memoryKey, self.tileCache.usedBytes + sum(pane.memoryUsage() for pane in self.panes))
+
+    def releaseMemory(self):
+        for pane in self.panes:
+            pane.releaseMemory()
+        # the tiles get decoded again as soon as the panes are painted
+        self.tileCache.clear()
+        self.reportMemory()
+
+    def showEvent(self, event):
+        self.memoryManager.setActive(self.memoryKey, True)
+
+    def hideEvent(self, event):
+        self.memoryManager.setActive(self.memoryKey, False)
+
+    def closeEvent(self, event):
+        for pane in self.panes:
+            pane.release()
+        super().closeEvent(event)
+
+    def keyPressEvent(self, event):
+        if event.key() in (Qt.Key_Plus, Qt.Key_Equal):
+            action = lambda canvas: canvas.zoomBy(KEY_ZOOM_STEP)
+        elif event.key() == Qt.Key_Minus:
+            action = lambda canvas: canvas.zoomBy(1 / KEY_ZOOM_STEP)
+        elif event.key() in (Qt.Key_0, Qt.Key_F):
+            action = ImageCanvas.fitToWindow
+        elif event.key() == Qt.Key_1:
+            action = ImageCanvas.actualSize
+        elif event.key() == Qt.Key_W:
+            action = ImageCanvas.fillWindow
+        else:
+            super().keyPressEvent(event)
+            return
+
+        for canvas in self.targetCanvases():
+            action(canvas)
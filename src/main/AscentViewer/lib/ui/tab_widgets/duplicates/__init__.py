@@ -0,0 +1,194 @@
+# AscentViewer, a Python image viewer.
+# Copyright (C) 2020-2021 DespawnedDiamond, A Crazy Town and other contributors
+#
+# This file is part of AscentViewer.
+#
+# AscentViewer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# AscentViewer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with AscentViewer.  If not, see <https://www.gnu.org/licenses/>.
+
+# =====================================================
+# Thank you for using and/or checking out AscentViewer!
+# =====================================================
+
+import os
+
+from PyQt5.QtCore import QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QFont, QIcon, QPixmap
+from PyQt5.QtWidgets import (QCheckBox, QComboBox, QFileDialog, QFormLayout, QHBoxLayout, QLabel, QLineEdit,
+                             QProgressBar, QPushButton, QSpinBox, QTreeWidget, QTreeWidgetItem, QVBoxLayout, QWidget)
+
+from lib.image.duplicates import DEFAULT_MAX_DISTANCE, HASH_KINDS, DuplicateFinder
+from lib.image.thumbnails import ThumbnailProvider
+
+ICON_SIZE = 64
+
+# only this many groups get unfolded (and their thumbnails loaded) right away
+EXPANDED_GROUPS = 20
+
+
+class DuplicatesWidget(QWidget):
+    """Looks through a folder for images that look the same, and lists them in groups."""
+    openRequested = pyqtSignal(str)
+
+    def __init__(self, themeLoaderObject):
+        super().__init__()
+
+        title = QLabel("Find duplicates")
+        title.setFont(QFont("Selawik", 28))
+        title.setMinimumSize(1, 1)
+
+        self.folderEdit = QLineEdit()
+        self.folderEdit.setPlaceholderText("Pick a folder...")
+        browseButton = QPushButton("Browse...")
+
+        folderHBox = QHBoxLayout()
+        folderHBox.addWidget(self.folderEdit)
+        folderHBox.addWidget(browseButton)
+
+        self.recursiveCheckBox = QCheckBox("Include subfolders")
+        self.recursiveCheckBox.setChecked(True)
+
+        self.hashComboBox = QComboBox()
+        self.hashComboBox.addItems(HASH_KINDS)
+        self.hashComboBox.setCurrentText("pHash")
+
+        # out of 64 bits
+        self.distanceSpinBox = QSpinBox()
+        self.distanceSpinBox.setRange(0, 12)
+        self.distanceSpinBox.setValue(DEFAULT_MAX_DISTANCE)
+        self.distanceSpinBox.setToolTip("How many bits (out of 64) two hashes can differ by and still count as the same image")
+
+        form = QFormLayout()
+        form.addRow("Folder:", folderHBox)
+        form.addRow("", self.recursiveCheckBox)
+        form.addRow("Compare by:", self.hashComboBox)
+        form.addRow("Tolerance:", self.distanceSpinBox)
+
+        self.findButton = QPushButton("Find duplicates")
+        self.progressBar = QProgressBar()
+        self.progressBar.hide()
+        self.statusLabel = QLabel()
+
+        statusHBox = QHBoxLayout()
+        statusHBox.addWidget(self.findButton)
+        statusHBox.addWidget(self.progressBar)
+        statusHBox.addWidget(self.statusLabel, 1)
+
+        self.groupTree = QTreeWidget()
+        self.groupTree.setHeaderHidden(True)
+        self.groupTree.setIconSize(QSize(ICON_SIZE, ICON_SIZE))
+
+        mainVBox = QVBoxLayout(self)
+        mainVBox.setContentsMargins(50, 70, 50, 50)
+        mainVBox.addWidget(title)
+        mainVBox.addLayout(form)
+        mainVBox.addLayout(statusHBox)
+        mainVBox.addWidget(self.groupTree, 1)
+
+        self.finder = DuplicateFinder(parent=self)
+        self.finder.progress.connect(self.onProgress)
+        self.finder.groupsFound.connect(self.showGroups)
+
+        self.thumbnailProvider = ThumbnailProvider(parent=self)
+        self.thumbnailProvider.thumbnailReady.connect(self.onThumbnailReady)
+        self.itemsByPath = {}
+
+        browseButton.clicked.connect(self.browse)
+        self.findButton.clicked.connect(self.toggleSearch)
+        self.groupTree.itemExpanded.connect(self.requestThumbnails)
+        self.groupTree.itemActivated.connect(self.onItemActivated)
+
+    def browse(self):
+        folder = QFileDialog.getExistingDirectory(self, "Find duplicates in", self.folderEdit.text())
+        if folder:
+            self.folderEdit.setText(folder)
+
+    def toggleSearch(self):
+        if self.finder.isRunning():
+            self.cancel()
+        else:
+            self.find(self.folderEdit.text())
+
+    def find(self, folder):
+        if not os.path.isdir(folder):
+            self.statusLabel.setText("That's not a folder.")
+            return
+
+        self.folderEdit.setText(folder)
+        self.clearGroups()
+        self.progressBar.setRange(0, 0)
+        self.progressBar.show()
+        self.statusLabel.setText("Looking for images...")
+        self.findButton.setText("Cancel")
+
+        self.finder.find(folder, self.recursiveCheckBox.isChecked(), self.hashComboBox.currentText(), self.distanceSpinBox.value())
+
+    def cancel(self):
+        self.finder.cancel()
+        self.progressBar.hide()
+        self.statusLabel.setText("Cancelled.")
+        self.findButton.setText("Find duplicates")
+
+    def clearGroups(self):
+        self.thumbnailProvider.cancelAll()
+        self.itemsByPath.clear()
+        self.groupTree.clear()
+
+    def onProgress(self, done, total):
+        self.progressBar.setRange(0, max(total, 1))
+        self.progressBar.setValue(done)
+        self.statusLabel.setText(f"Hashed {done} of {total} images...")
+
+    def showGroups(self, groups):
+        self.progressBar.hide()
+        self.findButton.setText("Find duplicates")
+
+        count = sum(len(group) for group in groups)
+        self.statusLabel.setText(f"{count} images in {len(groups)} groups." if groups else "No duplicates found.")
+
+        folder = self.folderEdit.text()
+        for group in groups:
+            groupItem = QTreeWidgetItem(self.groupTree, [f"{len(group)} images"])
+            for path in group:
+                item = QTreeWidgetItem(groupItem, [os.path.relpath(path, folder)])
+                item.setData(0, Qt.UserRole, path)
+                item.setToolTip(0, path)
+                self.itemsByPath.setdefault(path, []).append(item)
+
+        for index in range(min(EXPANDED_GROUPS, self.groupTree.topLevelItemCount())):
+            self.groupTree.topLevelItem(index).setExpanded(True)
+
+    def requestThumbnails(self, groupItem):
+        for index in range(groupItem.childCount()):
+            item = groupItem.child(index)
+            if item.icon(0).isNull():
+                self.thumbnailProvider.request(item.data(0, Qt.UserRole))
+
+    def onThumbnailReady(self, path, image):
+        if image.isNull():
+            return
+
+        icon = QIcon(QPixmap.fromImage(image.scaled(ICON_SIZE, ICON_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)))
+        for item in self.itemsByPath.get(path, ()):
+            item.setIcon(0, icon)
+
+    def onItemActivated(self, item, column):
+        path = item.data(0, Qt.UserRole)
+        if path:
+            self.openRequested.emit(path)
+
+    def closeEvent(self, event):
+        # the search would otherwise keep going (and the thread pool would wait for it) after the tab is gone
+        self.finder.cancel()
+        self.thumbnailProvider.cancelAll()
+        super().closeEvent(event)
@@ -21,8 +21,12 @@
 # =====================================================
 
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget
+from PyQt5.QtGui import QColor, QFont
+from PyQt5.QtWidgets import (QApplication, QColorDialog, QComboBox, QFormLayout, QLabel, QPushButton, QSpinBox,
+                             QVBoxLayout, QWidget)
+
+from lib.assets import getPixmap
+from lib.image.memory import getMemoryManager
 
 
 class SettingsWidget(QWidget):
@@ -31,11 +35,69 @@ class SettingsWidget(QWidget):
 
         # main widgets and layouts
         self.background = QLabel(self)
-        self.background.setPixmap(QPixmap("./assets/img/settingsbg_alpha4.png"))
+        self.background.setPixmap(getPixmap("./assets/img/settingsbg_alpha4.png"))
         self.background.setAlignment(Qt.AlignBottom | Qt.AlignRight)
 
+        self.themeLoader = themeLoaderObject
+
+        title = QLabel("Settings")
+        title.setFont(QFont("Selawik", 28))
+        title.setMinimumSize(1, 1)
+
+        self.themeComboBox = QComboBox()
+        self.themeComboBox.addItems(themeLoaderObject.themeNames())
+        self.themeComboBox.setCurrentText(themeLoaderObject.currentTheme or "")
+
+        self.accentButton = QPushButton()
+        self.accentButton.setFixedWidth(100)
+        self.updateAccentButton()
+
+        self.memoryManager = getMemoryManager()
+
+        self.memoryBudgetSpinBox = QSpinBox()
+        self.memoryBudgetSpinBox.setRange(128, 64 * 1024)
+        self.memoryBudgetSpinBox.setSingleStep(128)
+        self.memoryBudgetSpinBox.setSuffix(" MB")
+        self.memoryBudgetSpinBox.setValue(self.memoryManager.budgetBytes // (1024 * 1024))
+
+        self.memoryUsageLabel = QLabel()
+        self.updateMemoryUsage(self.memoryManager.usedBytes(), self.memoryManager.budgetBytes)
+
+        self.duplicatesLink = QLabel('<a href="https://">Find duplicate images...</a>')
+
+        themeForm = QFormLayout()
+        themeForm.addRow("Theme:", self.themeComboBox)
+        themeForm.addRow("Accent color:", self.accentButton)
+        themeForm.addRow("Image memory budget:", self.memoryBudgetSpinBox)
+        themeForm.addRow("Image memory in use:", self.memoryUsageLabel)
+
         mainVBox = QVBoxLayout(self)
-        mainVBox.setContentsMargins(0, 0, 0, 0)
+        mainVBox.setAlignment(Qt.AlignTop)
+        mainVBox.setContentsMargins(50, 70, 50, 50)
+        mainVBox.addWidget(title)
+        mainVBox.addLayout(themeForm)
+        mainVBox.addWidget(self.duplicatesLink)
+
+        self.themeComboBox.currentTextChanged.connect(self.switchTheme)
+        self.accentButton.clicked.connect(self.pickAccentColor)
+        self.memoryBudgetSpinBox.editingFinished.connect(lambda: self.memoryManager.setBudget(self.memoryBudgetSpinBox.value() * 1024 * 1024))
+        self.memoryManager.usageChanged.connect(self.updateMemoryUsage)
+
+    def switchTheme(self, themeName):
+        self.themeLoader.switchTheme(themeName, self.themeLoader.currentAccentColor, QApplication.instance())
+
+    def pickAccentColor(self):
+        color = QColorDialog.getColor(QColor(self.themeLoader.currentAccentColor), self, "Accent color")
+        if color.isValid():
+            self.themeLoader.switchTheme(self.themeLoader.currentTheme, color.name(), QApplication.instance())
+            self.updateAccentButton()
+
+    def updateAccentButton(self):
+        self.accentButton.setText(self.themeLoader.currentAccentColor or "")
+        self.accentButton.setStyleSheet(f"background-color: {self.themeLoader.currentAccentColor};")
+
+    def updateMemoryUsage(self, usedBytes, budgetBytes):
+        self.memoryUsageLabel.setText(f"{usedBytes / (1024 * 1024):.1f} MB of {budgetBytes / (1024 * 1024):.0f} MB")
 
     def resizeEvent(self, event):
         self.background.resize(self.geometry().size())
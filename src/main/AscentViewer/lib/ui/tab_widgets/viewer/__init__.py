@@ -20,9 +20,37 @@
 # Thank you for using and/or checking out AscentViewer!
 # =====================================================
 
-from PyQt5.QtCore import Qt
+import os
+
+from PyQt5 import sip
+from PyQt5.QtCore import QSize, Qt
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget
+from PyQt5.QtWidgets import QActionGroup, QFileDialog, QHBoxLayout, QMenu, QWidget
+
+from lib.image.adjustments import Adjustments, applyAdjustments, histogram
+from lib.image.animation import AnimationPlayer, isAnimated
+from lib.image.folder import FolderModel
+from lib.image.loader import FULL_RESOLUTION_SLACK, ImageLoader, fullImageSize
+from lib.image.memory import getMemoryManager
+from lib.image.metadata import cameraName
+from lib.image.prefetch_cache import PrefetchCache
+from lib.image.scaled_cache import ScaledPixmapCache, pixmapBytes
+from lib.image.slideshow import SLIDESHOW_INTERVALS, SlideshowScheduler
+from lib.image.thumbnails import getThumbnailStore
+from lib.image.tiles import TILED_MIN_PIXELS, TileCache, TileSource
+from lib.metrics import getMetrics, recordHit
+from lib.ui.adjustments import AdjustmentsPanel
+from lib.ui.canvas import ImageCanvas
+from lib.ui.metrics_overlay import MetricsOverlay
+
+# how much the zoom keys zoom by
+KEY_ZOOM_STEP = 1.25
+
+SORT_ORDER_NAMES = (("name", "Name"), ("date", "Date taken"), ("camera", "Camera"), ("dimensions", "Dimensions"),
+                    ("size", "File size"))
+
+# how many images on each side of the current one get decoded ahead of time in folder mode
+PREFETCH_RADIUS = 2
 
 
 class ViewerWidget(QWidget):
@@ -30,17 +58,439 @@ class ViewerWidget(QWidget):
         super().__init__()
 
         # main widgets and layouts
-        self.pixmap_ = QPixmap("./assets/img/banner.png")
+        self.pixmap_ = QPixmap()
+        self.scaledCache = ScaledPixmapCache(self.pixmap_)
+        # the size of the image pixmap_ is of. Big JPEGs get decoded to about the canvas size, so pixmap_ can be smaller
+        self.imageSize = QSize()
+        self.imagePath = None
+        # the path of what's on screen, which lags behind imagePath while that loads
+        self.shownPath = None
+
+        # the canvas does the zooming and panning, for pixmaps and tiled images alike
+        self.canvas = ImageCanvas()
+        self.canvas.smoothRepaintTimer.timeout.connect(self.reportMemory)
+        self.canvas.viewChanged.connect(self.checkResolution)
+
+        # adjustments never touch pixmap_, what's shown is an adjusted copy of it
+        self.adjustments = Adjustments()
+        self.adjustmentSource = None
+        self.adjustmentsPanel = AdjustmentsPanel()
+        self.adjustmentsPanel.hide()
+        self.adjustmentsPanel.adjustmentsChanged.connect(self.previewAdjustments)
+        self.adjustmentsPanel.adjustmentsCommitted.connect(self.commitAdjustments)
+
+        mainHBox = QHBoxLayout(self)
+        mainHBox.setContentsMargins(0, 0, 0, 0)
+        mainHBox.addWidget(self.canvas)
+        mainHBox.addWidget(self.adjustmentsPanel)
+
+        # really big images skip the pixmap entirely and get drawn a tile at a time
+        self.tileCache = TileCache()
+        self.tileSource = None
+
+        self.setFocusPolicy(Qt.StrongFocus)
+
+        # images are decoded off the GUI thread, only the QImage -> QPixmap conversion happens here
+        self.loader = ImageLoader(self)
+        self.loader.previewLoaded.connect(self.onPreviewLoaded)
+        self.loader.imageLoaded.connect(self.onImageLoaded)
+        self.loader.loadFailed.connect(self.onLoadFailed)
+        self.loader.imageTooLarge.connect(self.onImageTooLarge)
+        self.loadRequest = None
+
+        # folder mode: the current image's neighbours get decoded in the background
+        self.folderModel = FolderModel(self)
+        self.folderModel.currentChanged.connect(lambda index, path: self.showPath(path))
+        self.folderModel.countChanged.connect(lambda count: self.prefetchNeighbours())
+        self.folderModel.filesChanged.connect(self.onFilesChanged)
+        self.prefetchCache = PrefetchCache(parent=self)
+        self.prefetchCache.imageReady.connect(self.onPrefetched)
+        self.prefetchCache.prefetchFailed.connect(self.onPrefetchFailed)
+        self.waitingForPrefetch = False
+
+        # F5: steps through the folder on a timer, with each next image decoded and scaled before it's due
+        self.slideshow = SlideshowScheduler(self.folderModel, self.prefetchCache, self)
+
+        # animated images get their frames decoded as they play, the first frame is shown like any other image
+        self.animationPlayer = AnimationPlayer(self)
+        self.animationPlayer.frameReady.connect(self.showFrame)
+
+        # the memory manager makes this tab let go of its full resolution data while it's in the background
+        self.memoryManager = getMemoryManager()
+        self.memoryKey = f"viewer-{id(self)}"
+        self.memoryManager.register(self.memoryKey, "Image Viewer", self.releaseMemory)
+        self.destroyed.connect(lambda *args, manager=self.memoryManager, key=self.memoryKey:
+                               manager.unregister(key) if not sip.isdeleted(manager) else None)
+        self.prefetchCache.imageReady.connect(lambda path: self.reportMemory())
+        self.released = False
+
+        # F12: what decoding, scaling and the caches have been up to lately
+        self.metricsOverlay = MetricsOverlay(self.memoryKey, self.canvas)
+
+        if os.path.isfile("./assets/img/banner.png"):
+            self.openImage("./assets/img/banner.png")
+
+    def openImage(self, path):
+        """Starts decoding path in the background. Whatever was being loaded before gets cancelled."""
+        self.cancelLoad()
+
+        self.imagePath = path
+        if self.pixmap_.isNull():
+            self.canvas.setMessage(f"Loading {os.path.basename(path)}...")
+
+        self.loadRequest = self.loader.load(path, previewSize=self.size(), maxPixels=TILED_MIN_PIXELS,
+                                            displaySize=self.canvas.size())
+
+    def cancelLoad(self):
+        if self.loadRequest is not None:
+            self.loader.cancel(self.loadRequest)
+            self.loadRequest = None
+        self.waitingForPrefetch = False
+
+    def openFolder(self, folder, startPath=None, startImage=None):
+        """Opens folder for browsing, starting at startPath (or the first image once the scan finds one).
+        startImage can be an already decoded QImage of startPath."""
+        self.prefetchCache.clear()
+        if startPath is not None and startImage is not None:
+            self.prefetchCache.insert(os.path.abspath(startPath), startImage)
+
+        self.folderModel.open(folder, startPath)
+
+    def showPath(self, path):
+        """Shows path, straight from the prefetch cache if it's already there."""
+        prepared = self.slideshow.takePrepared(path)
+        image = self.prefetchCache.get(path)
+        recordHit("prefetchHit", prepared is not None or image is not None)
+        if prepared is not None:
+            # the slideshow already made the pixmap and its screen sized copy
+            pixmap, scaledCache, imageSize = prepared
+            self.cancelLoad()
+            self.imagePath = path
+            self.setPixmap(pixmap, path, scaledCache, imageSize)
+        elif image is not None:
+            self.cancelLoad()
+            self.imagePath = path
+            self.setPixmap(QPixmap.fromImage(image), path, imageSize=fullImageSize(image))
+        elif self.prefetchCache.isLoading(path):
+            # no point decoding it twice, just wait for the prefetch to land
+            self.cancelLoad()
+            self.imagePath = path
+            self.waitingForPrefetch = True
+        else:
+            self.openImage(path)
+
+        self.prefetchNeighbours()
+
+    def prefetchNeighbours(self):
+        # the slideshow only ever goes forward, and decides itself when it needs what
+        if self.slideshow.isRunning():
+            self.slideshow.preload()
+            return
+
+        self.prefetchCache.prefetch(self.folderModel.neighbours(PREFETCH_RADIUS))
+
+    def onFilesChanged(self, added, removed, modified):
+        """Drops whatever was cached for files that changed on disk. Everything else stays."""
+        store = getThumbnailStore()
+        for path in removed + modified:
+            self.prefetchCache.invalidate(path)
+            store.invalidate(path)
+
+        if self.imagePath in modified:
+            self.openImage(self.imagePath)
+        elif self.imagePath in removed and self.folderModel.count() == 0:
+            self.cancelLoad()
+            self.imagePath = None
+            self.setPixmap(QPixmap())
+            self.canvas.setMessage("No images left in this folder")
+
+        self.prefetchNeighbours()
+
+    def showNext(self):
+        self.folderModel.next()
+
+    def showPrevious(self):
+        self.folderModel.previous()
+
+    def onPrefetched(self, path):
+        if self.waitingForPrefetch and path == self.imagePath:
+            self.waitingForPrefetch = False
+            image = self.prefetchCache.get(path)
+            self.setPixmap(QPixmap.fromImage(image), path, imageSize=fullImageSize(image))
+
+    def onPrefetchFailed(self, path):
+        # e.g. it turned out to need tiled mode, which the viewer has to set up itself
+        if self.waitingForPrefetch and path == self.imagePath:
+            self.openImage(path)
+
+    def setPixmap(self, pixmap, path=None, scaledCache=None, imageSize=None):
+        """Shows pixmap, the image at path. If that's already on screen (e.g. as a preview), the zoom and position stay.
+        scaledCache can be a ScaledPixmapCache that's already been made for pixmap, imageSize the size of the full
+        image if pixmap is a smaller copy of it."""
+        self.setTileSource(None)
+
+        keepView = path is not None and path == self.shownPath
+        if path != self.shownPath:
+            self.animationPlayer.stop()
+        self.shownPath = path
+
+        self.pixmap_ = pixmap
+        self.imageSize = QSize(imageSize) if imageSize is not None else pixmap.size()
+        self.released = False
+        self.updateDisplay(keepView, scaledCache=scaledCache)
+        self.reportMemory()
 
-        self.mainPixmapLabel = QLabel()
-        self.mainPixmapLabel.setAlignment(Qt.AlignCenter)
-        self.mainPixmapLabel.setPixmap(self.pixmap_)
-        self.mainPixmapLabel.setMinimumSize(1, 1)
+        if path is not None:
+            self.slideshow.slideShown()
 
-        mainVBox = QVBoxLayout(self)
-        mainVBox.setContentsMargins(0, 0, 0, 0)
-        mainVBox.addWidget(self.mainPixmapLabel)
+        if path is not None and not self.animationPlayer.isPlaying() and isAnimated(path):
+            self.animationPlayer.play(path)
+
+    def showFrame(self, image):
+        """Swaps in the next frame of the animation that's playing, keeping the view as it is."""
+        self.pixmap_ = QPixmap.fromImage(image)
+        self.updateDisplay()
+
+    def updateDisplay(self, keepView=True, imageSize=None, scaledCache=None):
+        """Hands pixmap_ to the canvas, with the adjustments applied. scaledCache is reused if there are none."""
+        pixmap = self.pixmap_
+        if not self.adjustments.isIdentity() and not pixmap.isNull():
+            pixmap = QPixmap.fromImage(applyAdjustments(pixmap.toImage(), self.adjustments))
+            scaledCache = None
+
+        self.scaledCache = scaledCache if scaledCache is not None else ScaledPixmapCache(pixmap)
+        self.adjustmentSource = None
+        self.canvas.setPixmapCache(self.scaledCache, imageSize if imageSize is not None else self.imageSize, keepView=keepView)
+
+        if self.adjustmentsPanel.isVisible():
+            self.updateHistogram()
+
+    def checkResolution(self):
+        """Decodes the whole image once the view is zoomed in past what was decoded for the canvas."""
+        if (self.pixmap_.isNull() or self.released or self.loadRequest is not None or self.imagePath != self.shownPath
+                or self.pixmap_.width() >= self.imageSize.width()):
+            return
+
+        if self.canvas.zoom * self.imageSize.width() > self.pixmap_.width() * FULL_RESOLUTION_SLACK:
+            self.loadRequest = self.loader.load(self.imagePath, maxPixels=TILED_MIN_PIXELS)
+
+    def previewAdjustments(self):
+        """Shows the panel's adjustments on a screen sized copy, which is quick enough to redo on every slider move."""
+        self.adjustments = self.adjustmentsPanel.adjustments()
+        if self.pixmap_.isNull():
+            return
+
+        if self.adjustmentSource is None:
+            self.adjustmentSource = self.pixmap_.scaled(self.canvas.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation).toImage()
+
+        image = applyAdjustments(self.adjustmentSource, self.adjustments)
+        self.canvas.setPixmapCache(ScaledPixmapCache(QPixmap.fromImage(image)), self.imageSize, keepView=True)
+        self.adjustmentsPanel.histogram.setHistogram(histogram(image))
+
+    def commitAdjustments(self):
+        """Applies the panel's adjustments to the full image."""
+        self.adjustments = self.adjustmentsPanel.adjustments()
+        if not self.pixmap_.isNull():
+            self.updateDisplay()
+            self.reportMemory()
+
+    def updateHistogram(self):
+        self.adjustmentsPanel.histogram.setHistogram(histogram(self.scaledCache.source.toImage()))
+
+    def toggleAdjustments(self):
+        self.adjustmentsPanel.setVisible(not self.adjustmentsPanel.isVisible())
+        if self.adjustmentsPanel.isVisible():
+            self.updateHistogram()
+
+    def setTileSource(self, source):
+        """Switches to tiled mode for source, or back to the normal pixmap mode if source is None."""
+        if self.tileSource is not None:
+            self.canvas.setTileSource(None)
+            self.tileSource.deleteLater()
+
+        self.tileSource = source
+        if source is not None:
+            source.tileReady.connect(lambda *args: self.reportMemory())
+            self.canvas.setTileSource(source)
+
+    def onImageTooLarge(self, requestId, path, size):
+        if requestId == self.loadRequest:
+            self.loadRequest = None
+            self.setPixmap(QPixmap())
+            self.setTileSource(TileSource(path, self.tileCache))
+            # setPixmap() only restarts the slideshow's interval for images with a path
+            self.slideshow.slideShown()
+
+    def onPreviewLoaded(self, requestId, path, image):
+        if requestId == self.loadRequest:
+            self.setPixmap(QPixmap.fromImage(image), path, imageSize=fullImageSize(image))
+
+    def onImageLoaded(self, requestId, path, image):
+        if requestId == self.loadRequest:
+            self.loadRequest = None
+            self.setPixmap(QPixmap.fromImage(image), path, imageSize=fullImageSize(image))
+
+            # so that stepping back to it later is instant too. If the cache already has the canvas sized
+            # decode (this was a zoom in), that one stays, it's what stepping back would show anyway
+            if self.folderModel.folder is not None and self.prefetchCache.get(path) is None:
+                self.prefetchCache.insert(path, image)
+
+    def onLoadFailed(self, requestId, path, error):
+        if requestId == self.loadRequest:
+            self.loadRequest = None
+            self.setPixmap(QPixmap())
+            self.canvas.setMessage(f"Could not open {os.path.basename(path)}\n{error}")
+            # the error stays up for one interval, then the slideshow moves on past it
+            self.slideshow.slideShown()
+
+    def memoryUsage(self):
+        # the unadjusted original, if what's shown is an adjusted copy of it
+        originalBytes = pixmapBytes(self.pixmap_) if self.scaledCache.source is not self.pixmap_ else 0
+        sourceBytes = self.tileSource.usedBytes() if self.tileSource is not None else 0
+        return (self.scaledCache.totalBytes() + originalBytes + self.prefetchCache.usedBytes + self.tileCache.usedBytes
+                + sourceBytes + self.animationPlayer.bufferedBytes())
+
+    def reportMemory(self):
+        label = os.path.basename(self.imagePath) if self.imagePath else "Image Viewer"
+        self.memoryManager.update(self.memoryKey, self.memoryUsage(), label)
+
+    def releaseMemory(self):
+        """Drops everything that can be decoded again later. A screen sized copy of the image is kept,
+        so there's something to show straight away when the tab comes back."""
+        if not self.scaledCache.isNull() and not self.released:
+            original = self.scaledCache if self.scaledCache.source is self.pixmap_ else ScaledPixmapCache(self.pixmap_)
+            preview = original.scaled(self.size(), True)
+            if preview.width() < self.pixmap_.width():
+                self.pixmap_ = preview
+                # still measured in the full image's pixels, so the view doesn't budge
+                self.updateDisplay(imageSize=self.canvas.imageSize)
+                self.released = True
+
+        # it starts over once the tab gets reloaded
+        if self.animationPlayer.isPlaying():
+            self.animationPlayer.stop()
+            self.released = True
+
+        self.prefetchCache.clear()
+        self.tileCache.clear()
+        self.reportMemory()
+
+    def showEvent(self, event):
+        self.memoryManager.setActive(self.memoryKey, True)
+        self.animationPlayer.setPaused(False)
+
+        if self.released and self.imagePath is not None:
+            self.openImage(self.imagePath)
+        if self.folderModel.folder is not None:
+            self.prefetchNeighbours()
+
+    def hideEvent(self, event):
+        self.memoryManager.setActive(self.memoryKey, False)
+        # showEvent gets the neighbours going again
+        self.slideshow.stop()
+        # nobody's watching
+        self.animationPlayer.setPaused(True)
 
     def resizeEvent(self, event):
-        self.pixmap = self.pixmap_.scaled(self.geometry().width(), self.geometry().height(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        self.mainPixmapLabel.setPixmap(self.pixmap)
+        super().resizeEvent(event)
+        self.slideshow.setTargetSize(self.canvas.size())
+        self.prefetchCache.setDisplaySize(self.canvas.size())
+
+    def toggleSlideshow(self):
+        if self.slideshow.isRunning():
+            self.stopSlideshow()
+        elif self.folderModel.count() > 1:
+            self.canvas.fitToWindow()
+            self.slideshow.start(self.canvas.size())
+
+    def stopSlideshow(self):
+        if self.slideshow.isRunning():
+            self.slideshow.stop()
+            # back to decoding both sides of the current image
+            self.prefetchNeighbours()
+
+    def contextMenuEvent(self, event):
+        if self.folderModel.folder is None:
+            return
+
+        menu = QMenu(self)
+
+        slideshowMenu = menu.addMenu("Slideshow")
+        slideshowMenu.addAction("Stop" if self.slideshow.isRunning() else "Start", self.toggleSlideshow)
+        slideshowMenu.addSeparator()
+        intervalGroup = QActionGroup(slideshowMenu)
+        for interval in SLIDESHOW_INTERVALS:
+            action = slideshowMenu.addAction(f"Every {interval // 1000} seconds")
+            action.setCheckable(True)
+            action.setChecked(interval == self.slideshow.interval)
+            action.setActionGroup(intervalGroup)
+            action.triggered.connect(lambda checked, interval=interval: self.slideshow.setInterval(interval))
+
+        sortMenu = menu.addMenu("Sort by")
+        sortGroup = QActionGroup(sortMenu)
+        for sortOrder, name in SORT_ORDER_NAMES:
+            action = sortMenu.addAction(name)
+            action.setCheckable(True)
+            action.setChecked(sortOrder == self.folderModel.sortOrder)
+            action.setActionGroup(sortGroup)
+            action.triggered.connect(lambda checked, sortOrder=sortOrder:
+                                     self.folderModel.setSortOrder(sortOrder, self.folderModel.descending))
+        sortMenu.addSeparator()
+        descendingAction = sortMenu.addAction("Descending")
+        descendingAction.setCheckable(True)
+        descendingAction.setChecked(self.folderModel.descending)
+        descendingAction.toggled.connect(lambda checked: self.folderModel.setSortOrder(self.folderModel.sortOrder, checked))
+
+        # the cameras come from whatever has been indexed so far
+        cameraMenu = menu.addMenu("Only show camera")
+        cameraMenu.addAction("All images", lambda: self.folderModel.setFilter(None))
+        cameraMenu.addSeparator()
+        for camera in self.folderModel.cameras():
+            cameraMenu.addAction(camera, lambda camera=camera: self.folderModel.setFilter(
+                lambda record: record is not None and cameraName(record) == camera))
+
+        menu.exec_(event.globalPos())
+
+    def exportMetrics(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export metrics", "metrics.jsonl", "JSON lines (*.jsonl)")
+        if path:
+            try:
+                count = getMetrics().exportJsonLines(path)
+            except OSError as e:
+                print(f'[!] Could not export the metrics to "{path}": {e}')
+            else:
+                print(f'Exported {count} samples to "{path}"')
+
+    def keyPressEvent(self, event):
+        if event.key() in (Qt.Key_Right, Qt.Key_PageDown, Qt.Key_Space):
+            self.showNext()
+        elif event.key() in (Qt.Key_Left, Qt.Key_PageUp, Qt.Key_Backspace):
+            self.showPrevious()
+        elif event.key() == Qt.Key_Home:
+            self.folderModel.first()
+        elif event.key() == Qt.Key_End:
+            self.folderModel.last()
+        elif event.key() == Qt.Key_A:
+            self.toggleAdjustments()
+        elif event.key() == Qt.Key_P:
+            self.animationPlayer.setPaused(not self.animationPlayer.paused)
+        elif event.key() in (Qt.Key_Plus, Qt.Key_Equal):
+            self.canvas.zoomBy(KEY_ZOOM_STEP)
+        elif event.key() == Qt.Key_Minus:
+            self.canvas.zoomBy(1 / KEY_ZOOM_STEP)
+        elif event.key() in (Qt.Key_0, Qt.Key_F):
+            self.canvas.fitToWindow()
+        elif event.key() == Qt.Key_1:
+            self.canvas.actualSize()
+        elif event.key() == Qt.Key_W:
+            self.canvas.fillWindow()
+        elif event.key() == Qt.Key_F5:
+            self.toggleSlideshow()
+        elif event.key() == Qt.Key_Escape and self.slideshow.isRunning():
+            self.stopSlideshow()
+        elif event.key() == Qt.Key_F12 and event.modifiers() & Qt.ShiftModifier:
+            self.exportMetrics()
+        elif event.key() == Qt.Key_F12:
+            self.metricsOverlay.toggle()
+        else:
+            super().keyPressEvent(event)
@@ -21,10 +21,12 @@
 # =====================================================
 
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QPixmap
+from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (QLabel, QSizePolicy, QSpacerItem, QVBoxLayout,
                              QWidget)
 
+from lib.assets import getPixmap
+
 
 class WelcomeWidget(QWidget):
     def __init__(self, themeLoaderObject):
@@ -32,7 +34,7 @@ class WelcomeWidget(QWidget):
 
         # main widgets and layouts
         self.background = QLabel(self)
-        self.background.setPixmap(QPixmap("./assets/img/pcbg_alpha.png"))
+        self.background.setPixmap(getPixmap("./assets/img/pcbg_alpha.png"))
         self.background.setAlignment(Qt.AlignBottom | Qt.AlignRight)
 
         titleFont = QFont("Selawik", 28)
@@ -51,10 +53,18 @@ class WelcomeWidget(QWidget):
         self.openImageLink.setFont(labelFont)
         self.openImageLink.setMinimumSize(1, 1)
 
-        self.openFolderLink = QLabel('<a href="https://">Open an folder</a>')
+        self.openFolderLink = QLabel('<a href="https://">Open a folder</a>')
         self.openFolderLink.setFont(labelFont)
         self.openFolderLink.setMinimumSize(1, 1)
 
+        self.duplicatesLink = QLabel('<a href="https://">Find duplicate images</a>')
+        self.duplicatesLink.setFont(labelFont)
+        self.duplicatesLink.setMinimumSize(1, 1)
+
+        self.compareLink = QLabel('<a href="https://">Compare images side by side</a>')
+        self.compareLink.setFont(labelFont)
+        self.compareLink.setMinimumSize(1, 1)
+
         self.settingsLink = QLabel('<a href="https://">Open the settings</a>')
         self.settingsLink.setFont(labelFont)
         self.settingsLink.setMinimumSize(1, 1)
@@ -67,6 +77,8 @@ class WelcomeWidget(QWidget):
         mainVBox.addSpacerItem(QSpacerItem(1, 20, QSizePolicy.Fixed))
         mainVBox.addWidget(self.openImageLink)
         mainVBox.addWidget(self.openFolderLink)
+        mainVBox.addWidget(self.duplicatesLink)
+        mainVBox.addWidget(self.compareLink)
         mainVBox.addWidget(self.settingsLink)
 
     def resizeEvent(self, event):
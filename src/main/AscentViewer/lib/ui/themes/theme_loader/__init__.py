@@ -22,67 +22,181 @@
 
 # TODO: maybe clean up the code a bit
 
-import jstyleson
+import hashlib
+import json
 import os
+import time
 from glob import glob
 from pprint import pprint
 
 from PyQt5.QtGui import QColor, QPalette
 
+from lib.metrics import recordHit, recordMetric
+from lib.paths import getCacheDir
+
+# bump this whenever the layout of the compiled theme files changes
+COMPILED_THEME_VERSION = 1
+
 class ThemeLoader:
-    def __init__(self, themeLocation):
-        """Init function. Sets up the themes located in themeLocation."""
+    def __init__(self, themeLocation, cacheLocation=None):
+        """Init function. Sets up the themes located in themeLocation.
 
+        Every theme is compiled (manifest, palette and stylesheet all parsed and put into a single plain JSON file)
+        into cacheLocation, and only gets recompiled when one of its source files changes."""
+
+        start = time.perf_counter()
         self.validThemes = []
+        self.themesByName = {}
+        self.cacheLocation = cacheLocation if cacheLocation is not None else getCacheDir("themes")
 
         self.globThing = glob(os.path.join(themeLocation, "*", ""))
 
         for x in self.globThing:
-            if os.path.isfile(x + "manifest.json"):
-                with open(x + "manifest.json", "r", encoding="utf-8") as f:
-                    manifest = jstyleson.load(f)
+            theme = self.loadTheme(x)
+            if theme is not None:
+                self.validThemes.append(theme)
+                self.themesByName[theme["name"]] = theme
+        recordMetric("themeScanMs", (time.perf_counter() - start) * 1000)
+
+        # what's actually on the QApplication right now, so switching themes can skip whatever didn't change
+        self.currentTheme = None
+        self.currentAccentColor = None
+        self.appliedStyle = None
+        self.appliedStyleSheet = None
+
+    def loadTheme(self, themePath):
+        """Returns the compiled theme in themePath (compiling it first if the cached one is missing or stale),
+        or None if it isn't a valid theme."""
+        if not os.path.isfile(themePath + "manifest.json"):
+            return None
+
+        cachePath = os.path.join(self.cacheLocation, hashlib.sha1(os.path.abspath(themePath).encode("utf-8")).hexdigest() + ".json")
+        try:
+            with open(cachePath, "r", encoding="utf-8") as f:
+                theme = json.load(f)
+
+            if theme["version"] == COMPILED_THEME_VERSION and self.sourcesUnchanged(theme["sources"]):
+                theme["path"] = themePath
+                recordHit("themeCacheHit", True)
+                return theme
+        except (OSError, ValueError, KeyError):
+            pass
+
+        recordHit("themeCacheHit", False)
 
-                if os.path.isfile(x + manifest["themeData"]["paletteJSONPath"]) and os.path.isfile(x + manifest["themeData"]["styleSheetPath"]):
-                    self.validThemes.append({"name": manifest["commonMetadata"]["name"], "path": x, "manifest": manifest})
+        theme = self.compileTheme(themePath)
+        if theme is not None:
+            try:
+                # written next to the real file first, so a half written cache can never be read
+                with open(cachePath + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(theme, f)
+                os.replace(cachePath + ".tmp", cachePath)
+            except OSError as e:
+                print(f"[!] Could not write the compiled theme cache: {e}")
+
+        return theme
+
+    def sourcesUnchanged(self, sources):
+        try:
+            return all(os.stat(path).st_mtime_ns == mtime for path, mtime in sources.items())
+        except OSError:
+            return False
+
+    def compileTheme(self, themePath):
+        """Parses a theme's source files. This is the only place that needs the (slow, comment stripping) JSON parser."""
+        import jstyleson
+
+        manifestPath = themePath + "manifest.json"
+        with open(manifestPath, "r", encoding="utf-8") as f:
+            manifest = jstyleson.load(f)
+
+        palettePath = themePath + manifest["themeData"]["paletteJSONPath"]
+        styleSheetPath = themePath + manifest["themeData"]["styleSheetPath"]
+        if not (os.path.isfile(palettePath) and os.path.isfile(styleSheetPath)):
+            return None
+
+        with open(palettePath, "r", encoding="utf-8") as f:
+            paletteJSON = jstyleson.load(f)
+        with open(styleSheetPath, "r", encoding="utf-8") as f:
+            styleSheet = f.read()
+
+        return {
+            "version": COMPILED_THEME_VERSION,
+            "name": manifest["commonMetadata"]["name"],
+            "path": themePath,
+            "manifest": manifest,
+            "palette": paletteJSON["palette"],
+            "styleSheet": styleSheet,
+            "sources": {path: os.stat(path).st_mtime_ns for path in (manifestPath, palettePath, styleSheetPath)}
+        }
+
+    def themeNames(self):
+        return [theme["name"] for theme in self.validThemes]
+
+    def buildPalette(self, themeDict, accentColor):
+        paletteJSON = {"palette": themeDict["palette"]}
+
+        palette = QPalette()
+        palette.setColor(QPalette.Window, QColor(paletteJSON["palette"]["Window"]))
+        palette.setColor(QPalette.WindowText, QColor(paletteJSON["palette"]["WindowText"]))
+        palette.setColor(QPalette.Base, QColor(paletteJSON["palette"]["Base"]))
+        palette.setColor(QPalette.AlternateBase, QColor(paletteJSON["palette"]["AlternateBase"]))
+        palette.setColor(QPalette.ToolTipBase, QColor(paletteJSON["palette"]["ToolTipBase"]))
+        palette.setColor(QPalette.ToolTipText, QColor(paletteJSON["palette"]["ToolTipText"]))
+        palette.setColor(QPalette.Text, QColor(paletteJSON["palette"]["Text"]))
+        palette.setColor(QPalette.Button, QColor(paletteJSON["palette"]["Button"]))
+        palette.setColor(QPalette.ButtonText, QColor(paletteJSON["palette"]["ButtonText"]))
+        palette.setColor(QPalette.BrightText, QColor(paletteJSON["palette"]["BrightText"]))
+        palette.setColor(QPalette.HighlightedText, QColor(paletteJSON["palette"]["HighlightedText"]))
+
+        palette.setColor(QPalette.Link, QColor(accentColor))
+        palette.setColor(QPalette.Highlight, QColor(accentColor))
+
+        return palette
 
     def applyTheme(self, themeName, accentColor, QApplicationInstance):
         """The function that, as the name says, applies the theme (specified by themeName)"""
         print(f"The selected theme ({themeName}) ", end="")
         try:
-            themeDict = next(item for item in self.validThemes if item["name"] == themeName)
-            with open(themeDict["path"] + themeDict["manifest"]["themeData"]["paletteJSONPath"], "r", encoding="utf-8") as f:
-                paletteJSON = jstyleson.load(f)
-
-            QApplicationInstance.setStyle(themeDict["manifest"]["themeData"]["style"])
-            palette = QPalette()
-            palette.setColor(QPalette.Window, QColor(paletteJSON["palette"]["Window"]))
-            palette.setColor(QPalette.WindowText, QColor(paletteJSON["palette"]["WindowText"]))
-            palette.setColor(QPalette.Base, QColor(paletteJSON["palette"]["Base"]))
-            palette.setColor(QPalette.AlternateBase, QColor(paletteJSON["palette"]["AlternateBase"]))
-            palette.setColor(QPalette.ToolTipBase, QColor(paletteJSON["palette"]["ToolTipBase"]))
-            palette.setColor(QPalette.ToolTipText, QColor(paletteJSON["palette"]["ToolTipText"]))
-            palette.setColor(QPalette.Text, QColor(paletteJSON["palette"]["Text"]))
-            palette.setColor(QPalette.Button, QColor(paletteJSON["palette"]["Button"]))
-            palette.setColor(QPalette.ButtonText, QColor(paletteJSON["palette"]["ButtonText"]))
-            palette.setColor(QPalette.BrightText, QColor(paletteJSON["palette"]["BrightText"]))
-            palette.setColor(QPalette.HighlightedText, QColor(paletteJSON["palette"]["HighlightedText"]))
-
-            palette.setColor(QPalette.Link, QColor(accentColor))
-            palette.setColor(QPalette.Highlight, QColor(accentColor))
+            self.switchTheme(themeName, accentColor, QApplicationInstance)
+            print("has been applied.")
+        except:
+            print("could not be applied. Please check if the theme is valid.")
 
+    def switchTheme(self, themeName, accentColor, QApplicationInstance):
+        """Switches to a theme at runtime. Style, palette and stylesheet each only get set if they actually changed,
+        since every one of those makes Qt re-polish every widget. Returns whether anything was changed."""
+        start = time.perf_counter()
+        themeDict = self.themesByName[themeName]
+        changed = False
+
+        # setStyle also resets the palette, so a new style means a new palette no matter what
+        style = themeDict["manifest"]["themeData"]["style"]
+        styleChanged = style != self.appliedStyle
+        if styleChanged:
+            QApplicationInstance.setStyle(style)
+            self.appliedStyle = style
+            changed = True
+
+        palette = self.buildPalette(themeDict, accentColor)
+        if styleChanged or palette != QApplicationInstance.palette():
             QApplicationInstance.setPalette(palette)
+            changed = True
 
-            with open(themeDict["path"] + themeDict["manifest"]["themeData"]["styleSheetPath"], "r", encoding="utf-8") as f:
-                QApplicationInstance.setStyleSheet(f.read())
+        if themeDict["styleSheet"] != self.appliedStyleSheet:
+            QApplicationInstance.setStyleSheet(themeDict["styleSheet"])
+            self.appliedStyleSheet = themeDict["styleSheet"]
+            changed = True
 
-            print("has been applied.")
-        except:
-            print("could not be applied. Please check if the theme is valid.")
+        self.currentTheme = themeName
+        self.currentAccentColor = accentColor
+        recordMetric("themeApplyMs", (time.perf_counter() - start) * 1000, themeName)
+        return changed
 
     def printThemeMetadata(self, themeName):
         """The function prints out the theme's (specified by themeName) metadata."""
         try:
-            themeDict = next(item for item in self.validThemes if item["name"] == themeName)
+            themeDict = self.themesByName[themeName]
             print("Theme metadata\n=====================================================")
             print(f'Name: "{themeDict["manifest"]["commonMetadata"]["name"]}"')
             print(f'Description: "{themeDict["manifest"]["commonMetadata"]["description"]}"')
@@ -93,7 +207,7 @@ class ThemeLoader:
 
     def getThemeIconPackPath(self, themeName):
         try:
-            themeDict = next(item for item in self.validThemes if item["name"] == themeName)
+            themeDict = self.themesByName[themeName]
             return themeDict["manifest"]["themeData"]["imgPackPath"]
         except:
             pass
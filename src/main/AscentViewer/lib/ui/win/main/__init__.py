@@ -25,6 +25,9 @@ from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (QHBoxLayout, QMainWindow, QMenuBar, QPushButton, QTabWidget, QToolButton, QVBoxLayout,
                              QWidget)
 
+from lib.assets import getPixmap
+from lib.ui.tab_registry import TabRegistry
+
 
 class MainWindow(QMainWindow):
     def __init__(self, themeLoaderObject):
@@ -43,12 +46,15 @@ class MainWindow(QMainWindow):
         self.mainTabW = QTabWidget()
         self.mainTabW.setTabsClosable(True)
         self.mainTabW.setMovable(True)
+        self.tabRegistry = TabRegistry(self.mainTabW)
 
         self.mb = QMenuBar()
 
         self.fileMenu = self.mb.addMenu("&File")
         self.openImg = self.fileMenu.addAction("&Open image...")
-        self.openImg.setShortcut("Ctrl+Q")
+        self.openImg.setShortcut("Ctrl+O")
+        self.openFolder = self.fileMenu.addAction("Open &folder...")
+        self.openFolder.setShortcut("Ctrl+Shift+O")
         self.fileMenu.addSeparator()
         self.exit = self.fileMenu.addAction("Exit")
         self.exit.setShortcut("Ctrl+Q")
@@ -64,7 +70,7 @@ class MainWindow(QMainWindow):
         self.firstButton.setMenu(self.fileMenu)
 
         self.createNewTabButton = QPushButton()
-        self.createNewTabButton.setIcon(QIcon("./assets/img/dropdown_arrow.png"))
+        self.createNewTabButton.setIcon(QIcon(getPixmap("./assets/img/dropdown_arrow.png")))
         self.createNewTabButton.setFixedSize(20, 20)
 
         cornerWidget = QWidget()
@@ -83,7 +89,6 @@ class MainWindow(QMainWindow):
         self.setUpSignalsAndSlots()
 
     def setUpSignalsAndSlots(self):
-        self.mainTabW.tabCloseRequested.connect(lambda index: self.mainTabW.removeTab(index))
         self.createNewTabButton.clicked.connect(lambda: self.mainTabW.addTab(QWidget(), "New Tab"))
 
     #def crap(self, point):
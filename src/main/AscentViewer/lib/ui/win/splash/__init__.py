@@ -65,10 +65,10 @@ class Splash(QWidget):
         version.setFont(QFont("Selawik Light", 20))
         version.setStyleSheet("color: #8FBCBB;")
 
-        loadingLabel = QLabel("Loading...")
-        loadingLabel.setAlignment(Qt.AlignBottom)
-        loadingLabel.setFont(QFont("Segoe UI", 12))
-        loadingLabel.setFixedHeight(40)
+        self.loadingLabel = QLabel("Loading...")
+        self.loadingLabel.setAlignment(Qt.AlignBottom)
+        self.loadingLabel.setFont(QFont("Segoe UI", 12))
+        self.loadingLabel.setFixedHeight(40)
 
         self.progBar = QProgressBar()
         self.progBar.setValue(0)
@@ -88,7 +88,7 @@ class Splash(QWidget):
         bottom.setContentsMargins(0, 0, 0, 0)
         bottom.addWidget(topLabel)
         bottom.addWidget(version)
-        bottom.addWidget(loadingLabel)
+        bottom.addWidget(self.loadingLabel)
         bottom.addWidget(self.progBar)
 
         mainVBox.addLayout(top)
@@ -103,6 +103,10 @@ class Splash(QWidget):
         self.shortcut = QShortcut(QKeySequence("Ctrl+Q"), self)
         self.shortcut.activated.connect(quit)
 
+    def setProgress(self, percent, text):
+        self.progBar.setValue(percent)
+        self.loadingLabel.setText(text)
+
     # these three functions are from https://stackoverflow.com/questions/37718329/pyqt5-draggable-frameless-window
     def center(self):
         qr = self.frameGeometry()